@@ -1,25 +1,58 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, Response
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, Response, stream_with_context, make_response
 from flask_pymongo import PyMongo
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import json
+import base64
+import hashlib
 from werkzeug.utils import secure_filename
 import os
 from bson.objectid import ObjectId
-from io import BytesIO
-from reportlab.lib.pagesizes import letter, landscape
-from reportlab.pdfgen import canvas
+from pymongo import ReturnDocument
+from collections import OrderedDict
+import threading
+import time
+import click
+from io import BytesIO, StringIO
+import csv
+import tempfile
+import unicodedata
+from urllib.parse import quote
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
 from flask import send_file
 import uuid
+from report_jobs import ReportJobQueue
+from report_renderer import PdfTableRenderer
+from reservation_service import ReservationService, TransitionError, PENDING_STATUSES, ACTIVE_STATUSES, reservation_lines
+from availability_index import AvailabilityIndex, reservation_window
+from occupancy import occupancy_matrix, run_length_rows
+from car_import import CarImporter, ImportFileError, read_rows
+from db_indexes import ensure_indexes, explain_route_queries
+from password_hashing import PasswordHasher, HasherBusy
+from fragment_cache import FragmentCache
+from image_pipeline import (save_image_upload, store_existing_image, available_variants, is_content_addressed,
+                            backfill_image, orphaned_uploads, InvalidImage, UploadTooLarge,
+                            VARIANT_WIDTHS, THUMBNAIL_WIDTH)
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from request_metrics import RequestMetrics, MongoCommandListener
+from live_events import EventBroker, BrokerFull, RESYNC
+import hmac
+from markupsafe import Markup
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key'
 
 # MongoDB configuration
 app.config["MONGO_URI"] = os.environ.get("MONGO_URI", "mongodb://localhost:27017/voiture_de_location")
-mongo = PyMongo(app)
+app.config['REQUEST_LOG'] = os.environ.get('REQUEST_LOG', 'True').lower() == 'true'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')  # empty: /metrics is admin only
+# The listener is given to the client when it is created, so the metrics come first
+request_metrics = RequestMetrics(log_requests=app.config['REQUEST_LOG'])
+mongo = PyMongo(app, event_listeners=[MongoCommandListener(request_metrics)])
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -32,6 +65,102 @@ app.config['MYSQL_DB'] = 'inventory_db'
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB max upload size
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+app.config['CAR_CACHE_TTL'] = int(os.environ.get('CAR_CACHE_TTL', 300))  # seconds
+app.config['CAR_CACHE_MAX_ENTRIES'] = int(os.environ.get('CAR_CACHE_MAX_ENTRIES', 5000))
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))  # seconds
+app.config['USER_CACHE_MAX_ENTRIES'] = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+app.config['IMAGE_VARIANT_CACHE_TTL'] = int(os.environ.get('IMAGE_VARIANT_CACHE_TTL', 300))  # seconds
+app.config['IMAGE_VARIANT_CACHE_MAX_ENTRIES'] = int(os.environ.get('IMAGE_VARIANT_CACHE_MAX_ENTRIES', 10000))
+app.config['DATA_VERSION_TTL'] = float(os.environ.get('DATA_VERSION_TTL', 2))  # seconds
+app.config['APP_VERSION'] = os.environ.get('APP_VERSION', '1.0.0')
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+app.config['FRAGMENT_CACHE_DIR'] = os.environ.get('FRAGMENT_CACHE_DIR', '')  # empty: memory only
+app.config['FRAGMENT_CACHE_MAX_DISK_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_DISK_BYTES', 256 * 1024 * 1024))
+app.config['REPORT_OUTPUT_DIR'] = os.environ.get('REPORT_OUTPUT_DIR', os.path.join(app.instance_path, 'reports'))
+app.config['REPORT_WORKERS'] = int(os.environ.get('REPORT_WORKERS', 2))
+app.config['REPORT_JOB_TIMEOUT'] = int(os.environ.get('REPORT_JOB_TIMEOUT', 600))  # seconds
+app.config['ENSURE_INDEXES'] = os.environ.get('ENSURE_INDEXES', 'True').lower() == 'true'
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+# Per worker; keep it below the worker's thread count (32 in the Procfile) so pages still get served
+app.config['LIVE_EVENTS_MAX_STREAMS'] = int(os.environ.get('LIVE_EVENTS_MAX_STREAMS', 16))
+app.config['LIVE_EVENTS_QUEUE_SIZE'] = int(os.environ.get('LIVE_EVENTS_QUEUE_SIZE', 256))
+app.config['LIVE_EVENTS_HEARTBEAT'] = float(os.environ.get('LIVE_EVENTS_HEARTBEAT', 15))  # seconds
+app.config['LOGIN_HASH_WORKERS'] = int(os.environ.get('LOGIN_HASH_WORKERS', 2))
+app.config['LOGIN_HASH_MAX_PENDING'] = int(os.environ.get('LOGIN_HASH_MAX_PENDING', 8))
+app.config['LOGIN_HASH_TIMEOUT'] = int(os.environ.get('LOGIN_HASH_TIMEOUT', 10))  # seconds
+
+report_jobs = ReportJobQueue(
+    mongo.db.report_jobs, app.config['REPORT_OUTPUT_DIR'],
+    max_workers=app.config['REPORT_WORKERS'], timeout=app.config['REPORT_JOB_TIMEOUT']
+)
+password_hasher = PasswordHasher(
+    rounds=app.config['BCRYPT_LOG_ROUNDS'],
+    max_workers=app.config['LOGIN_HASH_WORKERS'],
+    max_pending=app.config['LOGIN_HASH_MAX_PENDING'],
+    timeout=app.config['LOGIN_HASH_TIMEOUT']
+)
+
+# Declare the indexes the routes rely on (a no-op when they already exist)
+if app.config['ENSURE_INDEXES']:
+    try:
+        ensure_indexes(mongo.db)
+    except Exception as e:
+        print(f"Warning: index bootstrap skipped: {e}")
+
+# Bounded process-local cache: least recently used entries are evicted first and every
+# entry expires after ttl seconds
+class LRUCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, now):
+        # Caller holds the lock; returns (found, value)
+        entry = self._entries.get(key)
+        if entry and entry[0] > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+        self.misses += 1
+        return False, None
+
+    def _store(self, key, value, expires_at):
+        # Caller holds the lock
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            return self._lookup(key, time.monotonic())
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value, time.monotonic() + self.ttl)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
 
 # User Loader
 class User(UserMixin):
@@ -40,11 +169,23 @@ class User(UserMixin):
         self.username = username
         self.role = role
 
+# Process-local cache of user id -> (username, role), or None for an unknown id
+# edit_staff/delete_staff invalidate explicitly; other workers pick changes up after USER_CACHE_TTL
+user_cache = LRUCache(app.config['USER_CACHE_MAX_ENTRIES'], app.config['USER_CACHE_TTL'])
+
 @login_manager.user_loader
 def load_user(user_id):
-    user = mongo.db.users.find_one({'_id': ObjectId(user_id)})
-    if user:
-        return User(str(user['_id']), user['username'], user['role'])
+    found, cached = user_cache.get(user_id)
+    if not found:
+        try:
+            user = mongo.db.users.find_one({'_id': ObjectId(user_id)}, {'username': 1, 'role': 1})
+        except Exception:
+            user = None
+        cached = (user['username'], user['role']) if user else None
+        user_cache.set(user_id, cached)
+    if cached:
+        # A fresh User per request; cached entries are never handed out for mutation
+        return User(user_id, *cached)
     return None
 
 # Helper function to get database cursor
@@ -60,6 +201,601 @@ def format_datetime(dt):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Helper functions for car images
+# Uploads are stored under the sha256 of their content, with WebP variants and a thumbnail (see image_pipeline)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def store_uploaded_image(image_file):
+    """Save an uploaded image and its derivatives; return the stored file name"""
+    filename = secure_filename(image_file.filename)
+    stored_name = save_image_upload(image_file.stream, app.config['UPLOAD_FOLDER'], filename, app.config['MAX_CONTENT_LENGTH'])
+    image_variant_cache.invalidate(stored_name)
+    return stored_name
+
+# The variants on disk of each image, so that rendering a page does not stat them for every car.
+# Derivatives written by backfill-images in another process show up once the entry expires.
+image_variant_cache = LRUCache(app.config['IMAGE_VARIANT_CACHE_MAX_ENTRIES'], app.config['IMAGE_VARIANT_CACHE_TTL'])
+
+def image_variants(image):
+    """available_variants() of an uploaded image, from the image variant cache"""
+    found, variants = image_variant_cache.get(image)
+    if not found:
+        variants = available_variants(app.config['UPLOAD_FOLDER'], image)
+        image_variant_cache.set(image, variants)
+    return variants
+
+@app.after_request
+def cache_content_addressed_uploads(response):
+    # A content-addressed file never changes under its name, so browsers and proxies may keep it forever
+    if request.endpoint == 'static' and response.status_code in (200, 206, 304):
+        filename = (request.view_args or {}).get('filename', '')
+        if filename.startswith('uploads/') and is_content_addressed(filename[len('uploads/'):]):
+            response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return response
+
+def upload_url(path):
+    return url_for('static', filename='uploads/' + path)
+
+@app.template_global()
+def image_src(image):
+    """URL of the thumbnail of an uploaded image, or of the original when it has none"""
+    if not image:
+        return None
+    thumb = image_variants(image)[1]
+    return upload_url(thumb or image)
+
+@app.template_global()
+def image_srcset(image):
+    """srcset attribute value listing the WebP variants of an uploaded image"""
+    if not image:
+        return ''
+    variants = image_variants(image)[0]
+    return ', '.join(f'{upload_url(path)} {width}w' for width, path in variants)
+
+# Helper functions to resolve the cars referenced by rental requests
+# All referenced ids are fetched with a single $in query instead of one find_one per line item
+CAR_LOOKUP_PROJECTION = {'_id': 0, 'id': 1, 'designation': 1, 'category': 1}
+
+def collect_item_ids(reservations):
+    item_ids = set()
+    for reservation in reservations:
+        items = reservation.get('items')
+        if items and isinstance(items, list):
+            # Multi-item request
+            for item_data in items:
+                if isinstance(item_data, dict) and item_data.get('item_id'):
+                    item_ids.add(item_data['item_id'])
+        elif reservation.get('item_id'):
+            # Single-item request (legacy)
+            item_ids.add(reservation['item_id'])
+    return item_ids
+
+def get_cars_map(item_ids, projection=CAR_LOOKUP_PROJECTION):
+    """Return {car id: car document} for the given ids using one query"""
+    item_ids = [item_id for item_id in item_ids if item_id]
+    if not item_ids:
+        return {}
+    return {car.get('id'): car for car in mongo.db.cars.find({'id': {'$in': item_ids}}, projection)}
+
+# Process-local cache of car id -> {designation, category}
+# Entries expire after CAR_CACHE_TTL seconds so other workers pick up renames; writes in this
+# process invalidate explicitly through insert_car/update_car/remove_car
+class CarLookupCache(LRUCache):
+    def get_many(self, item_ids):
+        """Return {car id: {designation, category}} for the given ids, querying only the misses"""
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for item_id in set(item_ids):
+                if not item_id:
+                    continue
+                hit, car = self._lookup(item_id, now)
+                if not hit:
+                    missing.append(item_id)
+                elif car is not None:
+                    found[item_id] = car
+
+        if missing:
+            fetched = get_cars_map(missing)
+            expires_at = time.monotonic() + self.ttl
+            with self._lock:
+                for item_id in missing:
+                    # Unknown ids are cached as None so they do not hit the database on every request
+                    car = fetched.get(item_id)
+                    self._store(item_id, car, expires_at)
+                    if car is not None:
+                        found[item_id] = car
+        return found
+
+car_lookup_cache = CarLookupCache(app.config['CAR_CACHE_MAX_ENTRIES'], app.config['CAR_CACHE_TTL'])
+
+# Rendered catalog cards and inventory rows, keyed by car id and updated_at (every car write sets it)
+fragment_cache = FragmentCache(
+    app.config['FRAGMENT_CACHE_MAX_BYTES'],
+    spill_dir=app.config['FRAGMENT_CACHE_DIR'] or None,
+    max_disk_bytes=app.config['FRAGMENT_CACHE_MAX_DISK_BYTES']
+)
+
+def render_fragment(template, item, variant=''):
+    """Return the rendered partial for a car from the fragment cache"""
+    # The variants on disk are part of the key so that images resized after the last car write show up
+    variants = tuple(width for width, _ in image_variants(item['image'])[0]) if item.get('image') else ()
+    key = (app.config['APP_VERSION'], template, item.get('id'), item.get('updated_at'), variant, variants)
+    return Markup(fragment_cache.get_or_render(key, lambda: render_template(template, item=item)))
+
+def resolve_reservation_cars(reservations):
+    """Return {car id: {designation, category}} for every car referenced by the given reservations"""
+    return car_lookup_cache.get_many(collect_item_ids(reservations))
+
+# Helper functions to compute fleet counters
+# The counters live in a single fleet_stats summary document kept up to date with $inc deltas
+# by every car write; the $facet aggregation below is only used to build or reconcile it
+FLEET_SUMMARY_ID = 'fleet'
+FLEET_STATUS_KEYS = {
+    'Disponible': 'available',
+    'Indisponible': 'unavailable',
+    'Nécessite une réparation': 'repair'
+}
+FLEET_CONDITION_KEYS = {
+    'Bon état': 'bon_etat',
+    'Mauvais état': 'mauvais_etat',
+    'Nécessite une réparation': 'condition_repair'
+}
+FLEET_QUANTITY_FIELDS = ['quantite_totale', 'quantite_disponible', 'quantite_cassée', 'quantite_en_réparation']
+FLEET_TRACKED_PROJECTION = dict({'_id': 0, 'status': 1, 'condition': 1}, **{field: 1 for field in FLEET_QUANTITY_FIELDS})
+
+def _summary_key(value):
+    # Field names in the summary document cannot contain dots or start with '$'
+    return str(value).replace('.', '_').lstrip('$')
+
+def compute_fleet_summary():
+    """Build the fleet summary document from scratch with one aggregation"""
+    pipeline = [{'$facet': {
+        'status': [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}],
+        'condition': [{'$group': {'_id': '$condition', 'count': {'$sum': 1}}}],
+        'quantities': [{'$group': dict({'_id': None}, **{field: {'$sum': f'${field}'} for field in FLEET_QUANTITY_FIELDS})}]
+    }}]
+    facets = next(mongo.db.cars.aggregate(pipeline), None) or {'status': [], 'condition': [], 'quantities': []}
+
+    summary = {'_id': FLEET_SUMMARY_ID, 'total': 0, 'status': {}, 'condition': {}, 'quantities': {}}
+    for bucket in facets['status']:
+        summary['total'] += bucket['count']
+        if bucket['_id']:
+            summary['status'][_summary_key(bucket['_id'])] = bucket['count']
+    for bucket in facets['condition']:
+        if bucket['_id']:
+            summary['condition'][_summary_key(bucket['_id'])] = bucket['count']
+    totals = facets['quantities'][0] if facets['quantities'] else {}
+    for field in FLEET_QUANTITY_FIELDS:
+        summary['quantities'][field] = totals.get(field, 0)
+    return summary
+
+def fleet_summary_delta(before, after):
+    """Return the $inc document turning the summary for `before` into the summary for `after`"""
+    inc = {}
+    for doc, sign in ((before, -1), (after, 1)):
+        if not doc:
+            continue
+        inc['total'] = inc.get('total', 0) + sign
+        for group in ('status', 'condition'):
+            if doc.get(group):
+                key = f'{group}.{_summary_key(doc[group])}'
+                inc[key] = inc.get(key, 0) + sign
+        for field in FLEET_QUANTITY_FIELDS:
+            key = f'quantities.{field}'
+            inc[key] = inc.get(key, 0) + sign * (doc.get(field) or 0)
+    return {key: value for key, value in inc.items() if value}
+
+def record_fleet_change(before, after, db_session=None):
+    delta = fleet_summary_delta(before, after)
+    if delta:
+        # No upsert: a missing summary is rebuilt from scratch on the next read
+        mongo.db.fleet_stats.update_one({'_id': FLEET_SUMMARY_ID}, {'$inc': delta}, session=db_session)
+
+def _apply_car_update(doc, update):
+    # Replay the $set/$inc operators used by the routes on a copy of the tracked fields
+    result = dict(doc)
+    for field, value in update.get('$set', {}).items():
+        result[field] = value
+    for field, value in update.get('$inc', {}).items():
+        result[field] = (result.get(field) or 0) + value
+    return result
+
+# Helper functions for data versions
+# Each collection has a counter bumped on every write, used to key cached report files and ETags
+def bump_data_version(name, db_session=None):
+    """Increment the data version of a collection; return the new version"""
+    doc = mongo.db.data_versions.find_one_and_update(
+        {'_id': name}, {'$inc': {'version': 1}},
+        upsert=True, return_document=ReturnDocument.AFTER, session=db_session
+    )
+    data_version_cache.invalidate(name)
+    return doc['version']
+
+def data_version(name):
+    doc = mongo.db.data_versions.find_one({'_id': name})
+    return doc.get('version', 0) if doc else 0
+
+# Process-local copy of the counters, so conditional requests can be answered without a query
+# Writes in this process invalidate it; writes in other workers are seen after DATA_VERSION_TTL
+data_version_cache = LRUCache(64, app.config['DATA_VERSION_TTL'])
+
+def cached_data_version(name):
+    found, version = data_version_cache.get(name)
+    if not found:
+        version = data_version(name)
+        data_version_cache.set(name, version)
+    return version
+
+# Helper functions for conditional GET on responses derived from the cars collection
+def fleet_etag(*parts):
+    # The version is read before the data, so an ETag never claims newer data than the body holds
+    key = '|'.join(str(part) for part in (app.config['APP_VERSION'], cached_data_version('cars')) + parts)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+def conditional_response(etag, build, cache_control='private, no-cache'):
+    """Return 304 when the client already has etag, otherwise build() with ETag/Cache-Control set"""
+    if session.get('_flashes'):
+        # Pending flash messages are rendered by this response only: never answer 304 nor tag it
+        response = make_response(build())
+        response.headers['Cache-Control'] = 'private, no-store'
+        response.vary.add('Cookie')
+        return response
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Cookie')
+    return response
+
+# Reservation windows holding units, per car, for availability over a date range
+# Writes from this process are applied to it; any other write moves the data version and rebuilds it
+AVAILABILITY_PROJECTION = {'items': 1, 'item_id': 1, 'quantity': 1, 'start_date': 1, 'end_date': 1, 'status': 1}
+availability_index = AvailabilityIndex(lambda: mongo.db.rental_requests.find(
+    {'status': {'$in': list(PENDING_STATUSES + ACTIVE_STATUSES)}}, AVAILABILITY_PROJECTION
+))
+
+# Live updates of the staff pages (see live_events); the write helpers below publish what they changed
+LIVE_EVENT_COLLECTIONS = ('rental_requests', 'cars')
+LIVE_CAR_FIELDS = ('id', 'status', 'quantite_totale', 'quantite_disponible')
+live_events = EventBroker(
+    LIVE_EVENT_COLLECTIONS,
+    lambda: {name: cached_data_version(name) for name in LIVE_EVENT_COLLECTIONS},
+    max_subscribers=app.config['LIVE_EVENTS_MAX_STREAMS'],
+    queue_size=app.config['LIVE_EVENTS_QUEUE_SIZE']
+)
+
+def live_events_supported():
+    # A stream holds its worker for as long as the page is open: gunicorn's sync worker (one request
+    # at a time per process) would be frozen by a single staff tab
+    environ = request.environ
+    return environ.get('wsgi.multithread', False) or not environ.get('SERVER_SOFTWARE', '').startswith('gunicorn')
+
+def live_events_url():
+    """URL of the event stream for a page rendered now, or None when the server cannot hold streams"""
+    # The stream resumes from what the page shows, so the cursor is taken before the data is read
+    return url_for('staff_events', after=live_events.cursor()) if live_events_supported() else None
+
+def publish_reservations(event, reservations, version):
+    live_events.publish(event, {'reservations': reservations}, {'rental_requests': version})
+
+def publish_cars(cars, version):
+    live_events.publish('car_changed', {'cars': [{field: car.get(field) for field in LIVE_CAR_FIELDS} for car in cars]},
+                        {'cars': version})
+
+# Helper functions for rental request writes; every write to rental_requests goes through these
+def insert_rental_request(reservation):
+    result = mongo.db.rental_requests.insert_one(reservation)
+    version = bump_data_version('rental_requests')
+    availability_index.apply([(result.inserted_id, reservation)], version)
+    publish_reservations('reservation_created', [{'id': str(result.inserted_id), 'status': reservation.get('status')}], version)
+    return result
+
+def update_rental_request(query, update):
+    result = mongo.db.rental_requests.update_one(query, update)
+    version = bump_data_version('rental_requests')
+    status = update.get('$set', {}).get('status')
+    if not isinstance(query.get('_id'), ObjectId):
+        # The pages cannot tell which row changed
+        live_events.publish(RESYNC, {}, {'rental_requests': version})
+    elif status and result.modified_count:
+        publish_reservations('reservation_status', [{'id': str(query['_id']), 'status': status}], version)
+    else:
+        live_events.publish(None, None, {'rental_requests': version})
+    return result
+
+def delete_rental_request(query):
+    result = mongo.db.rental_requests.delete_one(query)
+    version = bump_data_version('rental_requests')
+    if result.deleted_count and isinstance(query.get('_id'), ObjectId):
+        publish_reservations('reservation_deleted', [{'id': str(query['_id'])}], version)
+    else:
+        live_events.publish(RESYNC if result.deleted_count else None, {}, {'rental_requests': version})
+    return result
+
+def delete_rental_requests(query):
+    result = mongo.db.rental_requests.delete_many(query)
+    version = bump_data_version('rental_requests')
+    live_events.publish(RESYNC if result.deleted_count else None, {}, {'rental_requests': version})
+    return result
+
+# Helper functions for car writes; every write to cars goes through these
+CAR_LOOKUP_FIELDS = ('id', 'designation', 'category')
+
+def insert_car(car):
+    result = mongo.db.cars.insert_one(car)
+    record_fleet_change(None, car)
+    publish_cars([car], bump_data_version('cars'))
+    car_lookup_cache.invalidate(car.get('id'))
+    return result
+
+def update_car(query, update, apply_update=None):
+    # An aggregation pipeline update comes with apply_update(car before) returning the car after it
+    before = mongo.db.cars.find_one_and_update(
+        query, update,
+        projection=dict(FLEET_TRACKED_PROJECTION, id=1),
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is not None:
+        after = apply_update(before) if apply_update else _apply_car_update(before, update)
+        record_fleet_change(before, after)
+        publish_cars([after], bump_data_version('cars'))
+        # Quantity/status changes from reservations keep the cached designation valid
+        if not apply_update and any(field in update.get('$set', {}) for field in CAR_LOOKUP_FIELDS):
+            car_lookup_cache.invalidate(before.get('id'))
+            car_lookup_cache.invalidate(update['$set'].get('id'))
+    return before
+
+def remove_car(query):
+    before = mongo.db.cars.find_one_and_delete(query, projection=dict(FLEET_TRACKED_PROJECTION, id=1))
+    if before is not None:
+        record_fleet_change(before, None)
+        # A removed car has no units left to offer
+        publish_cars([{'id': before.get('id'), 'status': None, 'quantite_totale': 0, 'quantite_disponible': 0}],
+                     bump_data_version('cars'))
+        car_lookup_cache.invalidate(before.get('id'))
+    return before
+
+# Helper function recording the cars written by one bulk_write of an import
+def record_imported_cars(changes):
+    # One summary update for the whole batch instead of one per car
+    delta = {}
+    for before, after in changes:
+        for key, value in fleet_summary_delta(before, after).items():
+            delta[key] = delta.get(key, 0) + value
+    delta = {key: value for key, value in delta.items() if value}
+    if delta:
+        mongo.db.fleet_stats.update_one({'_id': FLEET_SUMMARY_ID}, {'$inc': delta})
+    publish_cars([after for _, after in changes], bump_data_version('cars'))
+    for before, after in changes:
+        car_lookup_cache.invalidate(after['id'])
+
+def car_importer(batch_size=None):
+    return CarImporter(
+        mongo.db.cars,
+        batch_size=batch_size or app.config['IMPORT_BATCH_SIZE'],
+        tracked_projection=FLEET_TRACKED_PROJECTION,
+        on_batch=record_imported_cars
+    )
+
+# Helper function recording the car writes of a reservation transition, inside its transaction
+def record_transition_writes(car_writes, db_session):
+    for before, update in car_writes:
+        record_fleet_change(before, _apply_car_update(before, update), db_session=db_session)
+    if car_writes:
+        # Transitions only change quantities and statuses, so cached designations stay valid
+        bump_data_version('cars', db_session=db_session)
+    bump_data_version('rental_requests', db_session=db_session)
+
+# Status a reservation is left with by each transition; a deleted one has none, and after returning
+# one of its cars it depends on the others (the pages fetch the row)
+TRANSITION_STATUSES = {'approve': 'Approved', 'reject': 'Rejected', 'return': 'Completed', 'return_item': None}
+
+def reservation_committed(action, reservations, cars):
+    # The versions were bumped inside the transaction; drop the local copies once it is visible
+    data_version_cache.invalidate()
+    version = data_version('rental_requests')
+    # Only an approval leaves a reservation holding units (rejected, deleted and returned ones release them)
+    changes = [(r['_id'], dict(r, status='Approved') if action == 'approve' else None) for r in reservations]
+    if action == 'return_item':
+        # The reservation may still hold the units of its other cars: rebuild on next use
+        availability_index.invalidate()
+    else:
+        availability_index.apply(changes, version)
+    if action in TRANSITION_STATUSES:
+        status = TRANSITION_STATUSES[action]
+        publish_reservations('reservation_status', [{'id': str(r['_id']), 'status': status} for r in reservations], version)
+    else:
+        publish_reservations('reservation_deleted', [{'id': str(r['_id'])} for r in reservations], version)
+    if cars:
+        publish_cars(cars, data_version('cars'))
+
+reservation_service = ReservationService(
+    mongo.cx, mongo.db,
+    on_cars_changed=record_transition_writes,
+    on_committed=reservation_committed
+)
+
+def fleet_stats():
+    """Return status and condition counts for the whole fleet from the summary document"""
+    summary = mongo.db.fleet_stats.find_one({'_id': FLEET_SUMMARY_ID})
+    if not summary:
+        summary = compute_fleet_summary()
+        mongo.db.fleet_stats.replace_one({'_id': FLEET_SUMMARY_ID}, summary, upsert=True)
+
+    stats = {'total': summary.get('total', 0)}
+    for value, key in FLEET_STATUS_KEYS.items():
+        stats[key] = summary.get('status', {}).get(_summary_key(value), 0)
+    for value, key in FLEET_CONDITION_KEYS.items():
+        stats[key] = summary.get('condition', {}).get(_summary_key(value), 0)
+    stats['autre'] = stats['total'] - (stats['bon_etat'] + stats['mauvais_etat'] + stats['condition_repair'])
+    return stats
+
+@app.cli.command('reconcile-fleet-stats')
+def reconcile_fleet_stats():
+    """Rebuild the fleet_stats summary from the cars collection and report any drift."""
+    stored = mongo.db.fleet_stats.find_one({'_id': FLEET_SUMMARY_ID}) or {}
+    fresh = compute_fleet_summary()
+
+    drift = []
+    if stored.get('total', 0) != fresh['total']:
+        drift.append(('total', stored.get('total', 0), fresh['total']))
+    for group in ('status', 'condition', 'quantities'):
+        stored_group = stored.get(group, {})
+        for key in sorted(set(stored_group) | set(fresh[group])):
+            if stored_group.get(key, 0) != fresh[group].get(key, 0):
+                drift.append((f'{group}.{key}', stored_group.get(key, 0), fresh[group].get(key, 0)))
+
+    mongo.db.fleet_stats.replace_one({'_id': FLEET_SUMMARY_ID}, fresh, upsert=True)
+    if not stored:
+        click.echo('Fleet summary was missing; rebuilt from scratch.')
+    elif drift:
+        click.echo(f'Fleet summary drift corrected on {len(drift)} counter(s):')
+        for key, old_value, new_value in drift:
+            click.echo(f'  {key}: {old_value} -> {new_value}')
+    else:
+        click.echo('Fleet summary is consistent.')
+
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Create the indexes declared in db_indexes.py."""
+    for collection, names in ensure_indexes(mongo.db).items():
+        click.echo(f'{collection}: {", ".join(names)}')
+
+@app.cli.command('explain-queries')
+def explain_queries_command():
+    """Explain the query of each route and flag the ones running a collection scan."""
+    collscans = 0
+    for route, collection, stages in explain_route_queries(mongo.db):
+        flag = 'COLLSCAN' if 'COLLSCAN' in stages else 'ok'
+        collscans += flag == 'COLLSCAN'
+        click.echo(f'[{flag:8}] {route} ({collection}): {" <- ".join(stages)}')
+    if collscans:
+        raise click.ClickException(f'{collscans} route quer{"y" if collscans == 1 else "ies"} scan the whole collection')
+    click.echo('Every route query uses an index.')
+
+@app.cli.command('migrate-images')
+@click.option('--dry-run', is_flag=True, help='Only report what would be migrated.')
+def migrate_images_command(dry_run):
+    """Move car images to content-addressed names and rewrite cars.image."""
+    upload_dir = app.config['UPLOAD_FOLDER']
+    migrated = missing = failed = 0
+    for image in sorted(mongo.db.cars.distinct('image', {'image': {'$nin': [None, '']}})):
+        if is_content_addressed(image):
+            continue
+        if not os.path.isfile(os.path.join(upload_dir, image)):
+            click.echo(f'missing  {image}')
+            missing += 1
+            continue
+        if dry_run:
+            click.echo(f'would migrate {image}')
+            migrated += 1
+            continue
+        try:
+            stored_name = store_existing_image(upload_dir, image)
+        except InvalidImage as e:
+            click.echo(f'invalid  {image}: {e}')
+            failed += 1
+            continue
+        # One write per car so the car helpers keep the caches and data versions in step
+        now = datetime.now()
+        for car in mongo.db.cars.find({'image': image}, {'_id': 0, 'id': 1}):
+            update_car({'id': car['id'], 'image': image}, {'$set': {'image': stored_name, 'updated_at': now}})
+        click.echo(f'migrated {image} -> {stored_name}')
+        migrated += 1
+    # The original files are left in place; they are no longer referenced once every worker runs this version
+    click.echo(f'{migrated} image(s) {"to migrate" if dry_run else "migrated"}, {missing} missing, {failed} invalid.')
+
+@app.cli.command('import-cars')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=None, help='Cars per bulk_write (default: IMPORT_BATCH_SIZE).')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), help='Write the rejected rows to this CSV file.')
+def import_cars_command(path, batch_size, errors_path):
+    """Add or update cars from a CSV or XLSX file, upserting by id."""
+    started = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            report = car_importer(batch_size).run(read_rows(f, path))
+    except ImportFileError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - started
+    click.echo(f'{report.rows} row(s) in {elapsed:.1f}s ({report.rows / elapsed if elapsed else 0:.0f} rows/s): '
+               f'{report.inserted} inserted, {report.updated} updated, {len(report.errors)} rejected.')
+    if errors_path and report.errors:
+        with open(errors_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['row', 'id', 'errors'])
+            for error in report.errors:
+                writer.writerow([error['row'], error['id'], '; '.join(error['errors'])])
+        click.echo(f'Rejected rows written to {errors_path}.')
+    else:
+        for error in report.errors[:20]:
+            click.echo(f'  row {error["row"]} ({error["id"] or "-"}): {"; ".join(error["errors"])}')
+        if len(report.errors) > 20:
+            click.echo(f'  ... and {len(report.errors) - 20} more (use --errors to write them all).')
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+@app.cli.command('backfill-images')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: one per CPU).')
+@click.option('--dry-run', is_flag=True, help='Estimate the savings without writing anything.')
+def backfill_images_command(workers, dry_run):
+    """Generate the missing derivatives of every car image and report unreferenced uploads."""
+    upload_dir = app.config['UPLOAD_FOLDER']
+    referenced = sorted(mongo.db.cars.distinct('image', {'image': {'$nin': [None, '']}}))
+    pending = []
+    missing = 0
+    for image in referenced:
+        if not os.path.isfile(os.path.join(upload_dir, image)):
+            click.echo(f'missing  {image}')
+            missing += 1
+        elif available_variants(upload_dir, image)[1] is None:
+            pending.append(image)
+    # Derivatives are written atomically and the thumbnail last, so an interrupted run resumes where it stopped;
+    # existing ones are never regenerated since their URLs are cached as immutable
+    click.echo(f'{len(referenced)} referenced image(s): {len(referenced) - len(pending) - missing} already done, '
+               f'{missing} missing, {len(pending)} to process.')
+
+    source_total = card_total = derivative_total = failed = 0
+    card_index = VARIANT_WIDTHS.index(THUMBNAIL_WIDTH)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(backfill_image, upload_dir, image, dry_run) for image in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            prefix = f'[{done:>{len(str(len(futures)))}}/{len(futures)}]'
+            if 'error' in result:
+                click.echo(f'{prefix} {result["image"]}: failed ({result["error"]})')
+                failed += 1
+                continue
+            # A catalog card loads the 640w WebP (or the largest one for smaller images) instead of the source
+            webp_sizes = [size for path, size in result['derivatives'].items() if path.endswith('.webp')]
+            card_bytes = webp_sizes[min(card_index, len(webp_sizes) - 1)]
+            source_total += result['source_bytes']
+            card_total += card_bytes
+            derivative_total += sum(result['derivatives'].values())
+            click.echo(f'{prefix} {result["image"]}: {_format_bytes(result["source_bytes"])} -> {_format_bytes(card_bytes)} per card')
+
+    if pending:
+        click.echo(f'Catalog cards: {_format_bytes(source_total)} -> {_format_bytes(card_total)} '
+                   f'({_format_bytes(source_total - card_total)} {"would be " if dry_run else ""}saved); '
+                   f'derivatives on disk: {_format_bytes(derivative_total)}; {failed} failed.')
+
+    orphans = orphaned_uploads(upload_dir, referenced)
+    if orphans:
+        click.echo(f'{len(orphans)} file(s) referenced by no car ({_format_bytes(sum(size for _, size in orphans))}):')
+        for path, size in orphans:
+            click.echo(f'  {path} ({_format_bytes(size)})')
+    else:
+        click.echo('Every upload is referenced by a car.')
+
 # Login Route
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -69,7 +805,17 @@ def login():
         
         user = mongo.db.users.find_one({'username': username})
         
-        if user and bcrypt.check_password_hash(user['password'], password):
+        # bcrypt runs on the login process pool; when it is saturated, refuse quickly
+        try:
+            valid, new_hash = password_hasher.check(user.get('password'), password) if user else (False, None)
+        except HasherBusy:
+            flash('Trop de connexions en cours, veuillez réessayer dans quelques secondes', 'error')
+            return render_template('login.html'), 503, {'Retry-After': '2'}
+        
+        if valid:
+            if new_hash:
+                # The cost factor changed since this password was hashed
+                mongo.db.users.update_one({'_id': user['_id'], 'password': user['password']}, {'$set': {'password': new_hash}})
             login_user(User(str(user['_id']), username, user['role']))
             flash(f'Welcome back, {username}!', 'success')
             return redirect(url_for('dashboard'))
@@ -108,10 +854,7 @@ def profile():
 @login_required
 def dashboard():
     # Get statistics
-    available = mongo.db.cars.count_documents({'status': 'Disponible'})
-    unavailable = mongo.db.cars.count_documents({'status': 'Indisponible'})
-    repair = mongo.db.cars.count_documents({'status': 'Nécessite une réparation'})
-    total = mongo.db.cars.count_documents({})
+    fleet = fleet_stats()
     # Get recent items
     recent_items = list(mongo.db.cars.find().sort([('updated_at', -1), ('created_at', -1)]).limit(10))
     for item in recent_items:
@@ -120,10 +863,10 @@ def dashboard():
         item['created_at'] = item.get('created_at', '').strftime('%Y-%m-%d %H:%M') if item.get('created_at') else ''
         item['updated_at'] = item.get('updated_at', '').strftime('%Y-%m-%d %H:%M') if item.get('updated_at') else ''
     stats = {
-        'available': available,
-        'unavailable': unavailable,
-        'repair': repair,
-        'total': total
+        'available': fleet['available'],
+        'unavailable': fleet['unavailable'],
+        'repair': fleet['repair'],
+        'total': fleet['total']
     }
     return render_template('dashboard.html', stats=stats, recent_items=recent_items)
 
@@ -142,8 +885,8 @@ def inventory():
         # Don't overwrite the actual 'id' field with MongoDB _id
         # The 'id' field should remain as the car's custom ID
         item['designation'] = item.get('designation', '')
-        item['created_at'] = item.get('created_at', '').strftime('%Y-%m-%d %H:%M') if item.get('created_at') else ''
-        item['updated_at'] = item.get('updated_at', '').strftime('%Y-%m-%d %H:%M') if item.get('updated_at') else ''
+        # The row's action buttons depend on the role
+        item['row_html'] = render_fragment('partials/inventory_row.html', item, current_user.role)
         
         # Get category (default to 'Non catégorisé' if not found)
         category = item.get('category', 'Non catégorisé')
@@ -193,16 +936,16 @@ def add_item():
             if not allowed_file(image_file.filename):
                 flash('Type de fichier image invalide. Seuls JPG, PNG, GIF sont autorisés.', 'danger')
                 return redirect(request.url)
-            if len(image_file.read()) > app.config['MAX_CONTENT_LENGTH']:
+            try:
+                image_filename = store_uploaded_image(image_file)
+            except UploadTooLarge:
                 flash('L\'image est trop volumineuse (max 2MB).', 'danger')
                 return redirect(request.url)
-            image_file.seek(0)
-            filename = secure_filename(image_file.filename)
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            image_file.save(image_path)
-            image_filename = filename
+            except InvalidImage:
+                flash('Le fichier n\'est pas une image valide.', 'danger')
+                return redirect(request.url)
         now = datetime.now()
-        mongo.db.cars.insert_one({
+        insert_car({
             'id': item_id,
             'quantity': quantity,
             'prix_journalier': prix_journalier,
@@ -234,6 +977,9 @@ def add_item():
 @app.route('/api/item/<string:item_id>', methods=['GET'])
 @login_required
 def get_item(item_id):
+    return conditional_response(fleet_etag('item', item_id), lambda: build_item_response(item_id))
+
+def build_item_response(item_id):
     item = mongo.db.cars.find_one({'id': item_id})
     if item:
         return jsonify({
@@ -282,13 +1028,12 @@ def update_item(item_id):
     if image_file and image_file.filename:
         if not allowed_file(image_file.filename):
             return jsonify({'success': False, 'message': 'Type de fichier image invalide. Seuls JPG, PNG, GIF sont autorisés.'}), 400
-        if len(image_file.read()) > app.config['MAX_CONTENT_LENGTH']:
+        try:
+            image_filename = store_uploaded_image(image_file)
+        except UploadTooLarge:
             return jsonify({'success': False, 'message': 'L\'image est trop volumineuse (max 2MB).'}), 400
-        image_file.seek(0)
-        filename = secure_filename(image_file.filename)
-        image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        image_file.save(image_path)
-        image_filename = filename
+        except InvalidImage:
+            return jsonify({'success': False, 'message': 'Le fichier n\'est pas une image valide.'}), 400
     update_fields = {
         'id': item_id_val,
         'designation': designation,
@@ -308,40 +1053,103 @@ def update_item(item_id):
     }
     if image_filename:
         update_fields['image'] = image_filename
-    mongo.db.cars.update_one({'id': item_id}, {'$set': update_fields})
+    update_car({'id': item_id}, {'$set': update_fields})
     return jsonify({'success': True, 'message': 'Matériel mis à jour avec succès'})
 
 @app.route('/api/item/<string:item_id>', methods=['DELETE'])
 @login_required
 def delete_item(item_id):
-    mongo.db.cars.delete_one({'id': item_id})
+    remove_car({'id': item_id})
     return jsonify({'success': True, 'message': 'Item deleted successfully'})
 
 # Categories API
 @app.route('/api/categories')
 @login_required
 def get_categories():
-    raw_categories = mongo.db.cars.distinct('category')
-    categories = [c for c in raw_categories if c and str(c).strip()]
-    categories.sort(key=lambda x: str(x).lower())
-    return jsonify({'success': True, 'categories': categories})
+    def build():
+        raw_categories = mongo.db.cars.distinct('category')
+        categories = [c for c in raw_categories if c and str(c).strip()]
+        categories.sort(key=lambda x: str(x).lower())
+        return jsonify({'success': True, 'categories': categories})
+
+    return conditional_response(fleet_etag('categories'), build)
 
 # Available items API (optionally filtered by category)
 @app.route('/api/available-items')
 @login_required
 def get_available_items():
     selected_category = (request.args.get('category') or '').strip()
+    try:
+        window = availability_window_args()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Période invalide'}), 400
+    if window is None:
+        return conditional_response(
+            fleet_etag('available-items', selected_category),
+            lambda: build_available_items_response(selected_category)
+        )
+    rentals_version = cached_data_version('rental_requests')
+    return conditional_response(
+        fleet_etag('available-items', selected_category, window[0], window[1], rentals_version),
+        lambda: build_available_items_response(selected_category, window, rentals_version)
+    )
 
+# Helper functions for availability over a date window
+# Cars become Indisponible when their last unit is booked, so they may still be free in another window
+WINDOW_STATUSES = ['Disponible', 'Indisponible']
+OUT_OF_SERVICE_FIELDS = ['quantite_cassée', 'quantite_en_réparation', 'quantite_indisponible', 'quantite_perdue']
+
+def availability_window_args():
+    """Return the (start, end) window of the request, None without one; raise ValueError if invalid"""
+    start, end = request.args.get('start'), request.args.get('end')
+    if not start and not end:
+        return None
+    if not start or not end:
+        raise ValueError('start and end go together')
+    start_dt, _ = parse_window_bound(start)
+    end_dt, end_is_date = parse_window_bound(end)
+    if end_is_date:
+        # A bare end date includes that whole day
+        end_dt += timedelta(days=1)
+    if end_dt <= start_dt:
+        raise ValueError('empty window')
+    return start_dt, end_dt
+
+def parse_window_bound(value):
+    """Return (datetime, is a bare date) for one bound of a window; raise ValueError if invalid"""
+    try:
+        return datetime.combine(date.fromisoformat(value), datetime.min.time()), True
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        # Reservation dates are stored naive (local time) and cannot be compared with an offset
+        raise ValueError('timezone offsets are not supported')
+    return parsed, False
+
+def rentable_units(car):
+    """Units of a car that can be rented at all, whatever the reservations"""
+    total = car.get('quantite_totale', car.get('quantite_disponible', 1)) or 0
+    return max(total - sum(car.get(field) or 0 for field in OUT_OF_SERVICE_FIELDS), 0)
+
+def build_available_items_response(selected_category, window=None, rentals_version=None):
     query = {
         'status': 'Disponible',
         'quantite_disponible': {'$gt': 0}
     }
+    if window:
+        query = {'status': {'$in': WINDOW_STATUSES}}
     if selected_category:
         query['category'] = selected_category
 
     available_items = list(
         mongo.db.cars.find(query).sort('designation', 1)
     )
+    if window:
+        booked = availability_index.booked_units([item.get('id') for item in available_items], window[0], window[1], rentals_version)
+        for item in available_items:
+            item['quantite_disponible'] = rentable_units(item) - booked[item.get('id')]
+        available_items = [item for item in available_items if item['quantite_disponible'] > 0]
 
     items = []
     for item in available_items:
@@ -354,6 +1162,96 @@ def get_available_items():
 
     return jsonify({'success': True, 'items': items})
 
+# Bulk car import from a CSV or XLSX file (see car_import)
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+@app.route('/api/import-cars', methods=['POST'])
+@login_required
+def import_cars():
+    if not (is_manager() or current_user.role == 'admin'):
+        return jsonify({'success': False, 'message': 'Accès refusé. Réservé au manager ou admin.'}), 403
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'success': False, 'message': 'Aucun fichier reçu'}), 400
+    try:
+        report = car_importer().run(read_rows(upload.stream, upload.filename))
+    except ImportFileError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(dict(
+        report.to_dict(max_errors=IMPORT_MAX_REPORTED_ERRORS),
+        success=True,
+        message=f'{report.inserted} voiture(s) ajoutée(s), {report.updated} mise(s) à jour, {len(report.errors)} ligne(s) rejetée(s)'
+    ))
+
+# Occupancy calendar: units booked per car and day over the requested range
+# Every reservation that was not rejected is shown, pending and completed ones included; the
+# availability index only holds the reservations holding units now and keeps to availability answers
+OCCUPANCY_DEFAULT_DAYS = 31
+OCCUPANCY_MAX_DAYS = 366
+OCCUPANCY_PROJECTION = dict({'_id': 0, 'id': 1, 'designation': 1, 'category': 1, 'quantite_totale': 1, 'quantite_disponible': 1},
+                            **{field: 1 for field in OUT_OF_SERVICE_FIELDS})
+OCCUPANCY_RESERVATION_PROJECTION = {'_id': 0, 'item_id': 1, 'quantity': 1, 'items.item_id': 1, 'items.quantity': 1,
+                                    'start_date': 1, 'end_date': 1}
+# Keyed by the data versions, so entries never go stale; the TTL only frees memory
+occupancy_cache = LRUCache(32, 3600)
+
+@app.route('/api/occupancy')
+@login_required
+def get_occupancy():
+    if not (is_manager() or current_user.role == 'admin'):
+        return jsonify({'success': False, 'message': 'Accès refusé'}), 403
+    try:
+        start = datetime.fromisoformat(request.args['start']).date() if request.args.get('start') else datetime.now().date()
+        days = int(request.args.get('days', OCCUPANCY_DEFAULT_DAYS))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Période invalide'}), 400
+    if not 1 <= days <= OCCUPANCY_MAX_DAYS:
+        return jsonify({'success': False, 'message': f'La période doit compter entre 1 et {OCCUPANCY_MAX_DAYS} jours'}), 400
+    rentals_version = cached_data_version('rental_requests')
+    return conditional_response(
+        fleet_etag('occupancy', start, days, rentals_version),
+        lambda: jsonify(build_occupancy(start, days, rentals_version))
+    )
+
+def build_occupancy(start, days, rentals_version):
+    """Return the run-length encoded occupancy payload of [start, start + days), from the cache when possible"""
+    key = (start, days, cached_data_version('cars'), rentals_version)
+    found, payload = occupancy_cache.get(key)
+    if found:
+        return payload
+    cars = list(mongo.db.cars.find({}, OCCUPANCY_PROJECTION).sort('designation', 1))
+    matrix = occupancy_matrix([car.get('id') for car in cars], occupancy_windows(start, days), start, days)
+    payload = {
+        'success': True,
+        'start': start.isoformat(),
+        'days': days,
+        'encoding': 'rle',
+        'cars': [{
+            'id': car.get('id'),
+            'designation': car.get('designation', ''),
+            'category': car.get('category', ''),
+            'capacity': rentable_units(car),
+            'booked': runs
+        } for car, runs in zip(cars, run_length_rows(matrix))]
+    }
+    occupancy_cache.set(key, payload)
+    return payload
+
+def occupancy_windows(start, days):
+    """Return [(car id, start, end, units)] of the reservations overlapping [start, start + days)"""
+    range_start = datetime.combine(start, datetime.min.time())
+    range_end = range_start + timedelta(days=days)
+    windows = []
+    for reservation in mongo.db.rental_requests.find({
+        'status': {'$ne': 'Rejected'},
+        'start_date': {'$lt': range_end},
+        'end_date': {'$gt': range_start}
+    }, OCCUPANCY_RESERVATION_PROJECTION):
+        window = reservation_window(reservation)
+        if window:
+            windows.extend((item_id, window[0], window[1], quantity) for item_id, quantity in reservation_lines(reservation))
+    return windows
+
 # Reservation API routes
 @app.route('/api/reservation', methods=['POST'])
 @login_required
@@ -398,7 +1296,7 @@ def create_reservation():
         'created_at': datetime.now()
     }
     
-    mongo.db.rental_requests.insert_one(reservation_data)
+    insert_rental_request(reservation_data)
     
     return jsonify({'success': True, 'message': 'Demande de réservation créée avec succès'})
 
@@ -416,29 +1314,13 @@ def approve_reservation(reservation_id):
         except Exception as e:
             return jsonify({'success': False, 'message': f'ID de réservation invalide: {reservation_id}'}), 400
         
-        # Find the reservation
-        reservation = mongo.db.rental_requests.find_one({'_id': object_id})
-        if not reservation:
-            return jsonify({'success': False, 'message': 'Réservation non trouvée'}), 404
-        
-        # Check if reservation is pending
-        current_status = reservation.get('status')
-        if current_status != 'En attente':
-            return jsonify({'success': False, 'message': 'Seules les réservations en attente peuvent être approuvées'}), 400
-        
-        # Update reservation status
-        mongo.db.rental_requests.update_one(
-            {'_id': object_id},
-            {'$set': {
-                'status': 'Approved', 
-                'approved_by': f'{current_user.role}:{current_user.username}', 
-                'approved_at': datetime.now()
-            }}
-        )
+        reservation_service.approve(object_id, f'{current_user.role}:{current_user.username}')
         
         flash(f'Réservation approuvée avec succès!', 'success')
         return jsonify({'success': True, 'message': f'Réservation approuvée avec succès'})
         
+    except TransitionError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
     except Exception as e:
         print(f"Error approving reservation: {e}")
         return jsonify({'success': False, 'message': f'Erreur lors de l\'approbation: {str(e)}'}), 500
@@ -457,107 +1339,85 @@ def reject_reservation(reservation_id):
         except Exception as e:
             return jsonify({'success': False, 'message': f'ID de réservation invalide: {reservation_id}'}), 400
         
-        # Find the reservation
-        reservation = mongo.db.rental_requests.find_one({'_id': object_id})
-        if not reservation:
-            return jsonify({'success': False, 'message': 'Réservation non trouvée'}), 404
-        
-        # Check if reservation can be rejected
-        current_status = reservation.get('status')
-        if current_status != 'En attente':
-            return jsonify({'success': False, 'message': 'Seules les réservations en attente peuvent être rejetées'}), 400
-        
-        # Update status to rejected
-        mongo.db.rental_requests.update_one(
-            {'_id': object_id},
-            {'$set': {
-                'status': 'Rejected',
-                'rejected_by': current_user.username,
-                'rejected_at': datetime.now()
-            }}
-        )
-        
-        # Restore quantities for all items in the reservation
-        if 'items' in reservation:
-            # Multi-item reservation
-            for item_data in reservation['items']:
-                item_id = item_data.get('item_id')
-                quantity = item_data.get('quantity', 1)
-                
-                # Restore the quantity
-                mongo.db.cars.update_one(
-                    {'id': item_id},
-                    {
-                        '$inc': {'quantite_disponible': quantity},
-                        '$set': {
-                            'status': 'Disponible',
-                            'updated_at': datetime.now()
-                        }
-                    }
-                )
-        else:
-            # Single item reservation (legacy)
-            item_id = reservation.get('item_id')
-            quantity = reservation.get('quantity', 1)
-            
-            if item_id:
-                mongo.db.cars.update_one(
-                    {'id': item_id},
-                    {
-                        '$inc': {'quantite_disponible': quantity},
-                        '$set': {
-                            'status': 'Disponible',
-                            'updated_at': datetime.now()
-                        }
-                    }
-                )
+        # Rejecting gives back the units held by the reservation
+        reservation_service.reject(object_id, current_user.username)
         
         flash('Réservation rejetée avec succès!', 'success')
         return jsonify({'success': True, 'message': 'Réservation rejetée avec succès'})
         
+    except TransitionError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
     except Exception as e:
         print(f"Error rejecting reservation: {e}")
         return jsonify({'success': False, 'message': f'Erreur lors du rejet: {str(e)}'}), 500
 
+BULK_TRANSITION_MAX_IDS = 500
+
+@app.route('/api/reservations/bulk', methods=['POST'])
+@login_required
+def bulk_transition_reservations():
+    """Approve or reject many reservations in one request"""
+    if not (is_manager() or current_user.role == 'admin'):
+        return jsonify({'success': False, 'message': 'Accès refusé. Réservé au manager ou admin.'}), 403
+
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    ids = data.get('ids') or []
+    if action not in ('approve', 'reject'):
+        return jsonify({'success': False, 'message': 'Action non reconnue'}), 400
+    if not isinstance(ids, list) or not ids:
+        return jsonify({'success': False, 'message': 'Aucune réservation sélectionnée'}), 400
+    if len(ids) > BULK_TRANSITION_MAX_IDS:
+        return jsonify({'success': False, 'message': f'{BULK_TRANSITION_MAX_IDS} réservations au plus par requête'}), 400
+
+    results = {}
+    object_ids = []
+    for reservation_id in ids:
+        try:
+            object_ids.append(ObjectId(reservation_id))
+        except Exception:
+            results[str(reservation_id)] = {'success': False, 'message': f'ID de réservation invalide: {reservation_id}'}
+
+    try:
+        if action == 'approve':
+            outcomes = reservation_service.approve_many(object_ids, f'{current_user.role}:{current_user.username}')
+        else:
+            outcomes = reservation_service.reject_many(object_ids, current_user.username)
+    except TransitionError as e:
+        # The whole batch was rolled back (a car or a reservation changed meanwhile)
+        return jsonify({'success': False, 'message': e.message}), e.status_code
+    except Exception as e:
+        print(f"Error in bulk reservation transition: {e}")
+        return jsonify({'success': False, 'message': f'Erreur lors du traitement: {str(e)}'}), 500
+
+    done_message = 'Réservation approuvée' if action == 'approve' else 'Réservation rejetée'
+    for object_id, error in outcomes.items():
+        results[str(object_id)] = {'success': True, 'message': done_message} if error is None else {'success': False, 'message': error.message}
+    succeeded = sum(1 for result in results.values() if result['success'])
+    verb = 'approuvée(s)' if action == 'approve' else 'rejetée(s)'
+    return jsonify({
+        'success': True,
+        'message': f'{succeeded} réservation(s) {verb}, {len(results) - succeeded} en échec',
+        'results': results
+    })
+
 @app.route('/api/reservation/<string:reservation_id>', methods=['DELETE'])
 @login_required
 def delete_reservation(reservation_id):
     """Delete a reservation"""
-    try:
-        reservation = mongo.db.rental_requests.find_one({'_id': ObjectId(reservation_id)})
-        if not reservation:
-            return jsonify({'success': False, 'message': 'Réservation non trouvée'}), 404
-        
-        # Check if user can delete this reservation
+    # Check if user can delete this reservation
+    def authorize(reservation):
         if not (is_manager() or current_user.role == 'admin' or reservation.get('user_email') == current_user.username):
-            return jsonify({'success': False, 'message': 'Permission refusée'}), 403
-        
-        # If reservation is pending, restore quantities
-        if reservation.get('status') == 'En attente':
-            if 'items' in reservation and reservation['items']:
-                # Multi-item reservation
-                for item_data in reservation['items']:
-                    item_id = item_data.get('item_id')
-                    quantity = item_data.get('quantity', 1)
-                    mongo.db.cars.update_one(
-                        {'id': item_id},
-                        {'$inc': {'quantite_disponible': quantity}, '$set': {'status': 'Disponible', 'updated_at': datetime.now()}}
-                    )
-            else:
-                # Single item reservation (legacy)
-                item_id = reservation.get('item_id')
-                quantity = reservation.get('quantity', 1)
-                if item_id:
-                    mongo.db.cars.update_one(
-                        {'id': item_id},
-                        {'$inc': {'quantite_disponible': quantity}, '$set': {'status': 'Disponible', 'updated_at': datetime.now()}}
-                    )
-        
-        # Delete the reservation
-        mongo.db.rental_requests.delete_one({'_id': ObjectId(reservation_id)})
+            raise TransitionError('Permission refusée', 403)
+    
+    try:
+        # Units still held by a pending reservation are restored with the delete
+        reservation_service.delete(ObjectId(reservation_id), authorize=authorize)
         
         return jsonify({'success': True, 'message': 'Réservation supprimée avec succès'})
         
+    except TransitionError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
     except Exception as e:
         print(f"Error deleting reservation: {e}")
         return jsonify({'success': False, 'message': 'Erreur lors de la suppression'}), 500
@@ -580,6 +1440,7 @@ def get_reservation_details(reservation_id):
         return jsonify({'success': False, 'message': 'Accès refusé'}), 403
 
     # Handle multi-item reservations
+    cars_map = resolve_reservation_cars([reservation])
     if 'items' in reservation:
         # Multi-item reservation
         items_data = []
@@ -588,7 +1449,7 @@ def get_reservation_details(reservation_id):
             quantity = item_data.get('quantity', 1)
             designation = item_data.get('designation', '')
             
-            car = mongo.db.cars.find_one({'id': item_id}) or {}
+            car = cars_map.get(item_id) or {}
             items_data.append({
                 'item_id': item_id,
                 'designation': designation or car.get('designation', ''),
@@ -610,7 +1471,7 @@ def get_reservation_details(reservation_id):
         }
     else:
         # Single item reservation (legacy)
-        car = mongo.db.cars.find_one({'id': reservation.get('item_id')}) or {}
+        car = cars_map.get(reservation.get('item_id')) or {}
         data = {
             'id': str(reservation.get('_id')),
             'item_id': reservation.get('item_id', ''),
@@ -655,22 +1516,21 @@ def create_cart_reservation():
         except ValueError:
             return jsonify({'success': False, 'message': 'Format de date invalide'}), 400
         
-        # Check if all items are available
+        # Validate the cart before touching any quantity
+        lines = []
         for item_data in items:
             item_id = item_data.get('item_id')
             quantity = item_data.get('quantity', 1)
             
-            if not item_id or quantity <= 0:
+            if not item_id or not isinstance(quantity, int) or quantity <= 0:
                 return jsonify({'success': False, 'message': 'Données d\'article invalides'}), 400
-            
-            # Check if item exists and has enough quantity
-            item = mongo.db.cars.find_one({'id': item_id})
-            if not item:
+            lines.append((item_id, quantity))
+        
+        # Check if items exist
+        cars = car_lookup_cache.get_many(item_id for item_id, _ in lines)
+        for item_id, _ in lines:
+            if item_id not in cars:
                 return jsonify({'success': False, 'message': f'Article {item_id} non trouvé'}), 400
-            
-            if item.get('quantite_disponible', 0) < quantity:
-                article_name = item.get("designation", "l'article")
-                return jsonify({'success': False, 'message': f'Quantité insuffisante pour {article_name}'}), 400
         
         # Create ONE reservation with multiple items
         reservation_data = {
@@ -684,42 +1544,29 @@ def create_cart_reservation():
             'items': []  # Array to store all items in this reservation
         }
         
-        # Add all items to the reservation
-        for item_data in items:
-            item_id = item_data.get('item_id')
-            quantity = item_data.get('quantity', 1)
-            
-            item = mongo.db.cars.find_one({'id': item_id})
-            
-            # Add item to reservation
-            reservation_data['items'].append({
-                'item_id': item_id,
-                'designation': item.get('designation', ''),
-                'quantity': quantity
-            })
-            
-            # Update item availability
-            new_available = item.get('quantite_disponible', 0) - quantity
-            
-            # Update status based on remaining quantity
-            if new_available <= 0:
-                new_status = "Indisponible"
-            else:
-                new_status = "Disponible"
+        # Reserve each item with one conditional decrement; if any item runs short,
+        # give back what was already taken so concurrent carts can never oversell
+        reserved = []
+        try:
+            for item_id, quantity in lines:
+                if not reserve_car_units(item_id, quantity):
+                    article_name = cars[item_id].get('designation') or "l'article"
+                    release_reserved_units(reserved)
+                    return jsonify({'success': False, 'message': f'Quantité insuffisante pour {article_name}'}), 400
+                reserved.append((item_id, quantity))
+                
+                # Add item to reservation
+                reservation_data['items'].append({
+                    'item_id': item_id,
+                    'designation': cars[item_id].get('designation', ''),
+                    'quantity': quantity
+                })
             
-            mongo.db.cars.update_one(
-                {'id': item_id},
-                {
-                    '$set': {
-                        'quantite_disponible': new_available,
-                        'status': new_status,
-                        'updated_at': datetime.now()
-                    }
-                }
-            )
-        
-        # Insert the single reservation
-        result = mongo.db.rental_requests.insert_one(reservation_data)
+            # Insert the single reservation
+            result = insert_rental_request(reservation_data)
+        except Exception:
+            release_reserved_units(reserved)
+            raise
         
         return jsonify({
             'success': True, 
@@ -731,6 +1578,37 @@ def create_cart_reservation():
         print(f"Error creating cart reservation: {e}")
         return jsonify({'success': False, 'message': 'Erreur lors de la création de la réservation'}), 500
 
+# Helper functions for reserving car units
+def reserve_car_units(item_id, quantity):
+    """Atomically take quantity units of a car; return False when not enough are available"""
+    now = datetime.now()
+    remaining = {'$subtract': ['$quantite_disponible', quantity]}
+    # The availability check, the decrement and, for the last units, the switch to Indisponible
+    # are a single conditional update
+    before = update_car(
+        {'id': item_id, 'quantite_disponible': {'$gte': quantity}},
+        [{'$set': {
+            'quantite_disponible': remaining,
+            'status': {'$cond': [{'$gt': [remaining, 0]}, 'Disponible', 'Indisponible']},
+            'updated_at': now
+        }}],
+        apply_update=lambda car: dict(
+            car,
+            quantite_disponible=car['quantite_disponible'] - quantity,
+            status='Disponible' if car['quantite_disponible'] - quantity > 0 else 'Indisponible',
+            updated_at=now
+        )
+    )
+    return before is not None
+
+def release_reserved_units(reserved):
+    """Give back units taken by reserve_car_units (compensation for a failed cart)"""
+    for item_id, quantity in reserved:
+        update_car(
+            {'id': item_id},
+            {'$inc': {'quantite_disponible': quantity}, '$set': {'status': 'Disponible', 'updated_at': datetime.now()}}
+        )
+
 # Reservations Route
 @app.route('/reservations')
 @login_required
@@ -755,120 +1633,137 @@ def reservations():
         reservations = list(mongo.db.rental_requests.find(user_filter).sort('created_at', -1))
     
     # Build a lookup for car names keyed by custom 'id'
-    cars_map = {e.get('id', ''): e.get('designation', '') for e in mongo.db.cars.find()}
+    cars_map = {car_id: car.get('designation', '') for car_id, car in resolve_reservation_cars(reservations).items()}
     
     # Format reservations for template
-    formatted_reservations = []
-    for r in reservations:
-        if 'items' in r and r['items']:
-            # Multi-item reservation
-            item_names = []
-            total_quantity = 0
-            for item_data in r['items']:
-                item_id = item_data.get('item_id', '')
-                quantity = item_data.get('quantity', 1)
-                designation = item_data.get('designation', '') or cars_map.get(item_id, '')
-                item_names.append(f"{designation} (x{quantity})")
-                total_quantity += quantity
-            
-            formatted_reservations.append({
-                'id': str(r.get('_id')),
-                'item_id': 'multi',  # Mark as multi-item
-                'item_name': ' + '.join(item_names),
-                'user_name': r.get('user_name', ''),
-                'user_email': r.get('user_email', ''),
-                'quantity': total_quantity,
-                'start_date': r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                'end_date': r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                'status': r.get('status', ''),
-                'purpose': r.get('purpose', ''),
-                'created_at': r.get('created_at', '').strftime('%Y-%m-%d %H:%M') if r.get('created_at') else '',
-                'is_multi_item': True
-            })
-        else:
-            # Single item reservation (legacy)
-            formatted_reservations.append({
-                'id': str(r.get('_id')),
-                'item_id': str(r.get('item_id')),
-                'item_name': cars_map.get(str(r.get('item_id')), ''),
-                'user_name': r.get('user_name', ''),
-                'user_email': r.get('user_email', ''),
-                'quantity': r.get('quantity', 1),
-                'start_date': r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                'end_date': r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                'status': r.get('status', ''),
-                'purpose': r.get('purpose', ''),
-                'created_at': r.get('created_at', '').strftime('%Y-%m-%d %H:%M') if r.get('created_at') else '',
-                'is_multi_item': False
-            })
+    formatted_reservations = [format_reservation_row(r, cars_map) for r in reservations]
     
     return render_template('reservation.html', reservations=formatted_reservations)
 
-# API route to get full reservation history (including rejected/completed)
+# Helper function to format a reservation for the reservations table and history API
+def format_reservation_row(r, cars_map):
+    if 'items' in r and r['items']:
+        # Multi-item reservation
+        item_names = []
+        total_quantity = 0
+        for item_data in r['items']:
+            item_id = item_data.get('item_id', '')
+            quantity = item_data.get('quantity', 1)
+            designation = item_data.get('designation', '') or cars_map.get(item_id, '')
+            item_names.append(f"{designation} (x{quantity})")
+            total_quantity += quantity
+        item_id = 'multi'  # Mark as multi-item
+        item_name = ' + '.join(item_names)
+        is_multi_item = True
+    else:
+        # Single item reservation (legacy)
+        item_id = str(r.get('item_id'))
+        item_name = cars_map.get(item_id, '')
+        total_quantity = r.get('quantity', 1)
+        is_multi_item = False
+
+    return {
+        'id': str(r.get('_id')),
+        'item_id': item_id,
+        'item_name': item_name,
+        'user_name': r.get('user_name', ''),
+        'user_email': r.get('user_email', ''),
+        'quantity': total_quantity,
+        'start_date': r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
+        'end_date': r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
+        'status': r.get('status', ''),
+        'purpose': r.get('purpose', ''),
+        'created_at': r.get('created_at', '').strftime('%Y-%m-%d %H:%M') if r.get('created_at') else '',
+        'is_multi_item': is_multi_item
+    }
+
+# Helper functions for keyset pagination on (created_at, _id)
+# The cursor is an opaque token holding the sort key of the last row of the previous page
+def encode_history_cursor(reservation):
+    created_at = reservation.get('created_at')
+    payload = {
+        'created_at': created_at.isoformat() if isinstance(created_at, datetime) else None,
+        '_id': str(reservation['_id'])
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+def decode_history_cursor(cursor):
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    created_at = datetime.fromisoformat(payload['created_at']) if payload.get('created_at') else None
+    return created_at, ObjectId(payload['_id'])
+
+def history_cursor_filter(created_at, last_id):
+    # Rows strictly after (created_at, _id) in descending order; missing created_at sorts last
+    if created_at is None:
+        return {'created_at': None, '_id': {'$lt': last_id}}
+    return {'$or': [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, '_id': {'$lt': last_id}},
+        {'created_at': None}
+    ]}
+
+# API route to get the reservation history (including rejected/completed), one page at a time
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+
 @app.route('/api/reservations/history')
 @login_required
 def get_reservation_history():
-    """Get all reservations including rejected and completed ones for history view"""
+    """Get one page of reservations including rejected and completed ones for history view"""
+    # Query parameters: limit, cursor (next_cursor of the previous page), status (comma separated),
+    # date_from and date_to (YYYY-MM-DD, applied to the creation date)
     try:
+        try:
+            limit = min(max(int(request.args.get('limit', HISTORY_DEFAULT_LIMIT)), 1), HISTORY_MAX_LIMIT)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Paramètre limit invalide'}), 400
+
+        conditions = []
         # Get reservations based on user role
-        if is_manager() or current_user.role == 'admin':
-            # Manager and admin see all reservations
-            reservations = list(mongo.db.rental_requests.find().sort('created_at', -1))
-        else:
+        if not (is_manager() or current_user.role == 'admin'):
             # Utilisateur sees only their own reservations
-            reservations = list(mongo.db.rental_requests.find({'user_email': current_user.username}).sort('created_at', -1))
+            conditions.append({'user_email': current_user.username})
+
+        statuses = [status.strip() for status in (request.args.get('status') or '').split(',') if status.strip()]
+        if statuses:
+            conditions.append({'status': {'$in': statuses}})
+
+        try:
+            created_range = {}
+            if request.args.get('date_from'):
+                created_range['$gte'] = datetime.strptime(request.args['date_from'], '%Y-%m-%d')
+            if request.args.get('date_to'):
+                created_range['$lt'] = datetime.strptime(request.args['date_to'], '%Y-%m-%d') + timedelta(days=1)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Format de date invalide (AAAA-MM-JJ attendu)'}), 400
+        if created_range:
+            conditions.append({'created_at': created_range})
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                conditions.append(history_cursor_filter(*decode_history_cursor(cursor)))
+            except Exception:
+                return jsonify({'success': False, 'message': 'Curseur de pagination invalide'}), 400
+
+        query = {'$and': conditions} if conditions else {}
+        # Fetch one extra row to know whether another page exists
+        reservations = list(
+            mongo.db.rental_requests.find(query)
+            .sort([('created_at', -1), ('_id', -1)])
+            .limit(limit + 1)
+        )
+        has_more = len(reservations) > limit
+        reservations = reservations[:limit]
         
         # Build a lookup for car names keyed by custom 'id'
-        cars_map = {e.get('id', ''): e.get('designation', '') for e in mongo.db.cars.find()}
-        
-        # Format reservations for API response
-        formatted_reservations = []
-        for r in reservations:
-            if 'items' in r and r['items']:
-                # Multi-item reservation
-                item_names = []
-                total_quantity = 0
-                for item_data in r['items']:
-                    item_id = item_data.get('item_id', '')
-                    quantity = item_data.get('quantity', 1)
-                    designation = item_data.get('designation', '') or cars_map.get(item_id, '')
-                    item_names.append(f"{designation} (x{quantity})")
-                    total_quantity += quantity
-                
-                formatted_reservations.append({
-                    'id': str(r.get('_id')),
-                    'item_id': 'multi',
-                    'item_name': ' + '.join(item_names),
-                    'user_name': r.get('user_name', ''),
-                    'user_email': r.get('user_email', ''),
-                    'quantity': total_quantity,
-                    'start_date': r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                    'end_date': r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                    'status': r.get('status', ''),
-                    'purpose': r.get('purpose', ''),
-                    'created_at': r.get('created_at', '').strftime('%Y-%m-%d %H:%M') if r.get('created_at') else '',
-                    'is_multi_item': True
-                })
-            else:
-                # Single item reservation (legacy)
-                formatted_reservations.append({
-                    'id': str(r.get('_id')),
-                    'item_id': str(r.get('item_id')),
-                    'item_name': cars_map.get(str(r.get('item_id')), ''),
-                    'user_name': r.get('user_name', ''),
-                    'user_email': r.get('user_email', ''),
-                    'quantity': r.get('quantity', 1),
-                    'start_date': r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                    'end_date': r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                    'status': r.get('status', ''),
-                    'purpose': r.get('purpose', ''),
-                    'created_at': r.get('created_at', '').strftime('%Y-%m-%d %H:%M') if r.get('created_at') else '',
-                    'is_multi_item': False
-                })
+        cars_map = {car_id: car.get('designation', '') for car_id, car in resolve_reservation_cars(reservations).items()}
         
         return jsonify({
             'success': True,
-            'reservations': formatted_reservations
+            'reservations': [format_reservation_row(r, cars_map) for r in reservations],
+            'has_more': has_more,
+            'next_cursor': encode_history_cursor(reservations[-1]) if has_more else None
         })
         
     except Exception as e:
@@ -907,25 +1802,8 @@ def generate_report():
             return render_template('report.html', items=items, report_type='inventory')
 
         elif report_type == 'statistics':
-            available = mongo.db.cars.count_documents({'status': 'Disponible'})
-            unavailable = mongo.db.cars.count_documents({'status': 'Indisponible'})
-            repair = mongo.db.cars.count_documents({'status': 'Nécessite une réparation'})
-            total = mongo.db.cars.count_documents({})
-            # Condition repartition
-            bon_etat = mongo.db.cars.count_documents({'condition': 'Bon état'})
-            mauvais_etat = mongo.db.cars.count_documents({'condition': 'Mauvais état'})
-            condition_repair = mongo.db.cars.count_documents({'condition': 'Nécessite une réparation'})
-            autre = total - (bon_etat + mauvais_etat + condition_repair)
-            stats = {
-                'available': available,
-                'unavailable': unavailable,
-                'repair': repair,
-                'total': total,
-                'bon_etat': bon_etat,
-                'mauvais_etat': mauvais_etat,
-                'condition_repair': condition_repair,
-                'autre': autre
-            }
+            # Status and condition repartition
+            stats = fleet_stats()
             return render_template('report.html', stats=stats, report_type='statistics')
 
         elif report_type == 'reservations':
@@ -934,6 +1812,37 @@ def generate_report():
 
     return render_template('report.html')
 
+# Column layouts of the PDF reports as (header, relative width)
+PDF_REPORT_COLUMNS = {
+    'inventory': [
+        ('ID', 5), ('Désignation', 10), ('Catégorie', 7), ('Marque', 6), ('Modèle', 6), ('N° Série', 7),
+        ('Ancien CAB', 6), ('Nouveau CAB', 6), ('Statut', 7), ("Date d'inventaire", 6),
+        ('Qté Tot.', 3), ('Qté Disp.', 3), ('Qté Cassée', 3), ('Qté Réparation', 4), ('Description', 14)
+    ],
+    'statistics': [('Libellé', 3), ('Valeur', 1)],
+    'reservations': [
+        ('Article', 10), ('Catégorie', 7), ('Réservé par', 7), ('Email', 9), ('Qté', 3),
+        ('Début', 7), ('Fin', 7), ('Statut', 6), ('But', 14)
+    ]
+}
+PDF_REPORT_TITLES = {
+    'inventory': 'Rapport d\'inventaire (détaillé)',
+    'statistics': 'Rapport de statistiques',
+    'reservations': 'Rapport des réservations (détaillé)'
+}
+
+def build_report_pdf(report_type, output):
+    """Draw the report into output (a path or a binary file object) and return the page count"""
+    columns = PDF_REPORT_COLUMNS.get(report_type, [('', 1)])
+    rows = REPORT_ROW_GENERATORS[report_type]() if report_type in REPORT_ROW_GENERATORS else iter([[]])
+    # The PDF table draws its own header row
+    next(rows, None)
+    if report_type == 'statistics':
+        # Drop the blank separator row of the tabular layout
+        rows = (row for row in rows if row)
+    renderer = PdfTableRenderer(output, PDF_REPORT_TITLES.get(report_type, 'Rapport'), columns)
+    return renderer.render(rows)
+
 @app.route('/export-report/pdf')
 @login_required
 def export_report_pdf():
@@ -943,137 +1852,153 @@ def export_report_pdf():
         return redirect(url_for('dashboard'))
     report_type = request.args.get('report_type', 'inventory')
     output = BytesIO()
-    c = canvas.Canvas(output, pagesize=landscape(letter))
-    width, height = landscape(letter)
-    y = height - 40
-    c.setFont('Helvetica-Bold', 18)
-    title_map = {
-        'inventory': 'Rapport d\'inventaire (détaillé)',
-        'statistics': 'Rapport de statistiques',
-        'reservations': 'Rapport des réservations (détaillé)'
-    }
-    c.drawString(40, y, title_map.get(report_type, 'Rapport'))
-    c.setFont('Helvetica', 12)
-    y -= 40
-    if report_type == 'inventory':
-        items = list(mongo.db.cars.find().sort('designation', 1))
-        headers = [
-            'ID', 'Désignation', 'Catégorie', 'Marque', 'Modèle', 'N° Série',
-            'Ancien CAB', 'Nouveau CAB', 'Statut', "Date d'inventaire",
-            'Qté Tot.', 'Qté Disp.', 'Qté Cassée', 'Qté Réparation', 'Description'
+    build_report_pdf(report_type, output)
+    output.seek(0)
+    return send_file(output, as_attachment=True, download_name=f"{REPORT_EXPORT_NAMES.get(report_type, 'rapport')}.pdf", mimetype='application/pdf')
+
+# Helper functions for streamed report exports
+# Each report is a generator of rows read straight from the Mongo cursor, so the CSV and XLSX
+# exports never hold the whole result set in memory
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+REPORT_EXPORT_NAMES = {
+    'inventory': 'inventaire_detaillé',
+    'statistics': 'statistiques',
+    'reservations': 'reservations_detaillé'
+}
+
+def inventory_report_rows():
+    yield [
+        'ID', 'Désignation', 'Catégorie', 'Marque', 'Modèle', 'N° Série',
+        'Ancien CAB', 'Nouveau CAB', 'Statut', "Date d'inventaire",
+        'Qté Totale', 'Qté Disponible', 'Qté Cassée', 'Qté en Réparation', 'Description'
+    ]
+    for item in mongo.db.cars.find().sort('designation', 1):
+        yield [
+            item.get('id', ''),
+            item.get('designation', ''),
+            item.get('category', ''),
+            item.get('marque', ''),
+            item.get('modele', ''),
+            item.get('n_serie', ''),
+            item.get('ancien_cab', ''),
+            item.get('nouveau_cab', ''),
+            item.get('status', ''),
+            item.get('date_inv', ''),
+            item.get('quantite_totale', 1),
+            item.get('quantite_disponible', item.get('quantite_totale', 1)),
+            item.get('quantite_cassée', 0),
+            item.get('quantite_en_réparation', 0),
+            item.get('description', '')
         ]
-        c.setFont('Helvetica-Bold', 10)
-        c.drawString(40, y, ' | '.join(headers))
-        y -= 18
-        c.setFont('Helvetica', 9)
-        for item in items:
-            description = (item.get('description', '') or '').replace('\n', ' ')
-            if len(description) > 80:
-                description = description[:77] + '...'
-            row = [
-                str(item.get('id', '')),
-                str(item.get('designation', '')),
-                str(item.get('category', '')),
-                str(item.get('marque', '')),
-                str(item.get('modele', '')),
-                str(item.get('n_serie', '')),
-                str(item.get('ancien_cab', '')),
-                str(item.get('nouveau_cab', '')),
-                str(item.get('status', '')),
-                str(item.get('date_inv', '')),
-                str(item.get('quantite_totale', 1)),
-                str(item.get('quantite_disponible', item.get('quantite_totale', 1))),
-                str(item.get('quantite_cassée', 0)),
-                str(item.get('quantite_en_réparation', 0)),
-                description
-            ]
-            c.drawString(40, y, ' | '.join(row))
-            y -= 16
-            if y < 40:
-                c.showPage()
-                y = height - 40
-                c.setFont('Helvetica-Bold', 10)
-                c.drawString(40, y, ' | '.join(headers))
-                y -= 18
-                c.setFont('Helvetica', 9)
-    elif report_type == 'statistics':
-        available = mongo.db.cars.count_documents({'status': 'Disponible'})
-        unavailable = mongo.db.cars.count_documents({'status': 'Indisponible'})
-        repair = mongo.db.cars.count_documents({'status': 'Nécessite une réparation'})
-        total = mongo.db.cars.count_documents({})
-        # Répartition par condition si existante
-        bon_etat = mongo.db.cars.count_documents({'condition': 'Bon état'})
-        mauvais_etat = mongo.db.cars.count_documents({'condition': 'Mauvais état'})
-        condition_repair = mongo.db.cars.count_documents({'condition': 'Nécessite une réparation'})
-        autre = total - (bon_etat + mauvais_etat + condition_repair)
-        stats = [
-            ('Disponible', available),
-            ('Indisponible', unavailable),
-            ('Nécessite une réparation', repair),
-            ('Total', total),
-            ('Bon état', bon_etat),
-            ('Mauvais état', mauvais_etat),
-            ('Autre', autre)
+
+def statistics_report_rows():
+    fleet = fleet_stats()
+    yield ['Libellé', 'Valeur']
+    yield ['Disponible', fleet['available']]
+    yield ['Indisponible', fleet['unavailable']]
+    yield ['Nécessite une réparation', fleet['repair']]
+    yield ['Total', fleet['total']]
+    # Répartition par condition (si disponible)
+    yield []
+    yield ['Condition', 'Valeur']
+    yield ['Bon état', fleet['bon_etat']]
+    yield ['Mauvais état', fleet['mauvais_etat']]
+    yield ['Nécessite une réparation', fleet['condition_repair']]
+    yield ['Autre', fleet['autre']]
+
+def reservation_report_cursor():
+    """One row per reserved line item, already joined with its car's designation and category"""
+    pipeline = [
+        {'$sort': {'start_date': -1}},
+        # Multi-item requests with no items produce no rows
+        {'$match': {'items': {'$ne': []}}},
+        # Multi-item request - one row for each item; single-item requests (legacy) pass through
+        {'$unwind': {'path': '$items', 'preserveNullAndEmptyArrays': True}},
+        {'$addFields': {
+            'line_item_id': {'$ifNull': ['$items.item_id', '$item_id']},
+            'line_quantity': {'$ifNull': ['$items.quantity', {'$ifNull': ['$quantity', 1]}]}
+        }},
+        {'$lookup': {'from': 'cars', 'localField': 'line_item_id', 'foreignField': 'id', 'as': 'car'}},
+        {'$project': {
+            '_id': 0, 'user_name': 1, 'user_email': 1, 'start_date': 1, 'end_date': 1,
+            'status': 1, 'purpose': 1, 'line_quantity': 1, 'car.designation': 1, 'car.category': 1
+        }}
+    ]
+    return mongo.db.rental_requests.aggregate(pipeline, allowDiskUse=True)
+
+def reservation_report_rows():
+    yield ['Article', 'Catégorie', 'Réservé par', 'Email', 'Quantité', 'Date début', 'Date fin', 'Statut', 'But']
+    for r in reservation_report_cursor():
+        equip = r['car'][0] if r.get('car') else {}
+        yield [
+            equip.get('designation', ''),
+            equip.get('category', ''),
+            r.get('user_name', ''),
+            r.get('user_email', ''),
+            r.get('line_quantity', 1),
+            r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
+            r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
+            r.get('status', ''),
+            r.get('purpose', '')
         ]
-        for label, value in stats:
-            c.drawString(40, y, f"{label}: {value}")
-            y -= 24
-    elif report_type == 'reservations':
-        reservations = list(mongo.db.rental_requests.find().sort('start_date', -1))
-        car_map = {e.get('id', ''): e.get('designation', '') for e in mongo.db.cars.find()}
-        headers = ['Article', 'Catégorie', 'Réservé par', 'Email', 'Qté', 'Début', 'Fin', 'Statut', 'But']
-        c.drawString(40, y, ' | '.join(headers))
-        y -= 20
-        for r in reservations:
-            if 'items' in r:
-                # Multi-item request - create a row for each item
-                for item_data in r.get('items', []):
-                    equip = mongo.db.cars.find_one({'id': item_data.get('item_id')}) or {}
-                    row = [
-                        car_map.get(item_data.get('item_id', ''), ''),
-                        str(equip.get('category', '')),
-                        r.get('user_name', ''),
-                        r.get('user_email', ''),
-                        str(item_data.get('quantity', 1)),
-                        r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                        r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                        r.get('status', ''),
-                        (r.get('purpose', '') or '')[:60]
-                    ]
-                    row_str = ' | '.join(row)
-                    c.drawString(40, y, row_str)
-                    y -= 18
-                    if y < 40:
-                        c.showPage()
-                        y = height - 40
-            else:
-                # Single-item request (legacy)
-                equip = mongo.db.cars.find_one({'id': r.get('item_id')}) or {}
-                row = [
-                    car_map.get(r.get('item_id', ''), ''),
-                    str(equip.get('category', '')),
-                    r.get('user_name', ''),
-                    r.get('user_email', ''),
-                    str(r.get('quantity', 1)),
-                    r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                    r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                    r.get('status', ''),
-                    (r.get('purpose', '') or '')[:60]
-                ]
-                row_str = ' | '.join(row)
-                c.drawString(40, y, row_str)
-                y -= 18
-                if y < 40:
-                    c.showPage()
-                    y = height - 40
-    c.save()
+
+REPORT_ROW_GENERATORS = {
+    'inventory': inventory_report_rows,
+    'statistics': statistics_report_rows,
+    'reservations': reservation_report_rows
+}
+
+def _content_disposition(download_name):
+    ascii_name = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(download_name)}"
+
+def csv_response(rows, download_name):
+    """Stream rows as a CSV download; the header row is sent as soon as it is produced"""
+    def generate():
+        buffer = StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        # BOM so that Excel opens the accented headers as UTF-8
+        buffer.write('\ufeff')
+        for index, row in enumerate(rows):
+            writer.writerow(row)
+            if index == 0 or buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': _content_disposition(download_name)}
+    )
+
+def write_report_xlsx(rows, sheet_title, output, column_widths=None, text_columns=()):
+    """Write rows with openpyxl's write-only mode into output (a path or a binary file object)"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    # Write-only sheets need their column widths before the first row is written
+    for index, width in enumerate(column_widths or [], start=1):
+        ws.column_dimensions[get_column_letter(index)].width = width
+    for row in rows:
+        if text_columns:
+            row = list(row)
+            for index in text_columns:
+                if index < len(row):
+                    # Force text format to prevent Excel auto-formatting
+                    cell = WriteOnlyCell(ws, value=row[index])
+                    cell.number_format = '@'
+                    row[index] = cell
+        ws.append(row)
+    wb.save(output)
+
+def xlsx_response(rows, sheet_title, download_name, column_widths=None, text_columns=()):
+    # The temporary file is removed as soon as the response closes it
+    output = tempfile.TemporaryFile()
+    write_report_xlsx(rows, sheet_title, output, column_widths, text_columns)
     output.seek(0)
-    name_map = {
-        'inventory': 'inventaire_detaillé',
-        'statistics': 'statistiques',
-        'reservations': 'reservations_detaillé'
-    }
-    return send_file(output, as_attachment=True, download_name=f"{name_map.get(report_type, 'rapport')}.pdf", mimetype='application/pdf')
+    return send_file(output, as_attachment=True, download_name=download_name, mimetype=XLSX_MIMETYPE)
 
 @app.route('/export-report/excel')
 @login_required
@@ -1083,128 +2008,116 @@ def export_report_excel():
         flash('Accès refusé. Réservé au manager et admin.', 'error')
         return redirect(url_for('dashboard'))
     report_type = request.args.get('report_type', 'inventory')
-    output = BytesIO()
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Rapport'
-    if report_type == 'inventory':
-        items = list(mongo.db.cars.find().sort('designation', 1))
-        headers = [
-            'ID', 'Désignation', 'Catégorie', 'Marque', 'Modèle', 'N° Série',
-            'Ancien CAB', 'Nouveau CAB', 'Statut', "Date d'inventaire",
-            'Qté Totale', 'Qté Disponible', 'Qté Cassée', 'Qté en Réparation', 'Description'
-        ]
-        ws.append(headers)
-        for item in items:
-            row = [
-                item.get('id', ''),
-                item.get('designation', ''),
-                item.get('category', ''),
-                item.get('marque', ''),
-                item.get('modele', ''),
-                item.get('n_serie', ''),
-                item.get('ancien_cab', ''),
-                item.get('nouveau_cab', ''),
-                item.get('status', ''),
-                item.get('date_inv', ''),
-                item.get('quantite_totale', 1),
-                item.get('quantite_disponible', item.get('quantite_totale', 1)),
-                item.get('quantite_cassée', 0),
-                item.get('quantite_en_réparation', 0),
-                item.get('description', '')
-            ]
-            ws.append(row)
-    elif report_type == 'statistics':
-        available = mongo.db.cars.count_documents({'status': 'Disponible'})
-        unavailable = mongo.db.cars.count_documents({'status': 'Indisponible'})
-        repair = mongo.db.cars.count_documents({'status': 'Nécessite une réparation'})
-        total = mongo.db.cars.count_documents({})
-        ws.append(['Libellé', 'Valeur'])
-        ws.append(['Disponible', available])
-        ws.append(['Indisponible', unavailable])
-        ws.append(['Nécessite une réparation', repair])
-        ws.append(['Total', total])
-        # Répartition par condition (si disponible)
-        bon_etat = mongo.db.cars.count_documents({'condition': 'Bon état'})
-        mauvais_etat = mongo.db.cars.count_documents({'condition': 'Mauvais état'})
-        condition_repair = mongo.db.cars.count_documents({'condition': 'Nécessite une réparation'})
-        autre = total - (bon_etat + mauvais_etat + condition_repair)
-        ws.append([])
-        ws.append(['Condition', 'Valeur'])
-        ws.append(['Bon état', bon_etat])
-        ws.append(['Mauvais état', mauvais_etat])
-        ws.append(['Nécessite une réparation', condition_repair])
-        ws.append(['Autre', autre])
-    elif report_type == 'reservations':
-        reservations = list(mongo.db.rental_requests.find().sort('start_date', -1))
-        car_map = {e.get('id', ''): e.get('designation', '') for e in mongo.db.cars.find()}
-        headers = ['Article', 'Catégorie', 'Réservé par', 'Email', 'Quantité', 'Date début', 'Date fin', 'Statut', 'But']
-        ws.append(headers)
-        for r in reservations:
-            if 'items' in r:
-                # Multi-item request - create a row for each item
-                for item_data in r.get('items', []):
-                    equip = mongo.db.cars.find_one({'id': item_data.get('item_id')}) or {}
-                    row = [
-                        car_map.get(item_data.get('item_id', ''), ''),
-                        equip.get('category', ''),
-                        r.get('user_name', ''),
-                        r.get('user_email', ''),
-                        item_data.get('quantity', 1),
-                        r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                        r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                        r.get('status', ''),
-                        r.get('purpose', '')
-                    ]
-                    ws.append(row)
-            else:
-                # Single-item request (legacy)
-                equip = mongo.db.cars.find_one({'id': r.get('item_id')}) or {}
-                row = [
-                    car_map.get(r.get('item_id', ''), ''),
-                    equip.get('category', ''),
-                    r.get('user_name', ''),
-                    r.get('user_email', ''),
-                    r.get('quantity', 1),
-                    r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                    r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                    r.get('status', ''),
-                    r.get('purpose', '')
-                ]
-                ws.append(row)
-    wb.save(output)
-    output.seek(0)
-    name_map = {
-        'inventory': 'inventaire_detaillé',
-        'statistics': 'statistiques',
-        'reservations': 'reservations_detaillé'
-    }
-    return send_file(output, as_attachment=True, download_name=f"{name_map.get(report_type, 'rapport')}.xlsx", mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    rows = REPORT_ROW_GENERATORS.get(report_type, lambda: iter(()))()
+    return xlsx_response(rows, 'Rapport', f"{REPORT_EXPORT_NAMES.get(report_type, 'rapport')}.xlsx")
 
-# Direct inventory Excel export (detailed) used by inventory page
-@app.route('/export/inventory-excel')
+@app.route('/export-report/csv')
 @login_required
-def export_inventory_excel():
-    # Only manager and admin can export inventory
+def export_report_csv():
+    # Only manager and admin can export reports
     if not (is_manager() or current_user.role == 'admin'):
         flash('Accès refusé. Réservé au manager et admin.', 'error')
         return redirect(url_for('dashboard'))
-    output = BytesIO()
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Inventaire'
-
-    headers = [
-        'Catégorie', 'ID', 'Désignation', 'Marque', 'Modèle', 'N° Série',
-        'Ancien CAB', 'Nouveau CAB', "Date d'inventaire", 'Quantité Totale',
-        'Disponible', 'Cassée', 'En Réparation', 'Statut', 'État', 'Description / Observation'
-    ]
-    ws.append(headers)
+    report_type = request.args.get('report_type', 'inventory')
+    rows = REPORT_ROW_GENERATORS.get(report_type, lambda: iter(()))()
+    return csv_response(rows, f"{REPORT_EXPORT_NAMES.get(report_type, 'rapport')}.csv")
+
+# Background report jobs
+# The report page queues PDF/Excel renders instead of tying up a worker for the whole render,
+# then polls the job and downloads the file once it is ready
+REPORT_DATA_SOURCES = {
+    'inventory': ('cars',),
+    'statistics': ('cars',),
+    'reservations': ('cars', 'rental_requests')
+}
+REPORT_JOB_FORMATS = {
+    'pdf': ('pdf', 'application/pdf'),
+    'excel': ('xlsx', XLSX_MIMETYPE)
+}
+
+def render_report_file(report_type, file_format, path):
+    if file_format == 'pdf':
+        build_report_pdf(report_type, path)
+    else:
+        write_report_xlsx(REPORT_ROW_GENERATORS[report_type](), 'Rapport', path)
+
+def report_job_payload(job):
+    payload = {
+        'job_id': str(job['_id']),
+        'report_type': job.get('report_type'),
+        'format': job.get('format'),
+        'status': job.get('status'),
+        'created_at': job['created_at'].strftime('%Y-%m-%d %H:%M') if job.get('created_at') else ''
+    }
+    if job.get('status') == 'done':
+        payload['download_url'] = url_for('download_report_job', job_id=str(job['_id']))
+    if job.get('status') == 'failed':
+        payload['error'] = job.get('error', '')
+    if job.get('status') == 'replaced':
+        payload['error'] = 'Rapport remplacé par une version plus récente, veuillez relancer l\'export'
+    return payload
+
+@app.route('/export-report/jobs', methods=['POST'])
+@login_required
+def create_report_job():
+    # Only manager and admin can export reports
+    if not (is_manager() or current_user.role == 'admin'):
+        return jsonify({'success': False, 'message': 'Accès refusé. Réservé au manager et admin.'}), 403
+    data = request.get_json(silent=True) or request.form
+    report_type = data.get('report_type', 'inventory')
+    file_format = data.get('format', 'pdf')
+    if report_type not in REPORT_DATA_SOURCES or file_format not in REPORT_JOB_FORMATS:
+        return jsonify({'success': False, 'message': 'Type de rapport ou format invalide'}), 400
+
+    extension, mimetype = REPORT_JOB_FORMATS[file_format]
+    # Same report type and format over the same data version reuses the finished file
+    versions = ','.join(f'{name}={data_version(name)}' for name in REPORT_DATA_SOURCES[report_type])
+    job = report_jobs.submit(
+        report_type, file_format,
+        cache_key=f'{report_type}:{file_format}:{versions}',
+        render=lambda path: render_report_file(report_type, file_format, path),
+        filename=f"{REPORT_EXPORT_NAMES[report_type]}.{extension}",
+        mimetype=mimetype,
+        requested_by=current_user.username
+    )
+    return jsonify(dict(report_job_payload(job), success=True)), 202
 
+@app.route('/export-report/jobs/<string:job_id>')
+@login_required
+def get_report_job(job_id):
+    if not (is_manager() or current_user.role == 'admin'):
+        return jsonify({'success': False, 'message': 'Accès refusé'}), 403
+    job = report_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Rapport introuvable'}), 404
+    return jsonify(dict(report_job_payload(job), success=True))
+
+@app.route('/export-report/jobs/<string:job_id>/download')
+@login_required
+def download_report_job(job_id):
+    if not (is_manager() or current_user.role == 'admin'):
+        flash('Accès refusé. Réservé au manager et admin.', 'error')
+        return redirect(url_for('dashboard'))
+    job = report_jobs.get(job_id)
+    if not job or job.get('status') != 'done' or not os.path.exists(job.get('path', '')):
+        flash('Rapport introuvable ou pas encore prêt', 'error')
+        return redirect(url_for('generate_report'))
+    return send_file(os.path.abspath(job['path']), as_attachment=True, download_name=job['filename'], mimetype=job['mimetype'])
+
+INVENTORY_EXPORT_HEADERS = [
+    'Catégorie', 'ID', 'Désignation', 'Marque', 'Modèle', 'N° Série',
+    'Ancien CAB', 'Nouveau CAB', "Date d'inventaire", 'Quantité Totale',
+    'Disponible', 'Cassée', 'En Réparation', 'Statut', 'État', 'Description / Observation'
+]
+# Fixed widths replace the old autosize pass, which had to walk every cell a second time
+INVENTORY_EXPORT_WIDTHS = [18, 14, 30, 16, 16, 18, 16, 16, 16, 16, 12, 12, 14, 16, 14, 60]
+INVENTORY_EXPORT_TEXT_COLUMNS = (1, 5, 6, 7)  # ID, N° Série, Ancien CAB, Nouveau CAB
+
+def inventory_export_rows():
+    yield INVENTORY_EXPORT_HEADERS
     # Query items grouped by category then designation
-    items = list(mongo.db.cars.find().sort([('category', 1), ('designation', 1)]))
-    for it in items:
-        row = [
+    for it in mongo.db.cars.find().sort([('category', 1), ('designation', 1)]):
+        yield [
             it.get('category', ''),
             it.get('id', ''),
             it.get('designation', ''),
@@ -1222,22 +2135,30 @@ def export_inventory_excel():
             it.get('condition', ''),
             it.get('description', '')
         ]
-        ws.append(row)
 
-    # Force text format for sensitive columns to prevent Excel auto-formatting
-    sensitive_cols = ['B', 'F', 'G', 'H']  # ID, N° Série, Ancien CAB, Nouveau CAB
-    for col_letter in sensitive_cols:
-        for cell in ws[col_letter]:
-            cell.number_format = '@'
-
-    # Autosize columns
-    for column_cells in ws.columns:
-        length = max(len(str(cell.value or '')) for cell in column_cells)
-        ws.column_dimensions[column_cells[0].column_letter].width = min(max(length + 2, 12), 60)
+# Direct inventory Excel export (detailed) used by inventory page
+@app.route('/export/inventory-excel')
+@login_required
+def export_inventory_excel():
+    # Only manager and admin can export inventory
+    if not (is_manager() or current_user.role == 'admin'):
+        flash('Accès refusé. Réservé au manager et admin.', 'error')
+        return redirect(url_for('dashboard'))
+    return xlsx_response(
+        inventory_export_rows(), 'Inventaire', 'inventaire_detaille.xlsx',
+        column_widths=INVENTORY_EXPORT_WIDTHS,
+        text_columns=INVENTORY_EXPORT_TEXT_COLUMNS
+    )
 
-    wb.save(output)
-    output.seek(0)
-    return send_file(output, as_attachment=True, download_name='inventaire_detaille.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+# Direct inventory CSV export, streamed as the cursor is read
+@app.route('/export/inventory-csv')
+@login_required
+def export_inventory_csv():
+    # Only manager and admin can export inventory
+    if not (is_manager() or current_user.role == 'admin'):
+        flash('Accès refusé. Réservé au manager et admin.', 'error')
+        return redirect(url_for('dashboard'))
+    return csv_response(inventory_export_rows(), 'inventaire_detaille.csv')
 
 @app.route('/create-default-users')
 def create_default_users():
@@ -1257,34 +2178,102 @@ def create_default_users():
     })
     return Response('Default admin and staff users created.\nAdmin: admin/admin123\nStaff: staff/staff123', mimetype='text/plain')
 
+# Helper functions for the public catalog
+# Filters and pagination run in the query (backed by the catalog index in db_indexes.py)
+CATALOG_STATUSES = ['Disponible', 'Available']
+CATALOG_PAGE_SIZE = 24
+CATALOG_PROJECTION = {
+    '_id': 0, 'id': 1, 'designation': 1, 'marque': 1, 'modele': 1, 'n_serie': 1, 'description': 1,
+    'status': 1, 'category': 1, 'image': 1, 'quantite_disponible': 1, 'prix_journalier': 1,
+    'carburant': 1, 'transmission': 1, 'updated_at': 1
+}
+
+def _price_arg(name):
+    try:
+        value = float(request.args.get(name, ''))
+    except ValueError:
+        return None
+    return value if value >= 0 else None
+
+def catalog_query():
+    """Return the catalog query for the request filters and the filters that were applied"""
+    query = {'status': {'$in': CATALOG_STATUSES}, 'quantite_disponible': {'$gt': 0}}
+    filters = {}
+    for field in ('category', 'carburant', 'transmission'):
+        value = (request.args.get(field) or '').strip()
+        if value:
+            query[field] = value
+            filters[field] = value
+
+    price_range = {}
+    for name, operator in (('prix_min', '$gte'), ('prix_max', '$lte')):
+        value = _price_arg(name)
+        if value is not None:
+            price_range[operator] = value
+            filters[name] = request.args.get(name)
+    if price_range:
+        query['prix_journalier'] = price_range
+    return query, filters
+
+def catalog_filter_options():
+    """Return the categories, fuels and transmissions present in the catalog with one aggregation"""
+    pipeline = [
+        {'$match': {'status': {'$in': CATALOG_STATUSES}, 'quantite_disponible': {'$gt': 0}}},
+        {'$group': {
+            '_id': None,
+            'category': {'$addToSet': '$category'},
+            'carburant': {'$addToSet': '$carburant'},
+            'transmission': {'$addToSet': '$transmission'}
+        }}
+    ]
+    options = next(mongo.db.cars.aggregate(pipeline), None) or {}
+    return {
+        field: sorted((v for v in options.get(field, []) if v and str(v).strip()), key=lambda v: str(v).lower())
+        for field in ('category', 'carburant', 'transmission')
+    }
+
 @app.route('/')
 def index():
     # Public car catalog - no login required
+    # The page shows the user name in the navbar, so the ETag is per user (anonymous pages are shared)
+    user_key = current_user.get_id() if current_user.is_authenticated else 'anonymous'
+    etag = fleet_etag('catalog', user_key, sorted(request.args.items(multi=True)))
+    cache_control = 'private, no-cache' if current_user.is_authenticated else 'public, no-cache'
+    return conditional_response(etag, build_catalog_page, cache_control)
+
+def build_catalog_page():
     # Only show available car with available quantity > 0
-    items = list(mongo.db.cars.find({
-        '$or': [
-            {'status': 'Disponible'},
-            {'status': 'Available'}
-        ]
-    }).sort('designation', 1))
-    
-    # Filter items with available quantity > 0
-    available_items = []
+    query, filters = catalog_query()
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    total = mongo.db.cars.count_documents(query)
+    pages = max((total + CATALOG_PAGE_SIZE - 1) // CATALOG_PAGE_SIZE, 1)
+    page = min(page, pages)
+    items = list(
+        mongo.db.cars.find(query, CATALOG_PROJECTION)
+        .sort('designation', 1)
+        .skip((page - 1) * CATALOG_PAGE_SIZE)
+        .limit(CATALOG_PAGE_SIZE)
+    )
+
+    cards = [render_fragment('partials/catalog_card.html', item) for item in items]
     for item in items:
-        quantite_disponible = item.get('quantite_disponible', item.get('quantite_totale', 1))
-        if quantite_disponible > 0:
-            # Convert ObjectId to string for JSON serialization
-            if '_id' in item:
-                item['_id'] = str(item['_id'])
-            
-            # Don't overwrite the actual 'id' field with MongoDB _id
-            # The 'id' field should remain as the car's custom ID
-            item['created_at'] = item.get('created_at', '').strftime('%Y-%m-%d %H:%M') if item.get('created_at') else ''
-            item['updated_at'] = item.get('updated_at', '').strftime('%Y-%m-%d %H:%M') if item.get('updated_at') else ''
-            item['quantite_disponible'] = quantite_disponible
-            available_items.append(item)
-    
-    return render_template('public_catalog.html', items=available_items)
+        # Only needed for the fragment key; keeps the inline JSON of the page unchanged
+        item.pop('updated_at', None)
+
+    return render_template(
+        'public_catalog.html',
+        items=items,
+        cards=cards,
+        filters=filters,
+        filter_options=catalog_filter_options(),
+        page=page,
+        pages=pages,
+        total=total
+    )
 
 # Helper functions for role checks
 
@@ -1327,7 +2316,7 @@ def request_rental(item_id):
             return redirect(url_for('request_rental', item_id=item_id))
         
         # Create rental request
-        mongo.db.rental_requests.insert_one({
+        insert_rental_request({
             'item_id': item_id,
             'user_name': user_name,
             'user_email': user_email,
@@ -1362,59 +2351,93 @@ def staff_requests():
         flash('Accès refusé. Réservé au manager et admin.', 'error')
         return redirect(url_for('index'))
     
+    events_url = live_events_url()
     # Get all rental requests
     requests = list(mongo.db.rental_requests.find().sort('created_at', -1))
-    
+    cars_map = resolve_reservation_cars(requests)
+    available = pending_availability(requests)
     for reservation in requests:
-        reservation['id'] = str(reservation['_id'])
-        reservation['created_at'] = reservation.get('created_at', '').strftime('%Y-%m-%d %H:%M') if reservation.get('created_at') else ''
-        
-        # Format dates for template display
-        if reservation.get('start_date'):
-            if isinstance(reservation['start_date'], datetime):
-                reservation['start_date'] = reservation['start_date'].strftime('%Y-%m-%d')
-            else:
-                reservation['start_date'] = str(reservation['start_date'])
-        else:
-            reservation['start_date'] = 'N/A'
-            
-        if reservation.get('end_date'):
-            if isinstance(reservation['end_date'], datetime):
-                reservation['end_date'] = reservation['end_date'].strftime('%Y-%m-%d')
-            else:
-                reservation['end_date'] = str(reservation['end_date'])
-        else:
-            reservation['end_date'] = 'N/A'
-        
-        # Handle car name and quantity
-        if 'items' in reservation and reservation['items'] and isinstance(reservation['items'], list):
-            # Multi-item request
-            print(f"DEBUG: Multi-item reservation: {reservation['items']}")
-            item_names = []
-            total_quantity = 0
-            for item_data in reservation['items']:
-                if isinstance(item_data, dict):
-                    car = mongo.db.cars.find_one({'id': item_data.get('item_id')})
-                    if car:
-                        item_names.append(f"{car.get('designation', 'Unknown')} (x{item_data.get('quantity', 1)})")
-                        total_quantity += item_data.get('quantity', 1)
-                    else:
-                        item_names.append(f"Unknown (x{item_data.get('quantity', 1)})")
-                        total_quantity += item_data.get('quantity', 1)
-            
-            reservation['car_name'] = ' + '.join(item_names) if item_names else 'Unknown'
-            reservation['quantity'] = total_quantity
-        else:
-            # Single-item request (legacy)
-            print(f"DEBUG: Single-item reservation: {reservation.get('item_id')}")
-            car = mongo.db.cars.find_one({'id': reservation.get('item_id')})
-            reservation['car_name'] = car['designation'] if car else 'Unknown'
-            reservation['quantity'] = reservation.get('quantity', 1)
+        format_staff_request(reservation, cars_map, available)
     
     # Get all users for role checking
     users = list(mongo.db.users.find({}, {'username': 1, 'role': 1}))
     
-    return render_template('staff_requests.html', requests=requests, users=users)
+    return render_template('staff_requests.html', requests=requests, users=users, events_url=events_url)
+
+@app.route('/staff/requests/<string:req_id>/row')
+@login_required
+def staff_request_row(req_id):
+    """One row of the staff requests table, fetched by the page when a live event names it"""
+    if not (is_manager() or current_user.role == 'admin'):
+        return jsonify({'success': False, 'message': 'Accès refusé'}), 403
+    reservation = mongo.db.rental_requests.find_one({'_id': ObjectId(req_id)}) if ObjectId.is_valid(req_id) else None
+    if not reservation:
+        # Deleted meanwhile: the page removes the row
+        return '', 204
+    format_staff_request(reservation, resolve_reservation_cars([reservation]), pending_availability([reservation]))
+    users = list(mongo.db.users.find({'username': reservation.get('user_name')}, {'username': 1, 'role': 1}))
+    return render_template('partials/staff_request_row.html', reservation=reservation, users=users)
+
+# Helper functions for the staff requests table
+def pending_availability(reservations):
+    """Return {car id: units available} for the cars of the pending reservations"""
+    item_ids = collect_item_ids([r for r in reservations if r.get('status') in PENDING_STATUSES])
+    if not item_ids:
+        return {}
+    cars = mongo.db.cars.find({'id': {'$in': list(item_ids)}}, {'_id': 0, 'id': 1, 'quantite_disponible': 1, 'quantite_totale': 1})
+    return {car['id']: car.get('quantite_disponible', car.get('quantite_totale', 0)) for car in cars}
+
+def format_staff_request(reservation, cars_map, available):
+    """Prepare a rental request for the staff requests table"""
+    reservation['id'] = str(reservation['_id'])
+    reservation['created_at'] = reservation.get('created_at', '').strftime('%Y-%m-%d %H:%M') if reservation.get('created_at') else ''
+    
+    # Format dates for template display
+    if reservation.get('start_date'):
+        if isinstance(reservation['start_date'], datetime):
+            reservation['start_date'] = reservation['start_date'].strftime('%Y-%m-%d')
+        else:
+            reservation['start_date'] = str(reservation['start_date'])
+    else:
+        reservation['start_date'] = 'N/A'
+        
+    if reservation.get('end_date'):
+        if isinstance(reservation['end_date'], datetime):
+            reservation['end_date'] = reservation['end_date'].strftime('%Y-%m-%d')
+        else:
+            reservation['end_date'] = str(reservation['end_date'])
+    else:
+        reservation['end_date'] = 'N/A'
+    
+    # Handle car name and quantity
+    if 'items' in reservation and reservation['items'] and isinstance(reservation['items'], list):
+        # Multi-item request
+        item_names = []
+        total_quantity = 0
+        for item_data in reservation['items']:
+            if isinstance(item_data, dict):
+                car = cars_map.get(item_data.get('item_id'))
+                if car:
+                    item_names.append(f"{car.get('designation', 'Unknown')} (x{item_data.get('quantity', 1)})")
+                    total_quantity += item_data.get('quantity', 1)
+                else:
+                    item_names.append(f"Unknown (x{item_data.get('quantity', 1)})")
+                    total_quantity += item_data.get('quantity', 1)
+        
+        reservation['car_name'] = ' + '.join(item_names) if item_names else 'Unknown'
+        reservation['quantity'] = total_quantity
+    else:
+        # Single-item request (legacy)
+        car = cars_map.get(reservation.get('item_id'))
+        reservation['car_name'] = car.get('designation', 'Unknown') if car else 'Unknown'
+        reservation['quantity'] = reservation.get('quantity', 1)
+    
+    # Units left on each car, shown while the request waits for a decision
+    reservation['availability'] = [
+        (item_id, (cars_map.get(item_id) or {}).get('designation', item_id), available[item_id])
+        for item_id in sorted(collect_item_ids([reservation])) if item_id in available
+    ]
+    return reservation
 
 # Update approve_request route
 @app.route('/staff/approve-request/<string:req_id>')
@@ -1425,59 +2448,12 @@ def approve_request(req_id):
         flash('Accès refusé.', 'error')
         return redirect(url_for('index'))
     
-    request_obj = mongo.db.rental_requests.find_one({'_id': ObjectId(req_id)})
-    if request_obj:
-        # Handle both single-item and multi-item requests
-        if 'items' in request_obj:
-            # Multi-item request - quantities were already deducted when created
-            # Just update the status to approved
-            mongo.db.rental_requests.update_one(
-                {'_id': ObjectId(req_id)},
-                {'$set': {'status': 'Approved'}}
-            )
-            flash('Multi-item request approved successfully!', 'success')
-        else:
-            # Single-item request (legacy)
-            car = mongo.db.cars.find_one({'id': request_obj.get('item_id')})
-            if not car:
-                flash('Voiture non trouvée', 'error')
-                return redirect(url_for('staff_requests'))
-            
-            requested_quantity = request_obj.get('quantity', 1)
-            current_available = car.get('quantite_disponible', car.get('quantite_totale', 1))
-            
-            # Check if enough quantity is available
-            if requested_quantity > current_available:
-                flash(f'Pas assez d\'unités disponibles. Demandé: {requested_quantity}, Disponible: {current_available}', 'error')
-                return redirect(url_for('staff_requests'))
-            
-            # Calculate new available quantity
-            new_available = current_available - requested_quantity
-            
-            # Update request status
-            mongo.db.rental_requests.update_one(
-                {'_id': ObjectId(req_id)},
-                {'$set': {'status': 'Approved'}}
-            )
-            
-            # Update car quantity and status
-            update_fields = {
-                'quantite_disponible': new_available,
-                'updated_at': datetime.now()
-            }
-            
-            # If no units left, mark as unavailable
-            if new_available <= 0:
-                update_fields['status'] = 'Indisponible'
-            
-            mongo.db.cars.update_one(
-                {'id': request_obj.get('item_id')},
-                {'$set': update_fields}
-            )
-            
-            flash(f'Request approved successfully! {requested_quantity} units rented.', 'success')
-    else:
-        flash('Request not found', 'error')
+    try:
+        # Multi-item requests had their units deducted when created; single-item ones take them now
+        reservation_service.approve(ObjectId(req_id), f'{current_user.role}:{current_user.username}')
+        flash('Request approved successfully!', 'success')
+    except TransitionError as e:
+        flash(e.message, 'error')
     
     return redirect(url_for('staff_requests'))
 
@@ -1490,51 +2466,13 @@ def reject_request(req_id):
         flash('Accès refusé.', 'error')
         return redirect(url_for('index'))
     
-    request_obj = mongo.db.rental_requests.find_one({'_id': ObjectId(req_id)})
-    if request_obj:
-        
-        # Handle both single-item and multi-item requests
-        if 'items' in request_obj:
-            # Multi-item request - restore quantities for each item
-            for item_data in request_obj['items']:
-                car = mongo.db.cars.find_one({'id': item_data.get('item_id')})
-                if car:
-                    current_available = car.get('quantite_disponible', 0)
-                    requested_quantity = item_data.get('quantity', 1)
-                    new_available = current_available + requested_quantity
-                    
-                    # Update car quantity
-                    mongo.db.cars.update_one(
-                        {'id': item_data.get('item_id')},
-                        {'$set': {
-                            'quantite_disponible': new_available,
-                            'status': 'Disponible' if new_available > 0 else 'Indisponible',
-                            'updated_at': datetime.now()
-                        }}
-                    )
-        else:
-            # Single-item request - restore quantity
-            car = mongo.db.cars.find_one({'id': request_obj.get('item_id')})
-            if car:
-                current_available = car.get('quantite_disponible', 0)
-                requested_quantity = request_obj.get('quantity', 1)
-                new_available = current_available + requested_quantity
-                
-                # Update car quantity
-                mongo.db.cars.update_one(
-                    {'id': request_obj.get('item_id')},
-                    {'$set': {
-                        'quantite_disponible': new_available,
-                        'status': 'Disponible' if new_available > 0 else 'Indisponible',
-                        'updated_at': datetime.now()
-                    }}
-                )
-    
-    mongo.db.rental_requests.update_one(
-        {'_id': ObjectId(req_id)},
-        {'$set': {'status': 'Rejected'}}
-    )
-    flash('Request rejected successfully!', 'success')
+    try:
+        # Restore the quantities held by the request
+        reservation_service.reject(ObjectId(req_id), current_user.username)
+        flash('Request rejected successfully!', 'success')
+    except TransitionError as e:
+        flash(e.message, 'error')
+    
     return redirect(url_for('staff_requests'))
 
 # Add reset request status route
@@ -1546,7 +2484,7 @@ def reset_request_status(req_id):
         flash('Accès refusé.', 'error')
         return redirect(url_for('index'))
     
-    mongo.db.rental_requests.update_one(
+    update_rental_request(
         {'_id': ObjectId(req_id)},
         {'$set': {'status': 'En attente'}}
     )
@@ -1557,61 +2495,76 @@ def reset_request_status(req_id):
 @login_required
 def staff_cars_used():
     """Staff view of currently rented cars"""
-    print(f"DEBUG: staff_cars_used called by user: {current_user.username}, role: {current_user.role}")
-    
     if not (is_manager() or current_user.role == 'admin'):
-        print(f"DEBUG: Access denied for user {current_user.username} with role {current_user.role}")
         flash('Accès refusé', 'error')
         return redirect(url_for('dashboard'))
     
-    print(f"DEBUG: Access granted, proceeding to render template")
-    
+    events_url = live_events_url()
     # Get only APPROVED reservations that are currently in use (not completed, returned, rejected, or pending)
     active_reservations = list(mongo.db.rental_requests.find({
         'status': {'$in': ['Approved', 'Active']}  # Only show reservations that were actually approved and given to users
     }).sort('start_date', -1))
     
+    cars_map = resolve_reservation_cars(active_reservations)
+    
     # Format reservations for template
-    formatted_reservations = []
-    for r in active_reservations:
-        if 'items' in r and r['items']:
-            # Multi-item reservation
-            item_names = []
-            total_quantity = 0
-            for item_data in r['items']:
-                item_id = item_data.get('item_id', '')
-                quantity = item_data.get('quantity', 1)
-                designation = item_data.get('designation', '')
-                item_names.append(f"{designation} (x{quantity})")
-                total_quantity += quantity
-            
-            formatted_reservations.append({
-                'id': str(r.get('_id')),
-                'item_name': ' + '.join(item_names),
-                'user_name': r.get('user_name', ''),
-                'user_email': r.get('user_email', ''),
-                'quantity': total_quantity,
-                'start_date': r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                'end_date': r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                'purpose': r.get('purpose', ''),
-                'is_multi_item': True
-            })
-        else:
-            # Single item reservation (legacy)
-            car = mongo.db.cars.find_one({'id': r.get('item_id')}) or {}
-            formatted_reservations.append({
-                'id': str(r.get('_id')),
-                'item_name': car.get('designation', ''),
-                'user_name': r.get('user_name', ''),
-                'user_email': r.get('user_email', ''),
-                'quantity': r.get('quantity', 1),
-                'start_date': r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
-                'end_date': r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
-                'purpose': r.get('purpose', ''),
-                'is_multi_item': False
-            })
+    formatted_reservations = [format_rented_reservation(r, cars_map) for r in active_reservations]
     
-    return render_template('staff_rented_cars.html', reservations=formatted_reservations)
+    return render_template('staff_rented_cars.html', reservations=formatted_reservations, events_url=events_url)
+
+@app.route('/staff/cars-used/<string:reservation_id>/row')
+@login_required
+def staff_cars_used_row(reservation_id):
+    """One row of the rented cars table, fetched by the page when a live event names it"""
+    if not (is_manager() or current_user.role == 'admin'):
+        return jsonify({'success': False, 'message': 'Accès refusé'}), 403
+    reservation = mongo.db.rental_requests.find_one({
+        '_id': ObjectId(reservation_id), 'status': {'$in': ['Approved', 'Active']}
+    }) if ObjectId.is_valid(reservation_id) else None
+    if not reservation:
+        # Not (or no longer) in use: the page removes the row
+        return '', 204
+    row = format_rented_reservation(reservation, resolve_reservation_cars([reservation]))
+    return render_template('partials/rented_car_row.html', reservation=row)
+
+# Helper function formatting an approved reservation for the rented cars table
+def format_rented_reservation(r, cars_map):
+    if 'items' in r and r['items']:
+        # Multi-item reservation
+        item_names = []
+        total_quantity = 0
+        for item_data in r['items']:
+            item_id = item_data.get('item_id', '')
+            quantity = item_data.get('quantity', 1)
+            designation = item_data.get('designation', '')
+            item_names.append(f"{designation} (x{quantity})")
+            total_quantity += quantity
+        
+        return {
+            'id': str(r.get('_id')),
+            'item_name': ' + '.join(item_names),
+            'user_name': r.get('user_name', ''),
+            'user_email': r.get('user_email', ''),
+            'quantity': total_quantity,
+            'start_date': r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
+            'end_date': r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
+            'purpose': r.get('purpose', ''),
+            'is_multi_item': True
+        }
+    else:
+        # Single item reservation (legacy)
+        car = cars_map.get(r.get('item_id')) or {}
+        return {
+            'id': str(r.get('_id')),
+            'item_name': car.get('designation', ''),
+            'user_name': r.get('user_name', ''),
+            'user_email': r.get('user_email', ''),
+            'quantity': r.get('quantity', 1),
+            'start_date': r.get('start_date', '').strftime('%Y-%m-%d %H:%M') if r.get('start_date') else '',
+            'end_date': r.get('end_date', '').strftime('%Y-%m-%d %H:%M') if r.get('end_date') else '',
+            'purpose': r.get('purpose', ''),
+            'is_multi_item': False
+        }
 
 @app.route('/staff/return-car/<string:item_id>', methods=['GET', 'POST'])
 @login_required
@@ -1625,7 +2578,7 @@ def return_car(item_id):
     rental_request = mongo.db.rental_requests.find_one({
         '$or': [
             {'item_id': item_id, 'status': 'Approved'},
-            {'items.item_id': item_id, 'status': 'Approved'}
+            {'items': {'$elemMatch': {'item_id': item_id, 'status': {'$ne': 'Completed'}}}, 'status': 'Approved'}
         ]
     })
     
@@ -1666,51 +2619,13 @@ def return_car(item_id):
             flash('Veuillez sélectionner un statut', 'error')
             return redirect(url_for('return_car', item_id=item_id))
         
-        # Calculate new quantities based on status
-        quantite_disponible = current_available + rented_quantity
-        quantite_cassee = car.get('quantite_cassée', 0)
-        quantite_en_reparation = car.get('quantite_en_réparation', 0)
-        
-        # Adjust quantities based on selected status
-        if new_status == 'Cassée':
-            quantite_cassee += rented_quantity
-            quantite_disponible -= rented_quantity
-        elif new_status == 'En réparation':
-            quantite_en_reparation += rented_quantity
-            quantite_disponible -= rented_quantity
-        # For 'Disponible' and 'Indisponible', quantities stay as calculated above
-        
-        # Update car
-        update_fields = {
-            'quantite_disponible': quantite_disponible,
-            'quantite_cassée': quantite_cassee,
-            'quantite_en_réparation': quantite_en_reparation,
-            'status': new_status,
-            'updated_at': datetime.now()
-        }
-        
-        if notes:
-            update_fields['notes'] = notes
-        
-        mongo.db.cars.update_one(
-            {'id': item_id},
-            {'$set': update_fields}
-        )
-        
-        # Update the rental request status to Completed
-        # Handle both single-item and multi-item requests
-        if 'items' in rental_request:
-            # Multi-item request - update the specific item status
-            mongo.db.rental_requests.update_one(
-                {'_id': rental_request['_id']},
-                {'$set': {'items.$.status': 'Completed'}}
-            )
-        else:
-            # Single-item request
-            mongo.db.rental_requests.update_one(
-                {'item_id': item_id, 'status': 'Approved'},
-                {'$set': {'status': 'Completed'}}
-            )
+        try:
+            # The units go back to the counter of the chosen status, and the reservation is completed
+            # once all its cars are back, in one transition
+            reservation_service.return_item(rental_request['_id'], item_id, new_status, notes)
+        except TransitionError as e:
+            flash(e.message, 'error')
+            return redirect(url_for('return_car', item_id=item_id))
         
         flash(f'Équipement retourné avec succès! {rented_quantity} unités marquées comme "{new_status}".', 'success')
         return redirect(url_for('staff_cars_used'))
@@ -1750,14 +2665,14 @@ def edit_car(item_id):
             if not allowed_file(image_file.filename):
                 flash('Type de fichier invalide. Seuls JPG, PNG, GIF autorisés.', 'danger')
                 return redirect(request.url)
-            if len(image_file.read()) > app.config['MAX_CONTENT_LENGTH']:
+            try:
+                image_filename = store_uploaded_image(image_file)
+            except UploadTooLarge:
                 flash('Le fichier image est trop volumineux (max 2MB).', 'danger')
                 return redirect(request.url)
-            image_file.seek(0)
-            filename = secure_filename(image_file.filename)
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            image_file.save(image_path)
-            image_filename = filename
+            except InvalidImage:
+                flash('Le fichier n\'est pas une image valide.', 'danger')
+                return redirect(request.url)
         
         update_fields = {
             'id': id_car,
@@ -1784,7 +2699,7 @@ def edit_car(item_id):
         if image_filename:
             update_fields['image'] = image_filename
         
-        mongo.db.cars.update_one(
+        update_car(
             {'id': item_id},
             {'$set': update_fields}
         )
@@ -1863,13 +2778,13 @@ def delete_car(item_id):
         return redirect(url_for('inventory'))
     
     # Delete the car
-    mongo.db.cars.delete_one({'id': item_id})
+    remove_car({'id': item_id})
     
     # Also delete any related rental requests
     # Delete single-item requests
-    mongo.db.rental_requests.delete_many({'item_id': item_id})
+    delete_rental_requests({'item_id': item_id})
     # Delete multi-item requests that contain this item
-    mongo.db.rental_requests.delete_many({'items.item_id': item_id})
+    delete_rental_requests({'items.item_id': item_id})
     
     flash('Voiture supprimée avec succès!', 'success')
     return redirect(url_for('inventory'))
@@ -1975,6 +2890,7 @@ def edit_staff(staff_id):
             {'_id': ObjectId(staff_id)},
             {'$set': update_fields}
         )
+        user_cache.invalidate(staff_id)
         
         flash('Staff member updated successfully!', 'success')
         return redirect(url_for('admin_staff'))
@@ -2001,6 +2917,7 @@ def delete_staff(staff_id):
         return redirect(url_for('admin_staff'))
     
     mongo.db.users.delete_one({'_id': ObjectId(staff_id), 'role': {'$ne': 'admin'}})
+    user_cache.invalidate(staff_id)
     flash('User deleted successfully!', 'success')
     return redirect(url_for('admin_staff'))
 
@@ -2014,6 +2931,7 @@ def api_staff_requests():
     
     # Get all rental requests
     requests = list(mongo.db.rental_requests.find().sort('created_at', -1))
+    cars_map = resolve_reservation_cars(requests)
     
     # Process requests for JSON response
     processed_requests = []
@@ -2026,7 +2944,7 @@ def api_staff_requests():
             item_names = []
             for item_data in reservation['items']:
                 if isinstance(item_data, dict):
-                    car = mongo.db.cars.find_one({'id': item_data.get('item_id')})
+                    car = cars_map.get(item_data.get('item_id'))
                     if car:
                         item_names.append(f"{car.get('designation', 'Unknown')} (x{item_data.get('quantity', 1)})")
                     else:
@@ -2034,8 +2952,8 @@ def api_staff_requests():
             reservation['car_name'] = ' + '.join(item_names) if item_names else 'Unknown'
         else:
             # Single-item request (legacy)
-            car = mongo.db.cars.find_one({'id': reservation.get('item_id')})
-            reservation['car_name'] = car['designation'] if car else 'Unknown'
+            car = cars_map.get(reservation.get('item_id'))
+            reservation['car_name'] = car.get('designation', 'Unknown') if car else 'Unknown'
         
         # Convert datetime objects to strings for JSON
         if reservation.get('start_date'):
@@ -2064,148 +2982,102 @@ def mark_car_returned(reservation_id):
         # Validate ObjectId format
         try:
             object_id = ObjectId(reservation_id)
-        except Exception as e:
-            print(f"Invalid ObjectId format: {reservation_id}")
+        except Exception:
             return jsonify({'success': False, 'message': f'ID de réservation invalide: {reservation_id}'}), 400
         
         data = request.get_json()
         if not data:
-            print("No JSON data received")
             return jsonify({'success': False, 'message': 'Aucune donnée reçue'}), 400
             
         action = data.get('action')
-        print(f"Action received: {action}")
         
         if action == 'mark_returned':
-            # Find the reservation
-            reservation = mongo.db.rental_requests.find_one({'_id': object_id})
-            if not reservation:
-                print(f"Reservation not found: {reservation_id}")
-                return jsonify({'success': False, 'message': 'Réservation non trouvée'}), 404
-            
-            print(f"Found reservation: {reservation}")
-            
             # Get status selections from request
             status_selections = data.get('status_selections', [])
-            if not status_selections:
-                return jsonify({'success': False, 'message': 'Aucune sélection de statut fournie'}), 400
             
-            print(f"Status selections: {status_selections}")
+            # Returned units go to the counter of the selected status; the reservation is completed
+            reservation_service.mark_returned(object_id, status_selections)
             
-            # Handle both single-item and multi-item reservations
-            if 'items' in reservation and reservation['items']:
-                # Multi-item reservation
-                print("Processing multi-item reservation")
-                for item_data in reservation['items']:
-                    # Find corresponding status selection
-                    status_selection = next((s for s in status_selections if s['item_id'] == item_data.get('item_id')), None)
-                    if not status_selection:
-                        continue
-                    
-                    car = mongo.db.cars.find_one({'id': item_data.get('item_id')})
-                    if car:
-                        # Get current quantities
-                        current_available = car.get('quantite_disponible', 0)
-                        current_broken = car.get('quantite_cassée', 0)
-                        current_repair = car.get('quantite_en_réparation', 0)
-                        current_unavailable = car.get('quantite_indisponible', 0)
-                        current_lost = car.get('quantite_perdue', 0)
-                        
-                        returned_quantity = item_data.get('quantity', 1)
-                        new_status = status_selection['status']
-                        
-                        print(f"Updating car {item_data.get('item_id')}: status={new_status}, quantity={returned_quantity}")
-                        
-                        # Update quantities based on selected status
-                        update_fields = {
-                            'updated_at': datetime.now()
-                        }
-                        
-                        if new_status == 'Disponible':
-                            update_fields['quantite_disponible'] = current_available + returned_quantity
-                            update_fields['status'] = 'Disponible'
-                        elif new_status == 'Cassée':
-                            update_fields['quantite_cassée'] = current_broken + returned_quantity
-                            update_fields['status'] = 'Cassée'
-                        elif new_status == 'En réparation':
-                            update_fields['quantite_en_réparation'] = current_repair + returned_quantity
-                            update_fields['status'] = 'En réparation'
-                        elif new_status == 'Indisponible':
-                            update_fields['quantite_indisponible'] = current_unavailable + returned_quantity
-                            update_fields['status'] = 'Indisponible'
-                        elif new_status == 'Perdue':
-                            update_fields['quantite_perdue'] = current_lost + returned_quantity
-                            update_fields['status'] = 'Perdue'
-                        
-                        # Update car
-                        mongo.db.cars.update_one(
-                            {'id': item_data.get('item_id')},
-                            {'$set': update_fields}
-                        )
-            else:
-                # Single-item reservation (legacy)
-                print("Processing single-item reservation")
-                if len(status_selections) > 0:
-                    status_selection = status_selections[0]
-                    car = mongo.db.cars.find_one({'id': reservation.get('item_id')})
-                    if car:
-                        # Get current quantities
-                        current_available = car.get('quantite_disponible', 0)
-                        current_broken = car.get('quantite_cassée', 0)
-                        current_repair = car.get('quantite_en_réparation', 0)
-                        current_unavailable = car.get('quantite_indisponible', 0)
-                        current_lost = car.get('quantite_perdue', 0)
-                        
-                        returned_quantity = reservation.get('quantity', 1)
-                        new_status = status_selection['status']
-                        
-                        print(f"Updating car {reservation.get('item_id')}: status={new_status}, quantity={returned_quantity}")
-                        
-                        # Update quantities based on selected status
-                        update_fields = {
-                            'updated_at': datetime.now()
-                        }
-                        
-                        if new_status == 'Disponible':
-                            update_fields['quantite_disponible'] = current_available + returned_quantity
-                            update_fields['status'] = 'Disponible'
-                        elif new_status == 'Cassée':
-                            update_fields['quantite_cassée'] = current_broken + returned_quantity
-                            update_fields['status'] = 'Cassée'
-                        elif new_status == 'En réparation':
-                            update_fields['quantite_en_réparation'] = current_repair + returned_quantity
-                            update_fields['status'] = 'En réparation'
-                        elif new_status == 'Indisponible':
-                            update_fields['quantite_indisponible'] = current_unavailable + returned_quantity
-                            update_fields['status'] = 'Indisponible'
-                        elif new_status == 'Perdue':
-                            update_fields['quantite_perdue'] = current_lost + returned_quantity
-                            update_fields['status'] = 'Perdue'
-                        
-                        # Update car
-                        mongo.db.cars.update_one(
-                            {'id': reservation.get('item_id')},
-                            {'$set': update_fields}
-                        )
-            
-            # Update reservation status to 'Completed'
-            mongo.db.rental_requests.update_one(
-                {'_id': object_id},
-                {'$set': {'status': 'Completed', 'returned_at': datetime.now()}}
-            )
-            
-            print("Successfully marked as returned")
             return jsonify({'success': True, 'message': 'Matériel marqué comme retourné avec succès'})
         else:
-            print(f"Unknown action: {action}")
             return jsonify({'success': False, 'message': 'Action non reconnue'}), 400
             
+    except TransitionError as e:
+        return jsonify({'success': False, 'message': e.message}), e.status_code
     except Exception as e:
         print(f"Error marking car as returned: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'message': f'Erreur lors du marquage: {str(e)}'}), 500
 
+# Request timing and MongoDB command counts per route (see request_metrics)
+@app.before_request
+def start_request_metrics():
+    request_metrics.start_request()
+
+@app.after_request
+def finish_request_metrics(response):
+    request_metrics.finish_request(request.endpoint or 'unmatched', request.method, response.status_code, response.content_length)
+    return response
+
+@app.teardown_request
+def finish_failed_request_metrics(exc):
+    # after_request is skipped when a view raises; the record is still open then
+    if exc is not None:
+        request_metrics.finish_request(request.endpoint or 'unmatched', request.method, 500, None)
+
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    authorized = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not (current_user.is_authenticated and current_user.role == 'admin'):
+        return Response('Accès refusé\n', status=403, mimetype='text/plain')
+    return Response(request_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# Cache statistics (admin only) used to size the in-process caches
+@app.route('/api/admin/cache-stats')
+@login_required
+def cache_stats():
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Accès refusé'}), 403
+    return jsonify({'success': True, 'caches': {
+        'cars': car_lookup_cache.stats(),
+        'users': user_cache.stats(),
+        'fragments': fragment_cache.stats(),
+        'availability': availability_index.stats(),
+        'occupancy': occupancy_cache.stats(),
+        'image_variants': image_variant_cache.stats(),
+        'live_events': live_events.stats()
+    }})
+
+# Server-Sent Events for the staff pages (see live_events)
+@app.route('/api/staff/events')
+@login_required
+def staff_events():
+    if not (is_manager() or current_user.role == 'admin'):
+        return jsonify({'success': False, 'message': 'Accès refusé'}), 403
+    if not live_events_supported():
+        return jsonify({'success': False, 'message': 'Mises à jour en direct indisponibles avec ce serveur'}), 503
+    # A reconnecting EventSource sends the last id it got; the first connection uses the page's cursor
+    try:
+        subscription = live_events.subscribe(request.headers.get('Last-Event-ID') or request.args.get('after'))
+    except BrokerFull:
+        return jsonify({'success': False, 'message': 'Trop de connexions en direct, réessayez plus tard'}), 503
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            yield from subscription.stream(app.config['LIVE_EVENTS_HEARTBEAT'])
+        finally:
+            subscription.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        # X-Accel-Buffering: no keeps nginx from holding the events back
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # Shutdown endpoint for the launcher
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
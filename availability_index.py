@@ -0,0 +1,140 @@
+"""
+In-memory index of the reservation windows holding car units, per car.
+For each car the windows are swept into a step function: sorted boundary times and the number of
+units booked between two consecutive boundaries, with a sparse table over those levels. "How many
+units of car X are booked at some point between T1 and T2" is then two bisections and one range
+maximum: O(log n) in the number of windows of that car.
+The index is rebuilt from rental_requests when it is first used or when the rental_requests data
+version moved without it; writes made in this process are applied incrementally, car by car.
+"""
+
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from reservation_service import holds_units, reservation_lines
+
+
+def reservation_window(reservation):
+    """Return (start, end) of a reservation, or None when its dates are missing or inverted"""
+    start, end = reservation.get('start_date'), reservation.get('end_date')
+    if not isinstance(start, datetime) or not isinstance(end, datetime) or end <= start:
+        return None
+    return start, end
+
+
+class CarTimeline:
+    def __init__(self):
+        self.windows = {}
+        self.times = []
+        self.levels = []
+        self._sparse = []
+
+    def set_window(self, reservation_id, start, end, quantity):
+        self.windows[reservation_id] = (start, end, quantity)
+
+    def rebuild(self):
+        deltas = {}
+        for start, end, quantity in self.windows.values():
+            deltas[start] = deltas.get(start, 0) + quantity
+            deltas[end] = deltas.get(end, 0) - quantity
+        self.times = sorted(deltas)
+        self.levels = []
+        level = 0
+        for moment in self.times:
+            level += deltas[moment]
+            self.levels.append(level)
+        # _sparse[k][i] is the highest level among levels[i:i + 2**k]
+        self._sparse = [self.levels]
+        width = 1
+        while width * 2 <= len(self.levels):
+            previous = self._sparse[-1]
+            self._sparse.append([max(previous[i], previous[i + width]) for i in range(len(previous) - width)])
+            width *= 2
+
+    def peak(self, start, end):
+        """Highest number of units booked at any moment of [start, end)"""
+        # Level i holds from times[i] to times[i + 1]; before times[0] nothing is booked
+        first = max(bisect_right(self.times, start) - 1, 0)
+        last = bisect_left(self.times, end) - 1
+        if last < first:
+            return 0
+        k = (last - first + 1).bit_length() - 1
+        return max(self._sparse[k][first], self._sparse[k][last - (1 << k) + 1])
+
+
+class AvailabilityIndex:
+    def __init__(self, load_reservations):
+        # load_reservations() returns every reservation that may hold units
+        self.load_reservations = load_reservations
+        self.version = None
+        self.rebuilds = 0
+        self._timelines = {}
+        self._cars_of = {}
+        self._lock = threading.Lock()
+
+    def _rebuild(self, version):
+        self._timelines = {}
+        self._cars_of = {}
+        for reservation in self.load_reservations():
+            self._add(reservation)
+        for timeline in self._timelines.values():
+            timeline.rebuild()
+        self.version = version
+        self.rebuilds += 1
+
+    def _add(self, reservation):
+        window = reservation_window(reservation)
+        if window is None or not holds_units(reservation):
+            return set()
+        quantities = {}
+        for item_id, quantity in reservation_lines(reservation):
+            quantities[item_id] = quantities.get(item_id, 0) + quantity
+        for item_id, quantity in quantities.items():
+            self._timelines.setdefault(item_id, CarTimeline()).set_window(reservation['_id'], window[0], window[1], quantity)
+        self._cars_of[reservation['_id']] = set(quantities)
+        return set(quantities)
+
+    def booked_units(self, item_ids, start, end, version):
+        """Return {car id: highest number of units booked during [start, end)} as of data version"""
+        with self._lock:
+            if self.version != version:
+                self._rebuild(version)
+            booked = {}
+            for item_id in item_ids:
+                timeline = self._timelines.get(item_id)
+                booked[item_id] = timeline.peak(start, end) if timeline else 0
+            return booked
+
+    def apply(self, changes, version):
+        """Record one write made by this process: changes is [(reservation id, new state or None once
+        deleted)], version the rental_requests data version right after the write"""
+        with self._lock:
+            if self.version is None or version != self.version + 1:
+                # Another write went in meanwhile (or nothing was built yet): rebuild on next use
+                self.version = None
+                return
+            changed = set()
+            for reservation_id, reservation in changes:
+                cars = self._cars_of.pop(reservation_id, set())
+                for item_id in cars:
+                    self._timelines[item_id].windows.pop(reservation_id, None)
+                changed |= cars
+                if reservation is not None:
+                    changed |= self._add(dict(reservation, _id=reservation_id))
+            for item_id in changed:
+                self._timelines[item_id].rebuild()
+            self.version = version
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cars': len(self._timelines),
+                'reservations': len(self._cars_of),
+                'version': self.version,
+                'rebuilds': self.rebuilds
+            }
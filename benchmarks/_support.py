@@ -0,0 +1,196 @@
+"""
+Shared setup of the benchmark scripts.
+The app runs against the database named by BENCH_MONGO_URI, or against mongomock with --mongomock
+(call counts and memory are then meaningful, timings much less so). The seed functions empty the
+collections they fill: never point BENCH_MONGO_URI at a database you care about.
+--app-dir runs the same script against another checkout of the app, e.g. a git worktree of the
+commit before a change, to compare before and after.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_MONGO_URI = os.environ.get('BENCH_MONGO_URI', 'mongodb://localhost:27017/voiture_de_location_bench')
+PASSWORD = 'bench'
+CATEGORIES = ['Citadine', 'Berline', 'SUV', 'Utilitaire']
+
+
+def argument_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--mongomock', action='store_true', help='Use an in-memory mongomock database.')
+    parser.add_argument('--app-dir', default=REPO_DIR, help='Checkout of the app to benchmark (default: this one).')
+    return parser
+
+
+def load_app(args, **environ):
+    """Import app.py from args.app_dir wired to the benchmark database; return (app module, db)"""
+    os.environ['MONGO_URI'] = BENCH_MONGO_URI
+    os.environ.setdefault('ENSURE_INDEXES', 'False')
+    os.environ.setdefault('REQUEST_LOG', 'False')
+    os.environ.update(environ)
+    app_dir = os.path.abspath(args.app_dir)
+    sys.path.insert(0, app_dir)
+    # UPLOAD_FOLDER and the templates are relative to the checkout
+    os.chdir(app_dir)
+    import app as app_module
+    if not args.mongomock:
+        return app_module, app_module.mongo.db
+    import mongomock
+    client = mongomock.MongoClient()
+    db = client['voiture_de_location_bench']
+    app_module.mongo.cx = client
+    app_module.mongo.db = db
+    # Older checkouts do not have every component
+    if hasattr(app_module, 'report_jobs'):
+        app_module.report_jobs.collection = db.report_jobs
+    if hasattr(app_module, 'reservation_service'):
+        app_module.reservation_service.client = client
+        app_module.reservation_service.db = db
+    return app_module, db
+
+
+def seed_users(app_module, db, rounds=4):
+    db.users.delete_many({})
+    password = app_module.bcrypt.generate_password_hash(PASSWORD, rounds).decode()
+    db.users.insert_many([
+        {'username': username, 'password': password, 'role': role}
+        for username, role in (('admin', 'admin'), ('manager', 'manager'), ('user', 'utilisateur'))
+    ])
+
+
+def seed_cars(db, count):
+    db.cars.delete_many({})
+    now = datetime.now()
+    db.cars.insert_many([{
+        'id': f'CAR{index:05d}', 'designation': f'Voiture {index}', 'category': CATEGORIES[index % len(CATEGORIES)],
+        'marque': 'Renault', 'modele': f'Modèle {index % 40}', 'numero_serie': f'SN{index:08d}',
+        'status': 'Disponible', 'condition': 'Bon état', 'quantite_totale': 5, 'quantite_disponible': 5,
+        'quantite_cassée': 0, 'quantite_en_réparation': 0, 'prix_journalier': 40 + index % 60,
+        'carburant': 'Essence', 'transmission': 'Manuelle', 'image': None,
+        'description': 'Véhicule de la flotte de démonstration', 'created_at': now, 'updated_at': now
+    } for index in range(count)])
+
+
+def seed_reservations(db, count, cars, batch_size=5000):
+    """Insert count reservations over cars cars, two thirds of them multi-item carts"""
+    db.rental_requests.delete_many({})
+    now = datetime.now()
+    statuses = ['En attente', 'Approved', 'Completed', 'Rejected']
+    for start in range(0, count, batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, count)):
+            reservation = {
+                'user_name': 'user', 'user_email': 'user', 'purpose': 'Déplacement professionnel',
+                'start_date': now + timedelta(days=index % 90), 'end_date': now + timedelta(days=index % 90 + 3),
+                'status': statuses[index % len(statuses)], 'created_at': now - timedelta(minutes=index)
+            }
+            if index % 3 == 0:
+                reservation.update(item_id=f'CAR{index % cars:05d}', quantity=1)
+            else:
+                reservation['items'] = [
+                    {'item_id': f'CAR{(index + offset) % cars:05d}', 'designation': '', 'quantity': 1}
+                    for offset in range(3)
+                ]
+            batch.append(reservation)
+        db.rental_requests.insert_many(batch)
+
+
+def client_as(app_module, username):
+    client = app_module.app.test_client()
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit(f'login as {username} failed ({response.status_code})')
+    return client
+
+
+class CallCounter:
+    """Count the collection method calls (one per query or write sent to the server), per collection"""
+
+    METHODS = ('find', 'find_one', 'aggregate', 'count_documents', 'distinct', 'insert_one', 'insert_many',
+               'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many', 'bulk_write',
+               'find_one_and_update', 'find_one_and_delete')
+
+    def __init__(self, db):
+        self.collection_class = type(db['cars'])
+        self.calls = {}
+        self._originals = {}
+        # mongomock implements some methods with others: only the outermost call is counted
+        self._depth = threading.local()
+
+    def __enter__(self):
+        for name in self.METHODS:
+            original = getattr(self.collection_class, name)
+            self._originals[name] = original
+            setattr(self.collection_class, name, self._counting(original))
+        return self
+
+    def __exit__(self, *exc):
+        for name, original in self._originals.items():
+            setattr(self.collection_class, name, original)
+
+    def _counting(self, original):
+        def counting(collection, *args, **kwargs):
+            depth = getattr(self._depth, 'value', 0)
+            if not depth:
+                self.calls[collection.name] = self.calls.get(collection.name, 0) + 1
+            self._depth.value = depth + 1
+            try:
+                return original(collection, *args, **kwargs)
+            finally:
+                self._depth.value = depth
+        return counting
+
+    def reset(self):
+        self.calls.clear()
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+
+def current_rss():
+    """Resident set size of this process in bytes (Linux)"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class PeakRss:
+    """Sample the RSS every few milliseconds; peak is the highest value above the RSS at entry"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            time.sleep(self.interval)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    @property
+    def growth(self):
+        return self.peak - self.baseline
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
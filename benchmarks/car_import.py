@@ -0,0 +1,77 @@
+"""
+Throughput of the bulk car import (user-023).
+Generates a CSV and an XLSX file of --rows cars, times reading and validating each one, then
+imports the CSV twice through the app's importer (all new cars, then all existing ones) and
+reports the rows per second and the collection calls per batch. Write times under mongomock say
+little about a real server; the call counts hold for both.
+"""
+
+import csv
+import os
+import tempfile
+import time
+
+from openpyxl import Workbook
+
+import _support
+
+COLUMNS = ['id', 'designation', 'category', 'marque', 'modele', 'quantity', 'prix_journalier',
+           'carburant', 'transmission', 'status', 'description']
+
+
+def generated_rows(count):
+    for index in range(count):
+        yield [f'IMP{index:06d}', f'Voiture {index}', _support.CATEGORIES[index % 4], 'Peugeot',
+               f'Modèle {index % 30}', 1 + index % 5, 35 + index % 70, 'Diesel', 'Automatique',
+               'Disponible', 'Importée depuis le parc de la nouvelle agence']
+
+
+def write_files(directory, count):
+    csv_path = os.path.join(directory, 'cars.csv')
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(generated_rows(count))
+    xlsx_path = os.path.join(directory, 'cars.xlsx')
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(COLUMNS)
+    for row in generated_rows(count):
+        sheet.append(row)
+    workbook.save(xlsx_path)
+    return csv_path, xlsx_path
+
+
+def main():
+    parser = _support.argument_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000, help='Cars in the generated files.')
+    parser.add_argument('--batch-size', type=int, default=500, help='Cars per bulk_write.')
+    args = parser.parse_args()
+
+    app_module, db = _support.load_app(args)
+    from car_import import parse_row, read_rows
+
+    csv_path, xlsx_path = write_files(tempfile.mkdtemp(), args.rows)
+    for path in (csv_path, xlsx_path):
+        started = time.perf_counter()
+        with open(path, 'rb') as f:
+            invalid = sum(1 for _, raw in read_rows(f, path) if parse_row(raw)[1])
+        elapsed = time.perf_counter() - started
+        print(f'read + validate {os.path.basename(path)}: {args.rows} rows in {elapsed:.2f}s '
+              f'({args.rows / elapsed:.0f} rows/s), {invalid} invalid')
+
+    db.cars.delete_many({})
+    batches = -(-args.rows // args.batch_size)
+    with _support.CallCounter(db) as counter, app_module.app.app_context():
+        for label in ('new cars', 'existing cars'):
+            counter.reset()
+            started = time.perf_counter()
+            with open(csv_path, 'rb') as f:
+                report = app_module.car_importer(args.batch_size).run(read_rows(f, csv_path))
+            elapsed = time.perf_counter() - started
+            print(f'import {label}: {report.inserted} inserted, {report.updated} updated, {len(report.errors)} rejected '
+                  f'in {elapsed:.2f}s ({args.rows / elapsed:.0f} rows/s), {counter.total / batches:.1f} calls per batch')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Peak memory and time to first byte of the report and inventory exports (user-006).
+Seeds --rows reservations (100k by default) over --cars cars, then downloads each export once
+and reports the time to the first body chunk, the total time, the size and how much the RSS of
+the process grew while the export ran. Routes the checkout does not have are skipped, so the
+same command measures the buffered exports before the change and the streamed ones after:
+
+    git worktree add /tmp/before cc581e2^
+    python benchmarks/export_streaming.py --app-dir /tmp/before
+    python benchmarks/export_streaming.py
+"""
+
+import gc
+import time
+
+import _support
+
+ROUTES = [
+    '/export-report/excel?report_type=reservations',
+    '/export-report/csv?report_type=reservations',
+    '/export-report/excel?report_type=inventory',
+    '/export-report/csv?report_type=inventory',
+    '/export/inventory-excel',
+    '/export/inventory-csv',
+]
+
+
+def download(client, url):
+    started = time.perf_counter()
+    response = client.get(url, buffered=False)
+    if response.status_code != 200:
+        response.close()
+        return None
+    first_byte = None
+    size = 0
+    for chunk in response.response:
+        if chunk and first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+    response.close()
+    return first_byte, time.perf_counter() - started, size
+
+
+def main():
+    parser = _support.argument_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='Reservations to seed.')
+    parser.add_argument('--cars', type=int, default=2000, help='Cars to seed.')
+    args = parser.parse_args()
+
+    app_module, db = _support.load_app(args)
+    _support.seed_users(app_module, db)
+    _support.seed_cars(db, args.cars)
+    _support.seed_reservations(db, args.rows, args.cars)
+    client = _support.client_as(app_module, 'manager')
+    print(f'{args.rows} reservations, {args.cars} cars ({args.app_dir})')
+    print(f'{"route":48} {"first byte":>10} {"total":>8} {"size":>9} {"peak RSS":>9}')
+    for url in ROUTES:
+        gc.collect()
+        with _support.PeakRss() as rss:
+            result = download(client, url)
+        if result is None:
+            print(f'{url:48} {"(not in this checkout)":>38}')
+            continue
+        first_byte, total, size = result
+        print(f'{url:48} {first_byte * 1000:8.0f}ms {total:7.2f}s {_support.format_bytes(size):>9} '
+              f'{"+" + _support.format_bytes(rss.growth):>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Login throughput under a burst of simultaneous logins (user-013).
+Hashes the users' passwords at --rounds, times a few logins one after the other, then fires
+--logins logins at once from as many threads and counts the verified ones (302), the ones
+refused because the hashing pool is saturated (503) and the others. Compare with the commit
+before the pool, where every login runs bcrypt in its request thread:
+
+    git worktree add /tmp/before 9025540^
+    python benchmarks/login_throughput.py --mongomock --app-dir /tmp/before
+    python benchmarks/login_throughput.py --mongomock
+"""
+
+import os
+import threading
+import time
+
+import _support
+
+
+def login(app_module):
+    client = app_module.app.test_client()
+    return client.post('/login', data={'username': 'user', 'password': _support.PASSWORD}).status_code
+
+
+def main():
+    parser = _support.argument_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost factor.')
+    parser.add_argument('--logins', type=int, default=30, help='Simultaneous logins.')
+    parser.add_argument('--sequential', type=int, default=5, help='Logins timed one after the other.')
+    args = parser.parse_args()
+
+    app_module, db = _support.load_app(args, BCRYPT_LOG_ROUNDS=str(args.rounds))
+    _support.seed_users(app_module, db, rounds=args.rounds)
+    print(f'cost {args.rounds}, {os.cpu_count()} CPU(s) ({args.app_dir})')
+
+    # The first login also starts the hashing pool, when there is one
+    login(app_module)
+    started = time.perf_counter()
+    for _ in range(args.sequential):
+        login(app_module)
+    print(f'sequential: {(time.perf_counter() - started) / args.sequential * 1000:.0f} ms per login')
+
+    statuses = []
+    barrier = threading.Barrier(args.logins)
+
+    def burst():
+        barrier.wait()
+        statuses.append(login(app_module))
+
+    threads = [threading.Thread(target=burst) for _ in range(args.logins)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    verified = statuses.count(302)
+    refused = statuses.count(503)
+    print(f'burst of {args.logins}: {verified} verified, {refused} refused, '
+          f'{len(statuses) - verified - refused} other in {elapsed:.2f}s ({verified / elapsed:.1f} logins/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Pages per second of the tabular PDF reports (user-008).
+By default seeds --rows cars (inventory) or reservations and renders the report end to end
+through build_report_pdf into a temporary file. --synthetic skips the database and feeds generated
+rows of the report's columns straight to PdfTableRenderer, which isolates the layout cost.
+Under mongomock the reservations report spends most of its time in the $lookup emulation.
+"""
+
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import _support
+
+
+def synthetic_rows(report_type, count):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M')
+    for index in range(count):
+        if report_type == 'reservations':
+            yield [f'Voiture {index % 2000}', _support.CATEGORIES[index % 4], 'user', 'user@example.com', 1,
+                   now, now, 'Approved', 'Déplacement professionnel vers le site client ' * (1 + index % 3)]
+        else:
+            yield [f'CAR{index:05d}', f'Voiture {index}', _support.CATEGORIES[index % 4], 'Renault',
+                   f'Modèle {index % 40}', f'SN{index:08d}', '', '', 'Disponible', now, 5, 5, 0, 0,
+                   'Véhicule de la flotte de démonstration ' * (1 + index % 4)]
+
+
+def main():
+    parser = _support.argument_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--report', choices=['inventory', 'reservations'], default='reservations')
+    parser.add_argument('--rows', type=int, default=20000, help='Cars or reservations to render.')
+    parser.add_argument('--synthetic', action='store_true', help='Render generated rows without the database.')
+    args = parser.parse_args()
+
+    app_module, db = _support.load_app(args)
+    if not args.synthetic:
+        if args.report == 'inventory':
+            _support.seed_cars(db, args.rows)
+        else:
+            _support.seed_cars(db, 2000)
+            _support.seed_reservations(db, args.rows, 2000)
+
+    path = os.path.join(tempfile.mkdtemp(), 'report.pdf')
+    with _support.PeakRss() as rss:
+        started = time.perf_counter()
+        if args.synthetic:
+            renderer = app_module.PdfTableRenderer(
+                path, app_module.PDF_REPORT_TITLES[args.report], app_module.PDF_REPORT_COLUMNS[args.report]
+            )
+            pages = renderer.render(synthetic_rows(args.report, args.rows))
+        else:
+            with app_module.app.app_context():
+                pages = app_module.build_report_pdf(args.report, path)
+        elapsed = time.perf_counter() - started
+    source = 'synthetic rows' if args.synthetic else 'database'
+    print(f'{args.report}: {args.rows} {source} -> {pages} pages in {elapsed:.2f}s '
+          f'({pages / elapsed:.0f} pages/s), {_support.format_bytes(os.path.getsize(path))}, '
+          f'peak RSS +{_support.format_bytes(rss.growth)}')
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Database calls per page of the staff views that resolve reservation cars (user-001).
+Seeds reservations at several history sizes and counts the collection calls of one request to
+each view; a view that looks its cars up one by one grows with the history, a batched one stays
+flat. The car lookup cache, when the checkout has one, is emptied before every request so the
+cold cost is measured. Calls are counted even when the view fails afterwards (marked *).
+Compare with the commit before the change:
+
+    git worktree add /tmp/before 271d114^
+    python benchmarks/query_counts.py --mongomock --app-dir /tmp/before
+    python benchmarks/query_counts.py --mongomock
+"""
+
+import contextlib
+import os
+
+import _support
+
+ROUTES = ['/staff/requests', '/api/staff/requests', '/staff/cars-used', '/api/reservation/{reservation_id}']
+
+
+def main():
+    parser = _support.argument_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='30,300,3000', help='Comma-separated reservation counts.')
+    parser.add_argument('--cars', type=int, default=200, help='Cars to seed.')
+    args = parser.parse_args()
+
+    app_module, db = _support.load_app(args)
+    _support.seed_users(app_module, db)
+    _support.seed_cars(db, args.cars)
+    client = _support.client_as(app_module, 'manager')
+    sizes = [int(size) for size in args.sizes.split(',')]
+    print(f'database calls per request ({args.app_dir})')
+    print(f'{"route":36}' + ''.join(f'{size:>10}' for size in sizes))
+    counts = {route: [] for route in ROUTES}
+    with _support.CallCounter(db) as counter, open(os.devnull, 'w') as devnull:
+        for size in sizes:
+            _support.seed_reservations(db, size, args.cars)
+            reservation_id = db.rental_requests.find_one({'items': {'$exists': True}})['_id']
+            for route in ROUTES:
+                if hasattr(app_module, 'car_lookup_cache'):
+                    app_module.car_lookup_cache.invalidate()
+                counter.reset()
+                # Some views print debug lines for every reservation
+                with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+                    response = client.get(route.format(reservation_id=reservation_id))
+                counts[route].append(f'{counter.total}{"" if response.status_code == 200 else "*"}')
+    for route, values in counts.items():
+        print(f'{route:36}' + ''.join(f'{value:>10}' for value in values))
+
+
+if __name__ == '__main__':
+    main()
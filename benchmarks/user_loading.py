@@ -0,0 +1,61 @@
+"""
+Database calls made to load the logged-in user (user-012).
+Sends --requests authenticated requests to a JSON route and counts the users collection calls,
+then times load_user() directly with a warm cache and with an empty one (one users query each).
+Compare with the commit before the cache:
+
+    git worktree add /tmp/before dfb7ca1^
+    python benchmarks/user_loading.py --mongomock --app-dir /tmp/before
+    python benchmarks/user_loading.py --mongomock
+"""
+
+import time
+
+import _support
+
+ROUTE = '/api/available-items'
+
+
+def time_per_call(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = _support.argument_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100, help='Authenticated requests to send.')
+    parser.add_argument('--repeat', type=int, default=10000, help='load_user() calls to time.')
+    args = parser.parse_args()
+
+    app_module, db = _support.load_app(args)
+    _support.seed_users(app_module, db)
+    _support.seed_cars(db, 20)
+    client = _support.client_as(app_module, 'user')
+    user_id = str(db.users.find_one({'username': 'user'})['_id'])
+    user_cache = getattr(app_module, 'user_cache', None)
+
+    with _support.CallCounter(db) as counter:
+        for _ in range(args.requests):
+            client.get(ROUTE)
+        users_calls = counter.calls.get('users', 0)
+    print(f'{args.requests} requests to {ROUTE}: {users_calls} users calls ({args.app_dir})')
+
+    with app_module.app.test_request_context():
+        warm = time_per_call(lambda: app_module.load_user(user_id), args.repeat)
+
+        def cold():
+            if user_cache is not None:
+                user_cache.invalidate()
+            app_module.load_user(user_id)
+
+        cold_time = time_per_call(cold, max(args.repeat // 10, 1))
+    if user_cache is None:
+        print(f'load_user: {warm * 1e6:.1f} us per call (no user cache in this checkout)')
+    else:
+        print(f'load_user: {warm * 1e6:.1f} us per call with a warm cache, {cold_time * 1e6:.1f} us with an empty one')
+
+
+if __name__ == '__main__':
+    main()
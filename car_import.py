@@ -0,0 +1,298 @@
+"""
+Bulk car import from CSV or XLSX files.
+Rows are read one at a time (csv reader, openpyxl in read-only mode), validated against the fields
+the add-item form writes, and upserted by id with one bulk_write per batch. New cars get their
+quantity counters like add_item(); for existing cars the descriptive fields are replaced and a
+quantity change moves quantite_totale and quantite_disponible by the same difference, so units
+out on rental or out of service are left alone. A decrease is conditional on enough units still
+being available when it is written, and a row whose car changed or disappeared in the meantime is
+reported instead of counted. Only the columns present in the file are written to
+existing cars; the add-item defaults (price, fuel, ...) only fill in new ones. Invalid rows are
+skipped and reported.
+Columns are matched by field name (id, designation, ...) or by the inventory export headers, so an
+export can be edited and imported back; unknown columns are ignored.
+"""
+
+import csv
+import io
+import re
+import unicodedata
+from datetime import date, datetime
+
+from bson.objectid import ObjectId
+from openpyxl import load_workbook
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DEFAULT_BATCH_SIZE = 500
+CARBURANTS = ('Essence', 'Diesel', 'Hybride', 'Électrique')
+TRANSMISSIONS = ('Manuelle', 'Automatique')
+STATUSES = ('Disponible', 'Indisponible', 'Cassée', 'En réparation', 'Nécessite une réparation')
+TEXT_FIELDS = ('designation', 'category', 'marque', 'modele', 'n_serie', 'ancien_cab', 'nouveau_cab', 'date_inv', 'description')
+REQUIRED_FIELDS = ('designation', 'category')
+# Values given to a new car for the columns the file leaves out or empty, as the add-item form does
+NEW_CAR_DEFAULTS = dict({field: '' for field in TEXT_FIELDS}, quantity=1, prix_journalier=0.0, carburant='Essence',
+                        transmission='Manuelle', status='Disponible')
+# Normalised column header -> field
+COLUMN_ALIASES = {
+    'id': 'id',
+    'designation': 'designation',
+    'category': 'category',
+    'categorie': 'category',
+    'marque': 'marque',
+    'modele': 'modele',
+    'n_serie': 'n_serie',
+    'ancien_cab': 'ancien_cab',
+    'nouveau_cab': 'nouveau_cab',
+    'date_inv': 'date_inv',
+    'date_d_inventaire': 'date_inv',
+    'quantity': 'quantity',
+    'quantite': 'quantity',
+    'quantite_totale': 'quantity',
+    'prix_journalier': 'prix_journalier',
+    'prix': 'prix_journalier',
+    'carburant': 'carburant',
+    'transmission': 'transmission',
+    'status': 'status',
+    'statut': 'status',
+    'description': 'description',
+    'description_observation': 'description',
+}
+
+
+class ImportFileError(Exception):
+    pass
+
+
+def _normalise_header(header):
+    text = unicodedata.normalize('NFKD', str(header or '')).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        # XLSX stores numeric ids and codes as floats
+        return str(int(value))
+    return str(value).strip()
+
+
+def _rows(header, records):
+    fields = [COLUMN_ALIASES.get(_normalise_header(column)) for column in header]
+    if 'id' not in fields:
+        raise ImportFileError('Colonne "id" introuvable')
+    for line, values in records:
+        if not any(value not in (None, '') for value in values):
+            continue
+        yield line, {field: value for field, value in zip(fields, values) if field}
+
+
+def read_rows(stream, filename):
+    """Yield (line number, {field: raw value}) for every non-empty row of a CSV or XLSX stream"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'xlsx':
+        try:
+            workbook = load_workbook(stream, read_only=True, data_only=True)
+        except Exception as e:
+            raise ImportFileError(f'Fichier XLSX illisible: {e}')
+        try:
+            records = enumerate(workbook.active.iter_rows(values_only=True), 1)
+            first = next(records, None)
+            if first is None:
+                return
+            yield from _rows(first[1], records)
+        finally:
+            workbook.close()
+    elif extension == 'csv':
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        sample = text.readline()
+        # Spreadsheets exported with a French locale separate columns with ';'
+        delimiter = ';' if sample.count(';') > sample.count(',') else ','
+        reader = csv.reader(text, delimiter=delimiter)
+        header = next(csv.reader([sample], delimiter=delimiter), [])
+        yield from _rows(header, ((reader.line_num + 1, values) for values in reader))
+    else:
+        raise ImportFileError('Format non supporté (CSV ou XLSX attendu)')
+
+
+def parse_row(raw):
+    """Return (fields, errors) for one row; fields only holds the columns the row provides
+
+    Empty cells of the text columns are kept (they clear the value); empty quantity, price, fuel,
+    transmission or status cells count as not provided.
+    """
+    errors = []
+    fields = {field: _cell_text(raw[field]) for field in TEXT_FIELDS if field in raw}
+    fields['id'] = _cell_text(raw.get('id'))
+    if not fields['id']:
+        errors.append('id manquant')
+    for field in REQUIRED_FIELDS:
+        if field in fields and not fields[field]:
+            errors.append(f'{field} manquante')
+
+    quantity = _cell_text(raw.get('quantity'))
+    if quantity:
+        try:
+            fields['quantity'] = int(float(quantity.replace(',', '.')))
+            if fields['quantity'] < 1 or fields['quantity'] != float(quantity.replace(',', '.')):
+                raise ValueError(quantity)
+        except ValueError:
+            errors.append(f'quantity invalide: {quantity}')
+
+    price = _cell_text(raw.get('prix_journalier'))
+    if price:
+        try:
+            fields['prix_journalier'] = float(price.replace(',', '.'))
+            if fields['prix_journalier'] < 0:
+                raise ValueError(price)
+        except ValueError:
+            errors.append(f'prix_journalier invalide: {price}')
+
+    for field, allowed in (('carburant', CARBURANTS), ('transmission', TRANSMISSIONS), ('status', STATUSES)):
+        value = _cell_text(raw.get(field))
+        if not value:
+            continue
+        fields[field] = value
+        if value not in allowed:
+            errors.append(f'{field} invalide: {value} (attendu: {", ".join(allowed)})')
+    return fields, errors
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []
+
+    def add_error(self, line, car_id, messages):
+        self.errors.append({'row': line, 'id': car_id, 'errors': messages})
+
+    def to_dict(self, max_errors=None):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'error_count': len(self.errors),
+            'errors': self.errors[:max_errors] if max_errors is not None else self.errors
+        }
+
+
+class CarImporter:
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, tracked_projection=None, on_batch=None):
+        # on_batch([(car before or None, car after)]) runs after each bulk_write with the cars it wrote;
+        # tracked_projection lists the fields the callback needs from existing cars
+        self.collection = collection
+        self.batch_size = max(1, batch_size)
+        self.tracked_projection = dict(tracked_projection or {}, id=1, quantite_totale=1, quantite_disponible=1)
+        self.on_batch = on_batch
+
+    def run(self, rows):
+        """Validate and upsert every (line, raw row); return an ImportReport"""
+        report = ImportReport()
+        seen = {}
+        batch = []
+        for line, raw in rows:
+            report.rows += 1
+            fields, errors = parse_row(raw)
+            if fields['id'] in seen:
+                errors.append(f'id en double (déjà à la ligne {seen[fields["id"]]})')
+            if errors:
+                report.add_error(line, fields['id'], errors)
+                continue
+            seen[fields['id']] = line
+            batch.append((line, fields))
+            if len(batch) >= self.batch_size:
+                self._write(batch, report)
+                batch = []
+        if batch:
+            self._write(batch, report)
+        return report
+
+    def _write(self, batch, report):
+        now = datetime.now()
+        # Tags the existing cars written by this batch, to tell which conditional updates matched
+        batch_id = ObjectId()
+        existing = {car['id']: car for car in self.collection.find({'id': {'$in': [fields['id'] for _, fields in batch]}},
+                                                                   self.tracked_projection)}
+        operations = []
+        changes = []
+        for line, fields in batch:
+            before = existing.get(fields['id'])
+            if before is None:
+                missing = [f'{field} manquante' for field in REQUIRED_FIELDS if field not in fields]
+                if missing:
+                    report.add_error(line, fields['id'], missing)
+                    continue
+                car = dict(NEW_CAR_DEFAULTS, **fields)
+                car.update(quantite_totale=car['quantity'], quantite_cassée=0, quantite_en_réparation=0,
+                           quantite_disponible=car['quantity'], image=None, created_at=now, updated_at=now)
+                operations.append(UpdateOne({'id': fields['id']}, {'$setOnInsert': car}, upsert=True))
+                changes.append((line, None, car))
+                continue
+            # Without a quantity column the counters are left as they are
+            difference = fields['quantity'] - (before.get('quantite_totale') or 0) if 'quantity' in fields else 0
+            available = before.get('quantite_disponible', before.get('quantite_totale', 0)) or 0
+            if available + difference < 0:
+                report.add_error(line, fields['id'], [
+                    f'quantity {fields["quantity"]} inférieure aux unités louées ou hors service'
+                ])
+                continue
+            update = {'$set': dict(fields, updated_at=now, import_batch=batch_id)}
+            after = dict(before, **update['$set'])
+            query = {'id': fields['id']}
+            if difference:
+                update['$inc'] = {'quantite_totale': difference, 'quantite_disponible': difference}
+                after['quantite_totale'] = (before.get('quantite_totale') or 0) + difference
+                after['quantite_disponible'] = available + difference
+            if difference < 0:
+                # Units may have been reserved since the lookup
+                query['quantite_disponible'] = {'$gte': -difference}
+            operations.append(UpdateOne(query, update))
+            changes.append((line, before, after))
+        if not operations:
+            return
+
+        failed = {}
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            upserted = set(result.upserted_ids)
+            matched_count = result.matched_count
+        except BulkWriteError as e:
+            upserted = {entry['index'] for entry in e.details.get('upserted', [])}
+            matched_count = e.details.get('nMatched', 0)
+            for error in e.details.get('writeErrors', []):
+                failed[error['index']] = error.get('errmsg', 'erreur d\'écriture')
+        raced = [index for index, (_, before, _) in enumerate(changes)
+                 if before is None and index not in failed and index not in upserted]
+        updated_ids = [after['id'] for index, (_, before, after) in enumerate(changes)
+                       if before is not None and index not in failed]
+        # A raced insert matched the existing car without changing it; it counts in matched_count too
+        if matched_count < len(updated_ids) + len(raced):
+            # Some cars were deleted, or had units reserved, between the lookup and the write
+            matched = {car['id'] for car in self.collection.find({'id': {'$in': updated_ids}, 'import_batch': batch_id}, {'id': 1})}
+        else:
+            matched = set(updated_ids)
+        written = []
+        for index, (line, before, after) in enumerate(changes):
+            if index in raced:
+                # The car was inserted by someone else between the lookup and the write: $setOnInsert
+                # left it untouched
+                failed[index] = 'id créé entre-temps par une autre écriture, ligne ignorée'
+            if before is not None and index not in failed and after['id'] not in matched:
+                failed[index] = 'voiture supprimée ou unités réservées entre-temps, ligne ignorée'
+            if index in failed:
+                report.add_error(line, after['id'], [failed[index]])
+                continue
+            written.append((before, after))
+            if before is None:
+                report.inserted += 1
+            else:
+                report.updated += 1
+        if self.on_batch and written:
+            self.on_batch(written)
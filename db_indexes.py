@@ -0,0 +1,112 @@
+"""
+Index declarations for the collections used by the routes, and a query-plan check.
+ensure_indexes() is called when the app starts; creating an index that already exists with the
+same keys and options is a no-op, so it is safe to run from every worker. Indexes keep the default
+generated names so that the ones already created by the setup scripts are recognised.
+"""
+
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], unique=True),
+    ],
+    'cars': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('designation', ASCENDING)]),
+        IndexModel([('status', ASCENDING), ('designation', ASCENDING)]),
+        IndexModel([('category', ASCENDING), ('designation', ASCENDING)]),
+        # Public catalog: equality filters, then the designation sort, then the ranges
+        IndexModel([('status', ASCENDING), ('category', ASCENDING), ('carburant', ASCENDING), ('transmission', ASCENDING),
+                    ('designation', ASCENDING), ('prix_journalier', ASCENDING), ('quantite_disponible', ASCENDING)]),
+        IndexModel([('updated_at', DESCENDING), ('created_at', DESCENDING)]),
+    ],
+    'rental_requests': [
+        IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('status', ASCENDING), ('created_at', DESCENDING)]),
+        IndexModel([('user_email', ASCENDING), ('created_at', DESCENDING)]),
+        IndexModel([('item_id', ASCENDING), ('created_at', DESCENDING)]),
+        IndexModel([('items.item_id', ASCENDING), ('created_at', DESCENDING)]),
+        IndexModel([('start_date', ASCENDING), ('end_date', ASCENDING)]),
+    ],
+    'report_jobs': [
+        IndexModel([('cache_key', ASCENDING), ('created_at', DESCENDING)]),
+    ],
+}
+
+# Representative query of each route: (route, collection, filter, sort)
+ROUTE_QUERIES = [
+    ('login / load_user', 'users', {'username': 'admin'}, None),
+    ('staff list', 'users', {'role': {'$ne': 'admin'}}, [('username', ASCENDING)]),
+    ('index', 'cars', {'status': {'$in': ['Disponible', 'Available']}, 'quantite_disponible': {'$gt': 0}}, [('designation', ASCENDING)]),
+    ('index (filtered)', 'cars',
+     {'status': {'$in': ['Disponible', 'Available']}, 'quantite_disponible': {'$gt': 0}, 'category': 'SUV',
+      'carburant': 'Diesel', 'transmission': 'Automatique', 'prix_journalier': {'$gte': 30, '$lte': 80}},
+     [('designation', ASCENDING)]),
+    ('inventory', 'cars', {}, [('designation', ASCENDING)]),
+    ('dashboard recent items', 'cars', {}, [('updated_at', DESCENDING), ('created_at', DESCENDING)]),
+    ('view_car / edit_car / delete_car', 'cars', {'id': 'CAR001'}, None),
+    ('available items API', 'cars', {'status': 'Disponible', 'quantite_disponible': {'$gt': 0}, 'category': 'SUV'},
+     [('designation', ASCENDING)]),
+    ('reservation car lookup', 'cars', {'id': {'$in': ['CAR001', 'CAR002']}}, None),
+    ('reservations (staff)', 'rental_requests', {'status': {'$nin': ['Rejected', 'Completed']}}, [('created_at', DESCENDING)]),
+    ('reservations (user)', 'rental_requests',
+     {'$and': [{'status': {'$nin': ['Rejected', 'Completed']}}, {'user_email': 'utilisateur'}]}, [('created_at', DESCENDING)]),
+    ('reservation history', 'rental_requests', {}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+    ('staff requests', 'rental_requests', {}, [('created_at', DESCENDING)]),
+    ('staff cars used', 'rental_requests', {'status': {'$in': ['Approved', 'Active']}}, [('start_date', DESCENDING)]),
+    ('occupancy calendar', 'rental_requests',
+     {'status': {'$ne': 'Rejected'}, 'start_date': {'$lt': datetime(2026, 2, 1)}, 'end_date': {'$gt': datetime(2026, 1, 1)}}, None),
+    ('availability index rebuild', 'rental_requests', {'status': {'$in': ['En attente', 'Pending', 'Approved', 'Active']}}, None),
+    ('view_car history (single item)', 'rental_requests', {'item_id': 'CAR001'}, [('created_at', DESCENDING)]),
+    ('view_car history (multi item)', 'rental_requests', {'items.item_id': 'CAR001'}, [('created_at', DESCENDING)]),
+    ('return_car', 'rental_requests',
+     {'$or': [{'item_id': 'CAR001', 'status': 'Approved'}, {'items.item_id': 'CAR001', 'status': 'Approved'}]}, None),
+    ('report job reuse', 'report_jobs',
+     {'cache_key': 'inventory', 'status': {'$in': ['pending', 'running', 'done']}}, [('created_at', DESCENDING)]),
+]
+
+
+def ensure_indexes(db):
+    """Create every declared index; return {collection: [index names]}"""
+    created = {}
+    for collection, models in INDEXES.items():
+        try:
+            created[collection] = db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # Typically an index with the same keys but other options (or duplicate keys for a
+            # unique index); report it and keep going with the other collections
+            print(f"Warning: could not create indexes on {collection}: {e}")
+    return created
+
+
+def _plan_stages(plan):
+    # Collect every stage name of a (possibly nested) winning plan
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for key in ('queryPlan', 'inputStage', 'inputStages', 'shards'):
+            if key in plan:
+                stages.extend(_plan_stages(plan[key]))
+        if 'winningPlan' in plan:
+            stages.extend(_plan_stages(plan['winningPlan']))
+    elif isinstance(plan, list):
+        for child in plan:
+            stages.extend(_plan_stages(child))
+    return stages
+
+
+def explain_route_queries(db):
+    """Explain every route query; return [(route, collection, stages)]"""
+    results = []
+    for route, collection, query, sort in ROUTE_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = cursor.explain()
+        results.append((route, collection, _plan_stages(explanation.get('queryPlanner', {}))))
+    return results
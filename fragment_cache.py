@@ -0,0 +1,126 @@
+"""
+Cache of rendered HTML fragments (catalog cards, inventory rows).
+Fragments are keyed by what they are rendered from (template, car id, updated_at, variant), so a
+write to a car naturally produces a new key and the old fragment simply ages out. Memory is bounded
+by the total size of the fragments; with a spill directory, fragments evicted from memory are kept
+on disk (also bounded) and read back instead of being rendered again.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    def __init__(self, max_bytes, spill_dir=None, max_disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir if spill_dir and max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self.bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._disk_entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.spill_dir, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.html')
+
+    def get_or_render(self, key, render):
+        """Return the fragment for key, calling render() only when it is neither in memory nor on disk"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            on_disk = key in self._disk_entries
+
+        html = self._read_spilled(key) if on_disk else None
+        with self._lock:
+            if html is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        if html is None:
+            html = render()
+        self._store(key, html)
+        return html
+
+    def _read_spilled(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            # Removed by another worker sharing the directory; render again
+            return None
+
+    def _store(self, key, html):
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                return
+            size = len(html.encode('utf-8'))
+            self._entries[key] = (html, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, (old_html, old_size) = self._entries.popitem(last=False)
+                self.bytes -= old_size
+                evicted.append((old_key, old_html, old_size))
+        if self.spill_dir:
+            for old_key, old_html, old_size in evicted:
+                self._spill(old_key, old_html, old_size)
+
+    def _spill(self, key, html, size):
+        path = self._path(key)
+        removed = []
+        with self._lock:
+            if key in self._disk_entries:
+                self._disk_entries.move_to_end(key)
+                return
+            self._disk_entries[key] = size
+            self.disk_bytes += size
+            while self.disk_bytes > self.max_disk_bytes and self._disk_entries:
+                old_key, old_size = self._disk_entries.popitem(last=False)
+                self.disk_bytes -= old_size
+                removed.append(old_key)
+        try:
+            # Write under a temporary name so other workers never read a partial fragment
+            partial_path = f'{path}.{os.getpid()}.part'
+            with open(partial_path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            os.replace(partial_path, path)
+        except OSError:
+            with self._lock:
+                if self._disk_entries.pop(key, None) is not None:
+                    self.disk_bytes -= size
+        for old_key in removed:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'disk_entries': len(self._disk_entries),
+                'disk_bytes': self.disk_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            }
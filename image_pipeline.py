@@ -0,0 +1,217 @@
+"""
+Image uploads and their derivatives.
+Uploads are streamed to disk in chunks (never read whole into memory), checked with Pillow, then
+stored under the sha256 of their content (<sha256>.<ext>): the same image uploaded for several cars
+is kept once, and a stored file never changes, so its URL can be cached forever.
+Each image is resized into WebP variants at a few widths plus one JPEG/PNG thumbnail for clients
+without WebP. Derivatives live next to the uploads in variants/, named after the source file:
+variants/<stem>-<width>w.webp and variants/<stem>-thumb.<jpg|png>. They are cached forever too, so
+a derivative is only ever written once; one already on disk is kept even if the encoder settings
+have changed since.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+from functools import partial
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+THUMBNAIL_WIDTH = 640
+VARIANTS_DIR = 'variants'
+WEBP_QUALITY = 80
+# Encoder effort (0-6): uploads encode every variant inside the request, and 6 takes several
+# times longer than 4 on large photos for a few percent smaller files
+WEBP_METHOD = 4
+CHUNK_SIZE = 64 * 1024
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+# <sha256>.<ext>, and the derivatives named after it
+CONTENT_ADDRESSED = re.compile(r'^(variants/)?[0-9a-f]{64}(-\d+w|-thumb)?\.[a-z0-9]+$')
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def is_content_addressed(path):
+    """True for a stored upload or derivative path named after the sha256 of its source"""
+    return bool(CONTENT_ADDRESSED.match(path))
+
+
+def stream_upload(stream, path, max_bytes=None):
+    """Copy a stream to path chunk by chunk; return its sha256 hex digest, raise UploadTooLarge past max_bytes"""
+    digest = hashlib.sha256()
+    written = 0
+    with open(path, 'wb') as f:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if max_bytes is not None and written > max_bytes:
+                raise UploadTooLarge()
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def verify_image(path):
+    """Return the Pillow format of the image at path; raise InvalidImage if it is not one"""
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            image.verify()
+    except Exception as e:
+        raise InvalidImage(str(e))
+    return image_format
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _resized(image, width):
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def variant_names(filename):
+    """Return ({nominal width: relative path of the WebP variant}, relative path of the thumbnail without extension)"""
+    stem = os.path.splitext(filename)[0]
+    webp = {width: f'{VARIANTS_DIR}/{stem}-{width}w.webp' for width in VARIANT_WIDTHS}
+    return webp, f'{VARIANTS_DIR}/{stem}-thumb'
+
+
+def _derivatives(upload_dir, filename):
+    # Yield (relative path, render() -> image, format, save options) for every derivative of upload_dir/filename
+    source_path = os.path.join(upload_dir, filename)
+    try:
+        with Image.open(source_path) as opened:
+            opened.load()
+            image = ImageOps.exif_transpose(opened)
+    except Exception as e:
+        raise InvalidImage(str(e))
+
+    alpha = _has_alpha(image)
+    image = image.convert('RGBA' if alpha else 'RGB')
+    webp, thumb = variant_names(filename)
+
+    for width in VARIANT_WIDTHS:
+        # Never upscale: the first width at or above the source size gets the source size, larger ones are skipped
+        yield webp[width], partial(_resized, image, width), 'WEBP', {'quality': WEBP_QUALITY, 'method': WEBP_METHOD}
+        if width >= image.width:
+            break
+
+    # The thumbnail comes last: once it exists, every derivative of the image has been written
+    if alpha:
+        yield thumb + '.png', partial(_resized, image, THUMBNAIL_WIDTH), 'PNG', {'optimize': True}
+    else:
+        yield thumb + '.jpg', partial(_resized, image, THUMBNAIL_WIDTH), 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}
+
+
+def generate_variants(upload_dir, filename):
+    """Write the missing derivatives of upload_dir/filename; return {relative path: size in bytes} of all of them"""
+    os.makedirs(os.path.join(upload_dir, VARIANTS_DIR), exist_ok=True)
+    written = {}
+    for path, render, image_format, options in _derivatives(upload_dir, filename):
+        # Its URL is cached as immutable: rewriting it would leave clients with the old bytes
+        if not os.path.exists(os.path.join(upload_dir, path)):
+            _save(render(), os.path.join(upload_dir, path), image_format, **options)
+        written[path] = os.path.getsize(os.path.join(upload_dir, path))
+    return written
+
+
+def estimate_variants(upload_dir, filename):
+    """Encode the derivatives of upload_dir/filename in memory; return {relative path: size in bytes}"""
+    sizes = {}
+    for path, render, image_format, options in _derivatives(upload_dir, filename):
+        buffer = BytesIO()
+        render().save(buffer, image_format, **options)
+        sizes[path] = buffer.tell()
+    return sizes
+
+
+def _save(image, path, image_format, **options):
+    # Write under a temporary name so a half-written derivative is never served
+    partial_path = path + '.part'
+    image.save(partial_path, image_format, **options)
+    os.replace(partial_path, path)
+
+
+def available_variants(upload_dir, filename):
+    """Return ([(nominal width, relative path)] of the WebP variants on disk, thumbnail relative path or None)"""
+    webp, thumb = variant_names(filename)
+    variants = [(width, path) for width, path in webp.items() if os.path.exists(os.path.join(upload_dir, path))]
+    for extension in ('.jpg', '.png'):
+        if os.path.exists(os.path.join(upload_dir, thumb + extension)):
+            return variants, thumb + extension
+    return variants, None
+
+
+def save_image_upload(stream, upload_dir, filename, max_bytes=None):
+    """Store an image stream under its content hash with its derivatives; return the stored file name"""
+    os.makedirs(upload_dir, exist_ok=True)
+    # The file only takes its final name once it is complete and known to be an image
+    partial_path = os.path.join(upload_dir, f'.upload-{uuid.uuid4().hex}.part')
+    try:
+        digest = stream_upload(stream, partial_path, max_bytes)
+        image_format = verify_image(partial_path)
+        extension = FORMAT_EXTENSIONS.get(image_format) or os.path.splitext(filename)[1].lstrip('.').lower()
+        stored_name = f'{digest}.{extension}'
+        stored_path = os.path.join(upload_dir, stored_name)
+        if not os.path.exists(stored_path):
+            os.replace(partial_path, stored_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    # An image already stored keeps its derivatives; they are only written when missing
+    if available_variants(upload_dir, stored_name)[1] is None:
+        generate_variants(upload_dir, stored_name)
+    return stored_name
+
+
+def store_existing_image(upload_dir, filename):
+    """Store a file already in upload_dir under its content hash; return the stored file name"""
+    with open(os.path.join(upload_dir, filename), 'rb') as f:
+        return save_image_upload(f, upload_dir, filename)
+
+
+def backfill_image(upload_dir, filename, dry_run=False):
+    """Generate (or with dry_run only estimate) the derivatives of one stored image; runs in a pool process"""
+    try:
+        source_bytes = os.path.getsize(os.path.join(upload_dir, filename))
+        sizes = estimate_variants(upload_dir, filename) if dry_run else generate_variants(upload_dir, filename)
+    except (OSError, InvalidImage) as e:
+        return {'image': filename, 'error': str(e)}
+    return {'image': filename, 'source_bytes': source_bytes, 'derivatives': sizes}
+
+
+def orphaned_uploads(upload_dir, referenced):
+    """Return [(relative path, size in bytes)] of the uploads and derivatives no referenced image owns"""
+    referenced = set(referenced)
+    owned = set(referenced)
+    for filename in referenced:
+        webp, thumb = variant_names(filename)
+        owned.update(webp.values())
+        owned.update((thumb + '.jpg', thumb + '.png'))
+
+    orphans = []
+    for directory in ('', VARIANTS_DIR):
+        full_directory = os.path.join(upload_dir, directory)
+        if not os.path.isdir(full_directory):
+            continue
+        for name in sorted(os.listdir(full_directory)):
+            path = f'{directory}/{name}' if directory else name
+            full_path = os.path.join(full_directory, name)
+            if os.path.isfile(full_path) and path not in owned and not name.endswith('.part'):
+                orphans.append((path, os.path.getsize(full_path)))
+    return orphans
@@ -0,0 +1,188 @@
+"""
+In-process publisher behind the live updates of the staff pages (Server-Sent Events).
+The write paths publish small events (a reservation created, reservations changing status, car
+quantities changing) and every open stream has its own bounded queue. Publishing never waits on a
+stream: a subscriber whose queue is full has fallen behind, it is dropped and told to reload.
+Recent events are kept so that a reconnecting stream gets what it missed (Last-Event-ID).
+The broker lives in one worker process and writes made by other workers do not go through it. Each
+event carries the data versions of the write; a stream follows them and, when the database version
+stays ahead of what it received for two heartbeats, tells the page to reload.
+"""
+
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+DEFAULT_MAX_SUBSCRIBERS = 100
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_REPLAY_SIZE = 1024
+RESYNC = 'resync'
+
+
+class BrokerFull(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, broker, queue_size, versions, missed):
+        self.broker = broker
+        self.queue = queue.Queue(queue_size)
+        self.dropped = False
+        # Highest version of each collection up to which every write was received
+        self.versions = dict(versions)
+        self._received = {name: set() for name in versions}
+        self._lagging = {}
+        self._missed = missed
+
+    def _note(self, versions):
+        for name, version in versions.items():
+            if name not in self.versions or version <= self.versions[name]:
+                continue
+            received = self._received[name]
+            received.add(version)
+            # Writes of one worker can be published out of order: advance over contiguous versions only
+            while self.versions[name] + 1 in received:
+                self.versions[name] += 1
+                received.discard(self.versions[name])
+
+    def _behind(self):
+        current = self.broker.current_versions()
+        behind = any(self.versions[name] < target for name, target in self._lagging.items())
+        self._lagging = {name: current[name] for name in self.versions if current.get(name, 0) > self.versions[name]}
+        return behind
+
+    def _event_id(self, sequence):
+        return '.'.join([f'{self.broker.stream_id}-{sequence}'] + [str(self.versions[name]) for name in self.broker.collections])
+
+    def _format(self, entry):
+        sequence, event, data, versions = entry
+        self._note(versions)
+        return format_event(event, data, self._event_id(sequence)) if event else ''
+
+    def stream(self, heartbeat):
+        """Yield text/event-stream chunks until the subscription is dropped or falls behind"""
+        if self._missed is None:
+            yield format_event(RESYNC, {})
+            return
+        for entry in self._missed:
+            chunk = self._format(entry)
+            if chunk:
+                yield chunk
+        self._missed = []
+        checked = time.monotonic()
+        while True:
+            if self.dropped:
+                yield format_event(RESYNC, {})
+                return
+            try:
+                chunk = self._format(self.queue.get(timeout=heartbeat))
+            except queue.Empty:
+                # Also lets the server notice a closed connection
+                chunk = ': keep-alive\n\n'
+            if time.monotonic() - checked >= heartbeat:
+                checked = time.monotonic()
+                if self._behind():
+                    yield format_event(RESYNC, {})
+                    return
+            if chunk:
+                yield chunk
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    def __init__(self, collections, current_versions, max_subscribers=DEFAULT_MAX_SUBSCRIBERS,
+                 queue_size=DEFAULT_QUEUE_SIZE, replay_size=DEFAULT_REPLAY_SIZE):
+        # current_versions() returns {collection: data version} as stored in the database
+        self.collections = tuple(collections)
+        self.current_versions = current_versions
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        # Event ids are "<stream id>-<sequence>.<version>...": ids handed out by another process,
+        # or before a restart, are recognised and cannot be replayed
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.sequence = 0
+        self.published = 0
+        self.dropped = 0
+        self._replay = deque(maxlen=replay_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event, data, versions):
+        """Send an event to every stream; versions is {collection: data version after the write}
+
+        With event None nothing reaches the pages, the streams only learn that the versions moved.
+        """
+        with self._lock:
+            self.sequence += 1
+            entry = (self.sequence, event, data, versions)
+            self._replay.append(entry)
+            self.published += 1
+            for subscription in list(self._subscribers):
+                try:
+                    subscription.queue.put_nowait(entry)
+                except queue.Full:
+                    subscription.dropped = True
+                    self._subscribers.discard(subscription)
+                    self.dropped += 1
+
+    def cursor(self):
+        """Return the event id a page rendered now resumes from"""
+        # Sequence first: a write landing in between is replayed rather than missed
+        with self._lock:
+            sequence = self.sequence
+        versions = self.current_versions()
+        return '.'.join([f'{self.stream_id}-{sequence}'] + [str(versions.get(name, 0)) for name in self.collections])
+
+    def subscribe(self, last_event_id=None):
+        """Open a stream resuming after last_event_id (a cursor or an event id)"""
+        parsed = self._parse(last_event_id) if last_event_id else None
+        versions = parsed[1] if parsed else self.current_versions()
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise BrokerFull()
+            if not last_event_id:
+                missed = []
+            elif parsed is None or parsed[0] > self.sequence:
+                missed = None
+            elif parsed[0] < self.sequence and (not self._replay or self._replay[0][0] > parsed[0] + 1):
+                # Older than the replay buffer
+                missed = None
+            else:
+                missed = [entry for entry in self._replay if entry[0] > parsed[0]]
+            subscription = Subscription(self, self.queue_size, versions, missed)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def _parse(self, event_id):
+        head, *versions = event_id.split('.')
+        stream_id, _, sequence = head.rpartition('-')
+        if stream_id != self.stream_id or not sequence.isdigit() or len(versions) != len(self.collections) \
+                or not all(version.isdigit() for version in versions):
+            return None
+        return int(sequence), {name: int(version) for name, version in zip(self.collections, versions)}
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'dropped': self.dropped,
+                'sequence': self.sequence
+            }
+
+
+def format_event(event, data, event_id=None):
+    """Return one event in the text/event-stream format"""
+    lines = [f'id: {event_id}'] if event_id else []
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, default=str)}')
+    return '\n'.join(lines) + '\n\n'
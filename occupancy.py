@@ -0,0 +1,58 @@
+"""
+Cars x days occupancy matrix for the staff calendar.
+Every reservation window becomes a +quantity / -quantity pair in a difference matrix (one row per
+car, one column per day); a cumulative sum along the days then gives the units booked per car and
+day, all in NumPy without a Python loop over days. A window occupies every day it overlaps.
+Rows are returned run-length encoded, [units, days, units, days, ...], which keeps a year of a
+mostly idle fleet down to a few numbers per car.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+DAY = np.timedelta64(1, 'D')
+
+
+def occupancy_matrix(car_ids, windows, start, days):
+    """Return the (cars x days) matrix of units booked per day from start (a date)
+
+    windows is an iterable of (car id, start datetime, end datetime, quantity); cars missing from
+    car_ids are ignored.
+    """
+    rows_of = {car_id: row for row, car_id in enumerate(car_ids)}
+    windows = [window for window in windows if window[0] in rows_of]
+    matrix = np.zeros((len(car_ids), days + 1), dtype=np.int32)
+    if not windows:
+        return matrix[:, :days]
+
+    car_column, starts, ends, quantities = zip(*windows)
+    rows = np.fromiter((rows_of[car_id] for car_id in car_column), dtype=np.intp, count=len(windows))
+    origin = np.datetime64(datetime.combine(start, datetime.min.time()), 'm')
+    first = (np.array(starts, dtype='datetime64[m]') - origin) // DAY
+    # The end is exclusive: a window ending at midnight does not occupy the next day
+    last = -((origin - np.array(ends, dtype='datetime64[m]')) // DAY)
+    quantities = np.array(quantities, dtype=np.int32)
+
+    visible = (last > 0) & (first < days)
+    rows, first, last, quantities = rows[visible], first[visible], last[visible], quantities[visible]
+    np.add.at(matrix, (rows, np.clip(first, 0, days)), quantities)
+    np.add.at(matrix, (rows, np.clip(last, 0, days)), -quantities)
+    return np.cumsum(matrix, axis=1, dtype=np.int32)[:, :days]
+
+
+def run_length_rows(matrix):
+    """Encode every row of matrix as [value, run length, value, run length, ...]"""
+    encoded = []
+    for row in matrix:
+        if not len(row):
+            encoded.append([])
+            continue
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(row)) + 1))
+        lengths = np.diff(np.append(starts, len(row)))
+        runs = np.empty(len(starts) * 2, dtype=np.int64)
+        runs[0::2] = row[starts]
+        runs[1::2] = lengths
+        encoded.append(runs.tolist())
+    return encoded
+
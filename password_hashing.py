@@ -0,0 +1,110 @@
+"""
+Password verification for the login route on a bounded process pool.
+bcrypt is CPU bound on purpose; running it in a few dedicated processes keeps a burst of logins
+from pinning the web workers. At most max_workers + max_pending verifications are in flight per
+web worker: beyond that check() raises HasherBusy at once instead of queueing without bound. A
+slot is held until its verification has really finished in the pool, even when the request gave
+up waiting for it. The pool processes are started from a fork server rather than forked from the
+threaded web worker, and a pool broken by a dead process is replaced on the next check.
+Hashes whose cost factor differs from the configured one are re-hashed after a successful check.
+"""
+
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _to_bytes(value):
+    # The setup scripts store hashes as bytes, the app as str
+    return value.encode('utf-8') if isinstance(value, str) else bytes(value)
+
+
+def hash_rounds(pw_hash):
+    """Return the cost factor of a bcrypt hash ($2b$<rounds>$...), or None if it is not one"""
+    try:
+        return int(_to_bytes(pw_hash).split(b'$')[2])
+    except (TypeError, IndexError, ValueError):
+        return None
+
+
+def _verify(pw_hash, password, rounds):
+    # Runs in a pool process; returns (valid, new hash when the cost factor changed)
+    pw_hash = _to_bytes(pw_hash)
+    password = _to_bytes(password)
+    try:
+        valid = hmac.compare_digest(bcrypt.hashpw(password, pw_hash), pw_hash)
+    except ValueError:
+        # Malformed hash, or a password bcrypt refuses (longer than 72 bytes)
+        return False, None
+    if valid and hash_rounds(pw_hash) != rounds:
+        return True, bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+    return valid, None
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, max_workers=2, max_pending=8, timeout=10):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _pool(self):
+        # Created lazily, and again after a fork, so every web worker owns its processes
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # Forking a process that runs other threads could hand the children locks held by them
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('forkserver')
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _discard_pool(self, executor):
+        # The next check starts a new pool; the failed checks of the broken one have released their slots
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, pw_hash, password):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        executor = self._pool()
+        try:
+            future = executor.submit(_verify, pw_hash, password, self.rounds)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard_pool(executor)
+            return None, executor
+        future.add_done_callback(lambda _: self._slots.release())
+        return future, executor
+
+    def check(self, pw_hash, password):
+        """Return (valid, new hash or None); raise HasherBusy when the pool is saturated"""
+        if not pw_hash:
+            return False, None
+        # A pool process that died breaks the whole pool: replace it and try once more
+        for _ in range(2):
+            future, executor = self._submit(pw_hash, password)
+            if future is None:
+                continue
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                future.cancel()
+                raise HasherBusy()
+            except BrokenProcessPool:
+                self._discard_pool(executor)
+        raise HasherBusy()
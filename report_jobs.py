@@ -0,0 +1,125 @@
+"""
+Background generation of report files (PDF / Excel).
+Jobs are recorded in the report_jobs collection so that any gunicorn worker can answer status
+and download requests; the rendering itself runs on a bounded thread pool in the worker that
+accepted the job. Finished files are reused while the data they were built from is unchanged.
+A job still pending or running after the timeout is taken for lost (its worker died or hung): it is
+marked failed and a new job replaces it. Files of failed jobs, and of finished jobs superseded by a
+newer file of the same report, are deleted.
+"""
+
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+
+class ReportJobQueue:
+    def __init__(self, collection, output_dir, max_workers=2, timeout=600):
+        self.collection = collection
+        self.output_dir = output_dir
+        self.timeout = timedelta(seconds=timeout)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report-job')
+
+    def submit(self, report_type, file_format, cache_key, render, filename, mimetype, requested_by=None):
+        """Queue a report and return its job document; render(path) writes the file"""
+        # A finished job with the same cache_key whose file still exists is reused,
+        # and so is a job for that key that is still pending or running within the timeout
+        existing = self.collection.find_one(
+            {'cache_key': cache_key, 'status': {'$in': ['pending', 'running', 'done']}},
+            sort=[('created_at', -1)]
+        )
+        if existing:
+            if existing['status'] == 'done':
+                if os.path.exists(existing.get('path', '')):
+                    return existing
+            elif datetime.now() - (existing.get('started_at') or existing['created_at']) <= self.timeout:
+                return existing
+            else:
+                self._fail(existing, 'Délai de génération dépassé')
+
+        job_id = ObjectId()
+        os.makedirs(self.output_dir, exist_ok=True)
+        job = {
+            '_id': job_id,
+            'report_type': report_type,
+            'format': file_format,
+            'cache_key': cache_key,
+            'status': 'pending',
+            'filename': filename,
+            'mimetype': mimetype,
+            'path': os.path.join(self.output_dir, f'{job_id}{os.path.splitext(filename)[1]}'),
+            'requested_by': requested_by,
+            'created_at': datetime.now()
+        }
+        self.collection.insert_one(job)
+        self._executor.submit(self._run, job, render)
+        return job
+
+    def get(self, job_id):
+        try:
+            return self.collection.find_one({'_id': ObjectId(job_id)})
+        except Exception:
+            return None
+
+    def _run(self, job, render):
+        # Every status change is guarded on the previous status: a job failed for its age stays failed
+        started = self.collection.update_one(
+            {'_id': job['_id'], 'status': 'pending'},
+            {'$set': {'status': 'running', 'started_at': datetime.now()}}
+        )
+        if not started.matched_count:
+            return
+        # Render into a temporary name so a half-written file is never served
+        partial_path = job['path'] + '.part'
+        try:
+            render(partial_path)
+            os.replace(partial_path, job['path'])
+            finished = self.collection.update_one(
+                {'_id': job['_id'], 'status': 'running'},
+                {'$set': {'status': 'done', 'finished_at': datetime.now(), 'size': os.path.getsize(job['path'])}}
+            )
+        except Exception as e:
+            traceback.print_exc()
+            self._fail(dict(job, status='running'), str(e))
+            return
+        if not finished.matched_count:
+            self._remove_files(job)
+            return
+        self._remove_replaced(job)
+
+    def _fail(self, job, error):
+        self.collection.update_one(
+            {'_id': job['_id'], 'status': job['status']},
+            {'$set': {'status': 'failed', 'finished_at': datetime.now(), 'error': error}}
+        )
+        self._remove_files(job)
+
+    def _remove_replaced(self, job):
+        """Delete the files of older finished jobs of the same report and format"""
+        replaced = list(self.collection.find({
+            'report_type': job['report_type'],
+            'format': job['format'],
+            'status': 'done',
+            'created_at': {'$lt': job['created_at']}
+        }))
+        if not replaced:
+            return
+        # Status first: a download that sees the job done finds its file
+        self.collection.update_many(
+            {'_id': {'$in': [old['_id'] for old in replaced]}, 'status': 'done'},
+            {'$set': {'status': 'replaced', 'replaced_by': job['_id']}}
+        )
+        for old in replaced:
+            self._remove_files(old)
+
+    @staticmethod
+    def _remove_files(job):
+        for path in (job.get('path'), job.get('path') and job['path'] + '.part'):
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,152 @@
+"""
+Tabular PDF rendering for the report exports.
+Column widths are fixed once from the column weights, cells are wrapped to their column and
+truncated after a few lines, and the header row is repeated on every page. Rows are drawn as
+they are read from the iterable, so the renderer never holds the whole report in memory.
+"""
+
+from reportlab.lib.pagesizes import letter, landscape
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+
+class PdfTableRenderer:
+    def __init__(self, output, title, columns, pagesize=landscape(letter), font='Helvetica',
+                 font_size=8, margin=30, max_lines=3):
+        # columns is a list of (header, weight); each column gets its share of the usable width
+        self.canvas = canvas.Canvas(output, pagesize=pagesize)
+        self.title = title
+        self.headers = [header for header, _ in columns]
+        self.width, self.height = pagesize
+        self.font = font
+        self.bold_font = f'{font}-Bold'
+        self.font_size = font_size
+        self.leading = font_size + 2
+        self.padding = 3
+        self.margin = margin
+        self.max_lines = max_lines
+        self.pages = 0
+
+        usable = self.width - 2 * margin
+        total_weight = sum(weight for _, weight in columns)
+        self.column_widths = [usable * weight / total_weight for _, weight in columns]
+        self.column_x = [margin]
+        for column_width in self.column_widths[:-1]:
+            self.column_x.append(self.column_x[-1] + column_width)
+        self._width_cache = {}
+        self.y = None
+        self._header_lines = self._wrap_row(self.headers, self.bold_font)
+
+    def _text_width(self, text, font):
+        key = (text, font)
+        width = self._width_cache.get(key)
+        if width is None:
+            width = stringWidth(text, font, self.font_size)
+            # Words repeat a lot across rows (statuses, categories, names); keep the cache bounded
+            if len(self._width_cache) < 50000:
+                self._width_cache[key] = width
+        return width
+
+    def _split_word(self, word, max_width, font):
+        # Hard-break a word that is wider than the column
+        parts = []
+        current = ''
+        for char in word:
+            if current and self._text_width(current + char, font) > max_width:
+                parts.append(current)
+                current = char
+            else:
+                current += char
+        if current:
+            parts.append(current)
+        return parts
+
+    def _truncate(self, line, max_width, font):
+        ellipsis = '...'
+        while line and self._text_width(line + ellipsis, font) > max_width:
+            line = line[:-1]
+        return line + ellipsis
+
+    def wrap(self, text, max_width, font=None):
+        """Return the lines of text that fit max_width, truncated to max_lines"""
+        font = font or self.font
+        lines = []
+        current = ''
+        space_width = self._text_width(' ', font)
+        current_width = 0
+        for word in str(text if text is not None else '').split():
+            word_width = self._text_width(word, font)
+            if current and current_width + space_width + word_width <= max_width:
+                current += ' ' + word
+                current_width += space_width + word_width
+                continue
+            if current:
+                lines.append(current)
+            if word_width > max_width:
+                pieces = self._split_word(word, max_width, font)
+                lines.extend(pieces[:-1])
+                current = pieces[-1]
+                current_width = self._text_width(current, font)
+            else:
+                current = word
+                current_width = word_width
+            if len(lines) > self.max_lines:
+                break
+        if current:
+            lines.append(current)
+
+        if len(lines) > self.max_lines:
+            lines = lines[:self.max_lines]
+            lines[-1] = self._truncate(lines[-1], max_width, font)
+        return lines or ['']
+
+    def _start_page(self):
+        if self.pages:
+            self._draw_footer()
+            self.canvas.showPage()
+        self.pages += 1
+        self.y = self.height - self.margin
+        if self.pages == 1:
+            self.canvas.setFont(self.bold_font, 16)
+            self.canvas.drawString(self.margin, self.y - 16, self.title)
+            self.y -= 30
+        self._draw_row(self._header_lines, self.bold_font, shaded=True)
+
+    def _draw_footer(self):
+        self.canvas.setFont(self.font, self.font_size)
+        self.canvas.drawRightString(self.width - self.margin, self.margin / 2, f'Page {self.pages}')
+
+    def _wrap_row(self, cells, font):
+        return [self.wrap(cell, width - 2 * self.padding, font) for cell, width in zip(cells, self.column_widths)]
+
+    def _row_height(self, wrapped):
+        return max(len(lines) for lines in wrapped) * self.leading + 2 * self.padding
+
+    def _draw_row(self, wrapped, font, shaded=False):
+        row_height = self._row_height(wrapped)
+        top = self.y
+        if shaded:
+            self.canvas.setFillGray(0.9)
+            self.canvas.rect(self.margin, top - row_height, self.width - 2 * self.margin, row_height, stroke=0, fill=1)
+            self.canvas.setFillGray(0)
+        self.canvas.setFont(font, self.font_size)
+        for x, lines in zip(self.column_x, wrapped):
+            text_y = top - self.padding - self.font_size
+            for line in lines:
+                self.canvas.drawString(x + self.padding, text_y, line)
+                text_y -= self.leading
+        self.canvas.setLineWidth(0.25)
+        self.canvas.line(self.margin, top - row_height, self.width - self.margin, top - row_height)
+        self.y = top - row_height
+
+    def render(self, rows):
+        """Draw every row, starting a new page (with the header repeated) when a row does not fit"""
+        self._start_page()
+        for row in rows:
+            wrapped = self._wrap_row(row, self.font)
+            if self.y - self._row_height(wrapped) < self.margin:
+                self._start_page()
+            self._draw_row(wrapped, self.font)
+        self._draw_footer()
+        self.canvas.save()
+        return self.pages
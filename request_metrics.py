@@ -0,0 +1,153 @@
+"""
+Per-route request timing and MongoDB command instrumentation.
+The Flask hooks open a record per request; the pymongo CommandListener adds every command issued
+by the same thread to it. Finished requests are aggregated into in-process histograms (one set per
+web worker) rendered in the Prometheus text format, and optionally logged as one JSON line each.
+Commands issued outside a request (CLI commands, report threads) are counted under route "-".
+"""
+
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+NO_ROUTE = '-'
+
+logger = logging.getLogger('request_metrics')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestMetrics:
+    def __init__(self, log_requests=False):
+        self.log_requests = log_requests
+        if log_requests and not logger.handlers:
+            logger.addHandler(logging.StreamHandler())
+            logger.setLevel(logging.INFO)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._sizes = {}
+        self._commands_per_request = {}
+        self._requests = {}
+        self._commands = {}
+
+    # Request side, called from the Flask hooks
+    def start_request(self):
+        self._local.current = {'started': time.perf_counter(), 'commands': {}}
+
+    def finish_request(self, route, method, status, size):
+        """Close the record of the current request; return it, or None if none was started"""
+        record = getattr(self._local, 'current', None)
+        if record is None:
+            return None
+        self._local.current = None
+        duration = time.perf_counter() - record['started']
+        command_count = sum(count for count, _ in record['commands'].values())
+        with self._lock:
+            key = (route, method)
+            self._latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self._commands_per_request.setdefault(key, Histogram(COMMAND_COUNT_BUCKETS)).observe(command_count)
+            if size is not None:
+                self._sizes.setdefault(key, Histogram(SIZE_BUCKETS)).observe(size)
+            status_key = (route, method, status)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            for command, (count, seconds) in record['commands'].items():
+                self._add_commands(route, command, count, seconds)
+
+        entry = {
+            'route': route,
+            'method': method,
+            'status': status,
+            'duration_ms': round(duration * 1000, 2),
+            'response_bytes': size,
+            'mongo_commands': command_count,
+            'mongo_ms': round(sum(seconds for _, seconds in record['commands'].values()) * 1000, 2),
+        }
+        if self.log_requests:
+            logger.info(json.dumps(entry))
+        return entry
+
+    # Command side, called from the listener in the thread that issued the command
+    def record_command(self, command, seconds):
+        record = getattr(self._local, 'current', None)
+        if record is not None:
+            count, total = record['commands'].get(command, (0, 0.0))
+            record['commands'][command] = (count + 1, total + seconds)
+        else:
+            with self._lock:
+                self._add_commands(NO_ROUTE, command, 1, seconds)
+
+    def _add_commands(self, route, command, count, seconds):
+        count_before, seconds_before = self._commands.get((route, command), (0, 0.0))
+        self._commands[(route, command)] = (count_before + count, seconds_before + seconds)
+
+    def render_prometheus(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self._lock:
+            lines = []
+            self._render_histograms(lines, 'http_request_duration_seconds', 'Request latency per route.', self._latency)
+            self._render_histograms(lines, 'http_response_size_bytes', 'Response body size per route.', self._sizes)
+            self._render_histograms(lines, 'http_request_mongo_commands', 'MongoDB commands issued per request.',
+                                    self._commands_per_request)
+            lines.append('# HELP http_requests_total Requests per route and status.')
+            lines.append('# TYPE http_requests_total counter')
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append(f'http_requests_total{{{_labels(route=route, method=method, status=status)}}} {count}')
+            lines.append('# HELP mongo_commands_total MongoDB commands per route and command.')
+            lines.append('# TYPE mongo_commands_total counter')
+            for (route, command), (count, _) in sorted(self._commands.items()):
+                lines.append(f'mongo_commands_total{{{_labels(route=route, command=command)}}} {count}')
+            lines.append('# HELP mongo_command_duration_seconds_total Time spent in MongoDB commands per route and command.')
+            lines.append('# TYPE mongo_command_duration_seconds_total counter')
+            for (route, command), (_, seconds) in sorted(self._commands.items()):
+                lines.append(f'mongo_command_duration_seconds_total{{{_labels(route=route, command=command)}}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histograms(lines, name, description, histograms):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for (route, method), histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{_labels(route=route, method=method, le=bound)}}} {cumulative}')
+            lines.append(f'{name}_sum{{{_labels(route=route, method=method)}}} {histogram.sum:g}')
+            lines.append(f'{name}_count{{{_labels(route=route, method=method)}}} {histogram.count}')
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.metrics.record_command(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.metrics.record_command(event.command_name, event.duration_micros / 1e6)
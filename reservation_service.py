@@ -0,0 +1,423 @@
+"""
+Reservation state machine.
+Every transition (approve, reject, delete, return) reads the reservation and the cars it references,
+checks that the transition is allowed from the current status, then writes the reservation and all
+the car quantity changes together inside one transaction; the car changes of a transition go out as
+a single bulk_write. Transient transaction errors are retried by the driver (with_transaction).
+Transactions need a replica set or a sharded cluster: on a standalone server the same steps run
+without one.
+Approvals and rejections can also run on many reservations at once: they are loaded with one $in,
+checked one after the other against the car quantities left by the previous ones, and written with
+one bulk_write on rental_requests (each update guarded by the status it was checked against) and one
+on cars (one update per car, summed) for the reservations that matched.
+Without a transaction the reservations are written first and the cars one by one, so that a failed
+quantity guard can be undone: the cars already updated and the reservations are put back.
+"""
+
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+
+PENDING_STATUSES = ('En attente', 'Pending')
+ACTIVE_STATUSES = ('Approved', 'Active')
+# Counter incremented on the car for each status a returned unit can come back with
+RETURN_COUNTERS = {
+    'Disponible': 'quantite_disponible',
+    'Cassée': 'quantite_cassée',
+    'En réparation': 'quantite_en_réparation',
+    'Indisponible': 'quantite_indisponible',
+    'Nécessite une réparation': 'quantite_en_réparation',
+    'Perdue': 'quantite_perdue'
+}
+CAR_PROJECTION = {
+    '_id': 0, 'id': 1, 'status': 1, 'condition': 1, 'quantite_totale': 1, 'quantite_disponible': 1,
+    'quantite_cassée': 1, 'quantite_en_réparation': 1, 'quantite_indisponible': 1, 'quantite_perdue': 1
+}
+
+
+class TransitionError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def reservation_lines(reservation):
+    """Return [(item_id, quantity)] for a multi-item or single-item (legacy) reservation"""
+    if 'items' in reservation:
+        return [(item.get('item_id'), item.get('quantity', 1)) for item in reservation.get('items') or [] if item.get('item_id')]
+    if reservation.get('item_id'):
+        return [(reservation['item_id'], reservation.get('quantity', 1))]
+    return []
+
+
+def holds_units(reservation):
+    # Multi-item requests take their units when created; single-item (legacy) ones when approved
+    if 'items' in reservation:
+        return reservation.get('status') in PENDING_STATUSES + ACTIVE_STATUSES
+    return reservation.get('status') in ACTIVE_STATUSES
+
+
+def _merge_lines(lines):
+    # One entry per car so that each car gets a single update in the bulk_write
+    merged = {}
+    for item_id, quantity in lines:
+        merged[item_id] = merged.get(item_id, 0) + quantity
+    return merged
+
+
+def _apply_update(car, update):
+    # Replay a planned car update on the in-memory copy used to check the next reservations
+    for field, value in update.get('$inc', {}).items():
+        car[field] = (car.get(field) or 0) + value
+    car.update(update.get('$set', {}))
+
+
+def _merge_update(merged, condition, update):
+    # Fold one planned car update into the single update sent for that car: $inc values add up,
+    # the last $set wins, and the quantity guards add up to the total taken
+    merged_condition, merged_update = merged
+    for field, value in update.get('$inc', {}).items():
+        merged_update.setdefault('$inc', {})
+        merged_update['$inc'][field] = merged_update['$inc'].get(field, 0) + value
+    merged_update.setdefault('$set', {}).update(update.get('$set', {}))
+    for field, guard in condition.items():
+        merged_condition.setdefault(field, {'$gte': 0})
+        merged_condition[field]['$gte'] += guard['$gte']
+
+
+def _undo_update(car, update):
+    # Inverse of a car update applied to car: the $inc values negated, the $set fields put back
+    undo = {'$inc': {field: -value for field, value in update.get('$inc', {}).items()}}
+    restored = {field: car[field] for field in update.get('$set', {}) if field in car}
+    if restored:
+        undo['$set'] = restored
+    return undo
+
+
+def _release_update(quantity, now):
+    return {'$inc': {'quantite_disponible': quantity}, '$set': {'status': 'Disponible', 'updated_at': now}}
+
+
+class ReservationService:
+    def __init__(self, client, db, on_cars_changed=None, on_committed=None):
+        # on_cars_changed(car_writes, session) runs inside the transaction with [(car before, update)];
+        # on_committed(action, [reservations as they were before], [cars as they are after, for the cars
+        # it changed]) runs once the transition is durable
+        self.client = client
+        self.db = db
+        self.on_cars_changed = on_cars_changed
+        self.on_committed = on_committed
+        self._transactions = None
+
+    def supports_transactions(self):
+        if self._transactions is None:
+            try:
+                hello = self.db.command('hello')
+            except Exception:
+                try:
+                    hello = self.db.command('isMaster')
+                except Exception:
+                    hello = {}
+            self._transactions = bool(hello.get('setName') or hello.get('msg') == 'isdbgrid')
+        return self._transactions
+
+    def approve(self, reservation_id, approved_by):
+        return self._run('approve', reservation_id, self._approve_plan(approved_by))
+
+    def approve_many(self, reservation_ids, approved_by):
+        return self._run_many('approve', reservation_ids, self._approve_plan(approved_by))
+
+    def _approve_plan(self, approved_by):
+        def plan(reservation, cars):
+            if reservation.get('status') not in PENDING_STATUSES:
+                raise TransitionError('Seules les réservations en attente peuvent être approuvées')
+            now = datetime.now()
+            car_updates = []
+            if not holds_units(reservation):
+                # Single-item request (legacy): units are taken on approval
+                for item_id, quantity in _merge_lines(reservation_lines(reservation)).items():
+                    car = cars.get(item_id)
+                    if not car:
+                        raise TransitionError('Voiture non trouvée', 404)
+                    available = car.get('quantite_disponible', car.get('quantite_totale', 1))
+                    if quantity > available:
+                        raise TransitionError(f'Pas assez d\'unités disponibles. Demandé: {quantity}, Disponible: {available}')
+                    update = {'$inc': {'quantite_disponible': -quantity}, '$set': {'updated_at': now}}
+                    if available - quantity <= 0:
+                        update['$set']['status'] = 'Indisponible'
+                    car_updates.append((item_id, {'quantite_disponible': {'$gte': quantity}}, update))
+            reservation_update = {'$set': {'status': 'Approved', 'approved_by': approved_by, 'approved_at': now}}
+            return car_updates, reservation_update
+
+        return plan
+
+    def reject(self, reservation_id, rejected_by):
+        return self._run('reject', reservation_id, self._reject_plan(rejected_by))
+
+    def reject_many(self, reservation_ids, rejected_by):
+        return self._run_many('reject', reservation_ids, self._reject_plan(rejected_by))
+
+    def _reject_plan(self, rejected_by):
+        def plan(reservation, cars):
+            if reservation.get('status') not in PENDING_STATUSES:
+                raise TransitionError('Seules les réservations en attente peuvent être rejetées')
+            now = datetime.now()
+            car_updates = []
+            if holds_units(reservation):
+                # Restore quantities for all items in the reservation
+                for item_id, quantity in _merge_lines(reservation_lines(reservation)).items():
+                    if item_id in cars:
+                        car_updates.append((item_id, {}, _release_update(quantity, now)))
+            reservation_update = {'$set': {'status': 'Rejected', 'rejected_by': rejected_by, 'rejected_at': now}}
+            return car_updates, reservation_update
+
+        return plan
+
+    def delete(self, reservation_id, authorize=None):
+        def plan(reservation, cars):
+            if authorize:
+                authorize(reservation)
+            now = datetime.now()
+            car_updates = []
+            # If reservation is pending, restore quantities
+            if reservation.get('status') in PENDING_STATUSES and holds_units(reservation):
+                for item_id, quantity in _merge_lines(reservation_lines(reservation)).items():
+                    if item_id in cars:
+                        car_updates.append((item_id, {}, _release_update(quantity, now)))
+            return car_updates, None
+
+        return self._run('delete', reservation_id, plan)
+
+    def mark_returned(self, reservation_id, status_selections):
+        def plan(reservation, cars):
+            if reservation.get('status') not in ACTIVE_STATUSES:
+                raise TransitionError('Seules les réservations approuvées peuvent être retournées')
+            now = datetime.now()
+            if 'items' in reservation:
+                selections = {s.get('item_id'): s.get('status') for s in status_selections}
+            else:
+                # Single-item reservation (legacy): the first selection applies
+                selections = {reservation.get('item_id'): status_selections[0].get('status')}
+
+            returned = {}
+            for item_id, quantity in reservation_lines(reservation):
+                new_status = selections.get(item_id)
+                # Items without a status selection, or whose car is gone, are left untouched
+                if new_status not in RETURN_COUNTERS or item_id not in cars:
+                    continue
+                returned.setdefault((item_id, new_status), 0)
+                returned[(item_id, new_status)] += quantity
+
+            car_updates = []
+            for (item_id, new_status), quantity in returned.items():
+                car_updates.append((item_id, {}, {
+                    '$inc': {RETURN_COUNTERS[new_status]: quantity},
+                    '$set': {'status': new_status, 'updated_at': now}
+                }))
+            reservation_update = {'$set': {'status': 'Completed', 'returned_at': now}}
+            return car_updates, reservation_update
+
+        if not status_selections:
+            raise TransitionError('Aucune sélection de statut fournie')
+        return self._run('return', reservation_id, plan)
+
+    def return_item(self, reservation_id, item_id, new_status, notes=None):
+        """Take back the units of one car of an approved reservation; the reservation is completed
+        once all its cars are back"""
+        def plan(reservation, cars):
+            if reservation.get('status') not in ACTIVE_STATUSES:
+                raise TransitionError('Seules les réservations approuvées peuvent être retournées')
+            if item_id not in cars:
+                raise TransitionError('Voiture non trouvée', 404)
+            now = datetime.now()
+            items = reservation.get('items')
+            if items:
+                lines = [index for index, item in enumerate(items)
+                         if item.get('item_id') == item_id and item.get('status') != 'Completed']
+                if not lines:
+                    raise TransitionError('Aucune utilisation active trouvée pour cette voiture')
+                quantity = sum(items[index].get('quantity', 1) for index in lines)
+                fields = {f'items.{index}.status': 'Completed' for index in lines}
+                if all(index in lines or item.get('status') == 'Completed' for index, item in enumerate(items)):
+                    fields.update(status='Completed', returned_at=now)
+            else:
+                quantity = reservation.get('quantity', 1)
+                fields = {'status': 'Completed', 'returned_at': now}
+            car_fields = {'status': new_status, 'updated_at': now}
+            if notes:
+                car_fields['notes'] = notes
+            car_update = {'$inc': {RETURN_COUNTERS[new_status]: quantity}, '$set': car_fields}
+            return [(item_id, {}, car_update)], {'$set': fields}
+
+        if new_status not in RETURN_COUNTERS:
+            raise TransitionError('Statut de retour invalide')
+        return self._run('return_item', reservation_id, plan)
+
+    def _update_cars(self, updates, cars, session):
+        """Apply {car id: (quantity guards, update)}; raise 409, with no car changed, if a guard fails"""
+        if not updates:
+            return
+        if session is not None:
+            operations = [UpdateOne(dict({'id': item_id}, **condition), update) for item_id, (condition, update) in updates.items()]
+            result = self.db.cars.bulk_write(operations, ordered=True, session=session)
+            if result.matched_count != len(operations):
+                # A conditional decrement lost a race; the transaction is aborted
+                raise TransitionError('Les quantités ont changé entre-temps, veuillez réessayer', 409)
+            return
+        # Without a transaction each car is written on its own, so that the ones already done can be undone
+        done = []
+        for item_id, (condition, update) in updates.items():
+            if self.db.cars.update_one(dict({'id': item_id}, **condition), update).matched_count:
+                done.append((item_id, update))
+                continue
+            for done_id, done_update in done:
+                self.db.cars.update_one({'id': done_id}, _undo_update(cars[done_id], done_update))
+            raise TransitionError('Les quantités ont changé entre-temps, veuillez réessayer', 409)
+
+    def _run(self, action, reservation_id, plan):
+        outcome = {}
+
+        def transition(session):
+            reservation = self.db.rental_requests.find_one({'_id': reservation_id}, session=session)
+            if not reservation:
+                raise TransitionError('Réservation non trouvée', 404)
+            item_ids = sorted({item_id for item_id, _ in reservation_lines(reservation)})
+            cars = {}
+            if item_ids:
+                cars = {car['id']: car for car in self.db.cars.find({'id': {'$in': item_ids}}, CAR_PROJECTION, session=session)}
+
+            car_updates, reservation_update = plan(reservation, cars)
+
+            # The reservation goes first, guarded by the state the plan was checked against: a concurrent
+            # transition of the same reservation matches nothing instead of moving the units twice
+            guard = {'_id': reservation_id, 'status': reservation.get('status')}
+            if 'items' in reservation:
+                guard['items'] = reservation['items']
+            if reservation_update is None:
+                written = self.db.rental_requests.delete_one(guard, session=session).deleted_count
+            else:
+                written = self.db.rental_requests.update_one(guard, reservation_update, session=session).matched_count
+            if not written:
+                raise TransitionError('La réservation a changé entre-temps, veuillez réessayer', 409)
+
+            merged = {}
+            for item_id, condition, update in car_updates:
+                _merge_update(merged.setdefault(item_id, ({}, {})), condition, update)
+            try:
+                self._update_cars(merged, cars, session)
+            except TransitionError:
+                if session is None:
+                    # Put the reservation back as it was read
+                    if reservation_update is None:
+                        self.db.rental_requests.insert_one(reservation)
+                    else:
+                        self.db.rental_requests.replace_one({'_id': reservation_id}, reservation)
+                raise
+            if self.on_cars_changed:
+                self.on_cars_changed([(cars[item_id], update) for item_id, (_, update) in merged.items()], session)
+
+            changed = {}
+            for item_id, (_, update) in merged.items():
+                _apply_update(changed.setdefault(item_id, dict(cars[item_id])), update)
+            outcome['reservation'] = reservation
+            outcome['car_updates'] = len(merged)
+            outcome['cars'] = list(changed.values())
+
+        if self.supports_transactions():
+            with self.client.start_session() as session:
+                session.with_transaction(
+                    transition,
+                    read_concern=ReadConcern('snapshot'),
+                    write_concern=WriteConcern('majority')
+                )
+        else:
+            transition(None)
+
+        if self.on_committed:
+            self.on_committed(action, [outcome['reservation']], outcome['cars'])
+        return outcome
+
+    def _run_many(self, action, reservation_ids, plan):
+        """Apply one transition to many reservations; return {reservation id: None or TransitionError}"""
+        outcome = {}
+        reservation_ids = list(dict.fromkeys(reservation_ids))
+
+        def transition(session):
+            results = {}
+            reservations = {r['_id']: r for r in self.db.rental_requests.find({'_id': {'$in': list(reservation_ids)}}, session=session)}
+            item_ids = sorted({item_id for r in reservations.values() for item_id, _ in reservation_lines(r)})
+            cars = {}
+            if item_ids:
+                cars = {car['id']: car for car in self.db.cars.find({'id': {'$in': item_ids}}, CAR_PROJECTION, session=session)}
+            # Each reservation is checked against the quantities left by the ones before it
+            current = {item_id: dict(car) for item_id, car in cars.items()}
+            planned = []
+            for reservation_id in reservation_ids:
+                reservation = reservations.get(reservation_id)
+                if not reservation:
+                    results[reservation_id] = TransitionError('Réservation non trouvée', 404)
+                    continue
+                try:
+                    car_updates, reservation_update = plan(reservation, current)
+                except TransitionError as e:
+                    results[reservation_id] = e
+                    continue
+                for item_id, _, update in car_updates:
+                    _apply_update(current[item_id], update)
+                planned.append((reservation, car_updates, reservation_update))
+
+            committed = []
+            matched = set()
+            if planned:
+                # The batch id tells which guarded updates matched; a reservation moved by another
+                # reviewer meanwhile is left out, which only leaves more units to the others
+                batch_id = ObjectId()
+                self.db.rental_requests.bulk_write([
+                    UpdateOne({'_id': reservation['_id'], 'status': reservation.get('status')},
+                              dict(reservation_update, **{'$set': dict(reservation_update['$set'], batch_id=batch_id)}))
+                    for reservation, _, reservation_update in planned
+                ], ordered=False, session=session)
+                matched = {r['_id'] for r in self.db.rental_requests.find({'batch_id': batch_id}, {'_id': 1}, session=session)}
+            merged = {}
+            for reservation, car_updates, _ in planned:
+                if reservation['_id'] not in matched:
+                    results[reservation['_id']] = TransitionError('La réservation a changé entre-temps, veuillez réessayer', 409)
+                    continue
+                for item_id, condition, update in car_updates:
+                    _merge_update(merged.setdefault(item_id, ({}, {})), condition, update)
+                committed.append(reservation)
+                results[reservation['_id']] = None
+
+            try:
+                self._update_cars(merged, cars, session)
+            except TransitionError:
+                if session is None and committed:
+                    self.db.rental_requests.bulk_write([ReplaceOne({'_id': r['_id']}, r) for r in committed], ordered=False)
+                raise
+            if self.on_cars_changed and committed:
+                self.on_cars_changed([(cars[item_id], update) for item_id, (_, update) in merged.items()], session)
+
+            changed = {}
+            for item_id, (_, update) in merged.items():
+                _apply_update(changed.setdefault(item_id, dict(cars[item_id])), update)
+            outcome['results'] = results
+            outcome['committed'] = committed
+            outcome['cars'] = list(changed.values())
+
+        if self.supports_transactions():
+            with self.client.start_session() as session:
+                session.with_transaction(
+                    transition,
+                    read_concern=ReadConcern('snapshot'),
+                    write_concern=WriteConcern('majority')
+                )
+        else:
+            transition(None)
+
+        if self.on_committed and outcome['committed']:
+            self.on_committed(action, outcome['committed'], outcome['cars'])
+        return outcome['results']
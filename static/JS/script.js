@@ -492,3 +492,76 @@ if (editItemForm) {
         }
     });
 }
+
+// Live updates of a staff table from the Server-Sent Events stream (/api/staff/events)
+// Rows named by an event are fetched again one by one; the server answers 204 for a row that no
+// longer belongs to the table. A "resync" event means updates were missed: the page is reloaded.
+function connectLiveTable(options) {
+    if (!window.EventSource || !options.eventsUrl) {
+        return null;
+    }
+    const tbody = document.getElementById(options.tableBodyId);
+    const source = new EventSource(options.eventsUrl);
+
+    function findRow(id) {
+        return tbody.querySelector(`tr[${options.rowAttribute}="${id}"]`);
+    }
+
+    function updateCount() {
+        const counter = document.getElementById(options.countId);
+        if (counter) {
+            counter.textContent = tbody.querySelectorAll(`tr[${options.rowAttribute}]`).length;
+        }
+    }
+
+    function refreshRow(id) {
+        fetch(options.rowUrl(id), { credentials: 'same-origin' })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.status === 204 ? '' : response.text();
+            })
+            .then(html => {
+                const current = findRow(id);
+                if (!html) {
+                    if (current) current.remove();
+                } else {
+                    const template = document.createElement('template');
+                    template.innerHTML = html.trim();
+                    const row = template.content.firstElementChild;
+                    if (current) {
+                        current.replaceWith(row);
+                    } else {
+                        // New rows go first, like the newest ones when the page is rendered
+                        tbody.querySelectorAll('tr.empty-row').forEach(empty => empty.remove());
+                        tbody.prepend(row);
+                    }
+                }
+                updateCount();
+                if (options.onChange) options.onChange();
+            })
+            .catch(error => console.error('Live update failed:', error));
+    }
+
+    (options.reservationEvents || ['reservation_created', 'reservation_status', 'reservation_deleted']).forEach(name => {
+        source.addEventListener(name, event => {
+            JSON.parse(event.data).reservations.forEach(reservation => refreshRow(reservation.id));
+        });
+    });
+
+    source.addEventListener('car_changed', event => {
+        JSON.parse(event.data).cars.forEach(car => {
+            tbody.querySelectorAll(`[data-available-car="${car.id}"]`).forEach(cell => {
+                cell.textContent = car.quantite_disponible ?? 0;
+            });
+        });
+    });
+
+    source.addEventListener('resync', () => {
+        source.close();
+        location.reload();
+    });
+
+    return source;
+}
@@ -0,0 +1,76 @@
+"""
+Test fixtures: the app runs against the MongoDB database named by TEST_MONGO_URI.
+Without a reachable server the tests fall back to mongomock when it is installed and are skipped
+otherwise. Every test starts from empty collections.
+"""
+
+import os
+import sys
+
+import pytest
+
+TEST_MONGO_URI = os.environ.get('TEST_MONGO_URI', 'mongodb://localhost:27017/voiture_de_location_test')
+
+os.environ['MONGO_URI'] = TEST_MONGO_URI
+os.environ.setdefault('ENSURE_INDEXES', 'False')
+os.environ.setdefault('REQUEST_LOG', 'False')
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _connect():
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+    client = MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+        return client, client.get_default_database()
+    except PyMongoError:
+        client.close()
+    try:
+        import mongomock
+    except ImportError:
+        pytest.skip(f'no MongoDB server at {TEST_MONGO_URI} and mongomock is not installed')
+    client = mongomock.MongoClient()
+    return client, client['voiture_de_location_test']
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app as app_module
+    client, db = _connect()
+    app_module.mongo.cx = client
+    app_module.mongo.db = db
+    app_module.report_jobs.collection = db.report_jobs
+    app_module.reservation_service.client = client
+    app_module.reservation_service.db = db
+    app_module.app.config['TESTING'] = True
+    yield app_module
+    client.close()
+
+
+@pytest.fixture
+def db(app_module):
+    database = app_module.mongo.db
+    for name in database.list_collection_names():
+        database[name].delete_many({})
+    app_module.data_version_cache.invalidate()
+    app_module.car_lookup_cache.invalidate()
+    app_module.user_cache.invalidate()
+    app_module.availability_index.invalidate()
+    return database
+
+
+@pytest.fixture
+def make_user(app_module, db):
+    def make_user(username, role='utilisateur', password='secret'):
+        db.users.insert_one({
+            'username': username,
+            'password': app_module.bcrypt.generate_password_hash(password).decode(),
+            'role': role
+        })
+        client = app_module.app.test_client()
+        response = client.post('/login', data={'username': username, 'password': password})
+        assert response.status_code == 302
+        return client
+    return make_user
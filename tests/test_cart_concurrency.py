@@ -0,0 +1,77 @@
+"""Simultaneous carts on one car never take more units than it has"""
+
+import threading
+from datetime import datetime
+
+CART = {'start_date': '2030-01-01T10:00', 'end_date': '2030-01-03T10:00', 'purpose': 'stress'}
+STOCK = 10
+CARTS = 40
+
+
+def seed_car(db, stock):
+    now = datetime.now()
+    db.cars.insert_one({
+        'id': 'CAR001', 'designation': 'Clio', 'category': 'Citadine', 'status': 'Disponible',
+        'condition': 'Bon état', 'quantite_totale': stock, 'quantite_disponible': stock,
+        'quantite_cassée': 0, 'quantite_en_réparation': 0, 'created_at': now, 'updated_at': now
+    })
+
+
+def fire_carts(clients, quantities):
+    barrier = threading.Barrier(len(clients))
+    statuses = [None] * len(clients)
+
+    def post(index):
+        barrier.wait()
+        response = clients[index].post('/api/create-reservation', json=dict(
+            CART, items=[{'item_id': 'CAR001', 'quantity': quantities[index]}]
+        ))
+        statuses[index] = response.status_code
+
+    threads = [threading.Thread(target=post, args=(index,)) for index in range(len(clients))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def test_simultaneous_carts_never_oversell(db, make_user):
+    seed_car(db, STOCK)
+    clients = [make_user(f'user{index}') for index in range(CARTS)]
+    quantities = [1 + index % 3 for index in range(CARTS)]
+
+    statuses = fire_carts(clients, quantities)
+
+    assert set(statuses) <= {200, 400}
+    accepted = sum(quantity for quantity, status in zip(quantities, statuses) if status == 200)
+    booked = sum(item['quantity'] for reservation in db.rental_requests.find() for item in reservation['items'])
+    car = db.cars.find_one({'id': 'CAR001'})
+    assert accepted == booked
+    assert 0 < accepted <= STOCK
+    assert car['quantite_disponible'] == STOCK - accepted >= 0
+    assert car['status'] == ('Indisponible' if car['quantite_disponible'] == 0 else 'Disponible')
+
+
+def test_taking_the_last_units_is_one_car_write(app_module, db, make_user, monkeypatch):
+    seed_car(db, 2)
+    client = make_user('user0')
+    assert app_module.fleet_stats()['available'] == 1
+    writes = []
+    collection_class = type(db.cars)
+    find_one_and_update = collection_class.find_one_and_update
+
+    def counting(collection, *args, **kwargs):
+        if collection.name == 'cars':
+            writes.append(args[0])
+        return find_one_and_update(collection, *args, **kwargs)
+
+    monkeypatch.setattr(collection_class, 'find_one_and_update', counting)
+    response = client.post('/api/create-reservation', json=dict(CART, items=[{'item_id': 'CAR001', 'quantity': 2}]))
+    monkeypatch.undo()
+
+    assert response.status_code == 200
+    assert len(writes) == 1
+    car = db.cars.find_one({'id': 'CAR001'})
+    assert (car['quantite_disponible'], car['status']) == (0, 'Indisponible')
+    assert (app_module.fleet_stats()['available'], app_module.fleet_stats()['unavailable']) == (0, 1)